@@ -2,6 +2,7 @@ import argparse as arg
 from solar.cli.query import make_q_parser
 from solar.cli.service import make_s_parser
 from solar.cli.visual import make_v_parser
+from solar.cli.report import make_r_parser
 import sys
 
 
@@ -18,4 +19,5 @@ def make_parser():
     make_q_parser(command_parser)
     make_s_parser(command_parser)
     make_v_parser(command_parser)
+    make_r_parser(command_parser)
     return root_parser
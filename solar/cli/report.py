@@ -0,0 +1,26 @@
+from datetime import datetime, timedelta
+from solar.service.telemetry import latency_report, print_report
+
+
+def parse_r(args):
+    since = datetime.now() - timedelta(days=args.days) if args.days else None
+    print_report(latency_report(args.service, since))
+
+
+def make_r_parser(command_parser):
+    report_parser = command_parser.add_parser(
+        "report", help="Report the latency and throughput of the service requests"
+    )
+    report_parser.add_argument(
+        "-s",
+        "--service",
+        help="Only report requests of this type",
+        choices=["hek", "cutout", "local_cutout"],
+    )
+    report_parser.add_argument(
+        "-d",
+        "--days",
+        type=float,
+        help="Only report requests created in the last DAYS days",
+    )
+    report_parser.set_defaults(func=parse_r)
@@ -1,24 +1,22 @@
 from solar.service.hek import Hek_Service
-from solar.service.cutout import Cutout_Service
+from solar.service.cutout import Cutout_Service, resume_cutouts
 from solar.database.tables.service_request import Service_Request
 from solar.database.tables.hek_event import Hek_Event
 import re
-import peewee as pw
 
 query_re = re.compile("([a-zA-Z1-9_]+)\s*=\s*([a-zA-Z1-9_-]+)")
 
 
-def grab_save(req, action, save_data, save_request):
-    if action == "submit":
+def grab_save(req, action, save_data, save_request, incremental=False):
+    if action == "submit" and incremental:
+        req.submit_request(incremental=True)
+    elif action == "submit":
         req.submit_request()
     elif action == "fetch":
         req.fetch_data()
-    if req.data and save_data:
-        for x in req.data:
-            try:
-                x.save()
-            except pw.IntegrityError as e:
-                pass
+    # A search that found no events still saves the time ranges it covered
+    if save_data and (req.data or getattr(req, "covered", None)):
+        req.save_data()
     if save_request:
         req.save_request()
 
@@ -62,7 +60,9 @@ def parse_cutout_event(search, action, save_data=False, save_request=False):
     grab_save(c, action, save_data, save_request)
 
 
-def parse_hek_exist(search, action, save_data=False, save_request=False):
+def parse_hek_exist(
+    search, action, save_data=False, save_request=False, incremental=False
+):
     hek = Service_Request.select().where(
         (Service_Request.service_type == "hek")
         & ((Service_Request.id % search) | (Service_Request.job_id % f"%{search}%"))
@@ -78,7 +78,7 @@ def parse_hek_exist(search, action, save_data=False, save_request=False):
     h = Hek_Service._from_model(hek.get())
     print("I will use the request")
     print(h)
-    grab_save(h, action, save_data, save_request)
+    grab_save(h, action, save_data, save_request, incremental)
 
 
 def parse_cutout_params(param_dict, action, save_data=False, save_request=False):
@@ -86,22 +86,35 @@ def parse_cutout_params(param_dict, action, save_data=False, save_request=False)
     grab_save(c, action, save_data, save_request)
 
 
-def parse_hek_params(param_dict, action, save_data=False, save_request=False):
+def parse_hek_params(
+    param_dict, action, save_data=False, save_request=False, incremental=False
+):
     h = Hek_Service(**param_dict)
-    grab_save(h, action, save_data, save_request)
+    grab_save(h, action, save_data, save_request, incremental)
 
 
 def parse_s(args):
     serv = args.service
+    if args.resume:
+        if serv != "cutout":
+            print("Only cutout requests can be resumed")
+            return None
+        resume_cutouts(save_data=args.save_data)
+        return None
     act = "fetch" if args.fetch else "submit"
     save_dat = args.save_data
     save_req = args.save_request
     event = args.event if args.event else None
+    incremental = args.incremental
     if args.search:
         search_pattern = args.search
         if serv == "hek":
             parse_hek_exist(
-                search_pattern, act, save_data=save_dat, save_request=save_req
+                search_pattern,
+                act,
+                save_data=save_dat,
+                save_request=save_req,
+                incremental=incremental,
             )
         elif serv == "cutout":
             if not event:
@@ -119,7 +132,13 @@ def parse_s(args):
             param: val for param, val in [query_re.search(q).groups() for q in params]
         }
         if serv == "hek":
-            parse_hek_params(query_dict, act, save_data=save_dat, save_request=save_req)
+            parse_hek_params(
+                query_dict,
+                act,
+                save_data=save_dat,
+                save_request=save_req,
+                incremental=incremental,
+            )
         elif serv == "cutout":
             parse_cutout_params(
                 query_dict, act, save_data=save_dat, save_request=save_req
@@ -168,6 +187,11 @@ def make_s_parser(command_parser):
         action="store_true",
         help="Attempt to fetch data from a request. If the request has not been submitted, this command will first submit the request.\n Note that this may take some time and will block.",
     )
+    group2.add_argument(
+        "--resume",
+        action="store_true",
+        help="For cutout requests, fetch the data of every saved request that was submitted but never completed, without submitting them again.",
+    )
 
     service_parser.add_argument(
         "-w", "--save-data", action="store_true", help="Save the data from the request"
@@ -186,4 +210,10 @@ def make_s_parser(command_parser):
         help="If submitting a cutout request, look for an existing solar event matching the parameter (as opposed to a cutout request), and create a cutout request using that event",
     )
 
+    service_parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="For hek requests, only search the time ranges that have not already been searched by a saved request with the same parameters",
+    )
+
     service_parser.set_defaults(func=parse_s)
@@ -54,3 +54,87 @@ class Config(metaclass=ConfMeta):
     )
     time_format = Map(hek="%Y-%m-%dT%H:%M:%S", fits="%Y-%m-%dT%H:%M:%S.%f")
     chatty = True
+
+    # Number of rows per insert, and number of keys per IN query, for the bulk database operations
+    bulk = Map(insert_chunk=100, select_chunk=900)
+
+    # Connection pooling, timeouts (in seconds) and retries for the shared http session.
+    # Failed requests are retried with exponential backoff, and requests to a host are refused for
+    # breaker_reset seconds after breaker_threshold consecutive failures.
+    # Each client keeps the timings of its last max_timings requests.
+    http = Map(
+        pool_size=20,
+        connect_timeout=10,
+        timeout=60,
+        retries=4,
+        backoff=1.0,
+        max_backoff=60,
+        breaker_threshold=5,
+        breaker_reset=120,
+        max_timings=10000,
+    )
+    # Concurrency for the hek interval requests. The number of requests in flight is reduced
+    # when the latency of a request exceeds latency_factor times the fastest request seen.
+    # The time range is requested in windows of interval_days, which are split when they reach
+    # result_limit events, and lengthened (up to max_interval_days) when they come back sparse.
+    # Events are reported to HEK with some delay, so the last settle_days before a request are never marked as covered.
+    # When streaming, responses are read stream_chunk bytes at a time and at most stream_buffer parsed events are held in memory.
+    # The ids of the last stream_seen events are remembered to drop the events returned by two neighbouring windows.
+    hek = Map(
+        max_workers=5,
+        min_workers=1,
+        latency_factor=3.0,
+        interval_days=60,
+        max_interval_days=360,
+        min_interval_hours=1,
+        result_limit=500,
+        settle_days=2,
+        stream_chunk=64 * 1024,
+        stream_buffer=1000,
+        stream_seen=100000,
+    )
+    # A cutout job is abandoned after max_poll_failures consecutive failed status checks, or once it
+    # is older than deadline seconds. A job is checked again after backoff times its age, clamped
+    # between min_delay and max_delay seconds, using at most poll_workers concurrent http calls.
+    cutout = Map(
+        max_poll_failures=5,
+        poll_workers=10,
+        min_delay=10,
+        max_delay=300,
+        backoff=0.1,
+        deadline=12 * 3600,
+        # Smallest field of view of a cutout, and largest field of view of a cutout covering several events (arcsec)
+        min_fov=120,
+        coalesce_fov=600,
+        # The bounding box of an event is padded by fov_padding times its size, and the field of view
+        # is capped at max_fov_pix pixels of plate_scale arcsec (None for no cap). Changing them changes the
+        # parameters of new requests, which then no longer match the requests already made for the same events.
+        fov_padding=0,
+        max_fov_pix=None,
+        plate_scale=0.6,
+        # Target time between frames in seconds, and largest number of frames per request (None for no limit)
+        cadence=24,
+        frame_budget=None,
+    )
+    # Concurrent downloads: at most max_concurrency transfers, per_host of them to the same host, a total of
+    # bandwidth bytes per second (None for no limit), reading chunk_size bytes at a time.
+    # backend is "async" (needs aiohttp), "threads", or "auto" to use async when aiohttp is installed.
+    download = Map(
+        max_concurrency=32,
+        per_host=8,
+        bandwidth=None,
+        chunk_size=64 * 1024,
+        backend="auto",
+    )
+    # Local full-disk files used by Local_Cutout_Service, searched recursively under db_save/path
+    # for names matching pattern, and cropped by workers threads
+    local_cutout = Map(path="full_disk", pattern="*.f*ts", workers=8)
+    # Content addressed store of the downloaded files, under db_save/path. When enabled, identical files
+    # are hard links to a single copy, and files whose checksum is known are linked instead of downloaded again.
+    blob_store = Map(enabled=False, path="blobs")
+    # At rest format of the downloaded fits files. When enabled, files are rewritten tile compressed, losslessly:
+    # integer images with the integer algorithm, floating point images with the float one (which must be a GZIP variant).
+    compression = Map(enabled=False, integer="RICE_1", float="GZIP_2")
+    # On disk cache of the service responses, stored under db_save/path. Entries older than ttl seconds
+    # are ignored, and the least recently used entries are removed once the cache is larger than max_size bytes.
+    cache = Map(enabled=False, path="cache", ttl=24 * 3600, max_size=512 * 1024 ** 2)
@@ -0,0 +1,109 @@
+"""
+Reading and writing fits files that may be stored tile compressed (see ``Config.compression``).
+
+Compressed files hold the image in a ``CompImageHDU`` after an empty primary hdu. The functions here read them
+as if they were the original, uncompressed files.
+"""
+
+import os
+import numpy as np
+from pathlib import Path
+from astropy.io import fits
+from sunpy.map import Map
+from solar.common.config import Config
+
+# Header keywords of an image extension, that the original primary hdu did not have
+_extension_keys = ["xtension", "pcount", "gcount"]
+
+
+def image_hdu(hdul):
+    """
+    :return: The first hdu containing a 2d image (full-disk AIA files are usually tile compressed, with the image in the second hdu)
+    """
+    for hdu in hdul:
+        if hdu.is_image and hdu.header.get("NAXIS") == 2:
+            return hdu
+    raise ValueError(f"No image in {hdul.filename()}")
+
+
+def is_compressed(path):
+    """
+    :param path: The fits file
+    :type path: Union[str, Path]
+    :return: Whether the image of the file is tile compressed
+    :rtype: bool
+    """
+    with fits.open(path) as hdul:
+        return isinstance(image_hdu(hdul), fits.CompImageHDU)
+
+
+def read_map(path):
+    """
+    Load a fits file as a sunpy map. The map of a compressed file has the same data and header as the map of the original file.
+
+    :param path: The fits file
+    :type path: Union[str, Path]
+    :return: The map
+    :rtype: sunpy.map.GenericMap
+    """
+    m = Map(path)
+    if is_compressed(path):
+        for key in _extension_keys:
+            m.meta.pop(key, None)
+        m.meta["simple"] = True
+    return m
+
+
+def fits_size(path):
+    """
+    The size the file would have uncompressed. This is the size of the file itself for uncompressed files.
+
+    :param path: The fits file
+    :type path: Union[str, Path]
+    :return: The size in bytes
+    :rtype: int
+    """
+    with fits.open(path) as hdul:
+        hdu = image_hdu(hdul)
+        if not isinstance(hdu, fits.CompImageHDU):
+            return os.path.getsize(path)
+        header = hdu.header
+        data = abs(header["BITPIX"]) // 8 * int(
+            np.prod([header[f"NAXIS{i}"] for i in range(1, header["NAXIS"] + 1)])
+        )
+        # Both the header and the data are padded to a multiple of 2880 bytes
+        return len(header.tostring()) + -(-data // 2880) * 2880
+
+
+def compress_fits(path, dest=None):
+    """
+    Rewrite a fits file as a tile compressed file. The compression is lossless: integer images use
+    ``Config.compression.integer`` (RICE_1 by default), floating point images ``Config.compression.float``
+    (GZIP_2 by default) without quantization.
+
+    :param path: The fits file
+    :type path: Union[str, Path]
+    :param dest: Where to write the compressed file, defaults to None (replace the file)
+    :type dest: Union[str, Path], optional
+    :return: Whether the file was compressed, False if it already was
+    :rtype: bool
+    """
+    p = Path(path)
+    dest = Path(dest) if dest else p
+    tmp = dest.with_name(dest.name + ".tmp")
+    with fits.open(p, do_not_scale_image_data=True) as hdul:
+        hdu = image_hdu(hdul)
+        if isinstance(hdu, fits.CompImageHDU):
+            return False
+        if hdu.data.dtype.kind == "f":
+            options = dict(
+                compression_type=Config.compression.float, quantize_level=0.0
+            )
+        else:
+            options = dict(compression_type=Config.compression.integer)
+        compressed = fits.CompImageHDU(
+            hdu.data, hdu.header, do_not_scale_image_data=True, **options
+        )
+        fits.HDUList([fits.PrimaryHDU(), compressed]).writeto(tmp, overwrite=True)
+    os.replace(tmp, dest)
+    return True
@@ -1,10 +1,60 @@
 import solar.database.tables as tb
 from .database import database as db
+from playhouse.migrate import SqliteMigrator, migrate
+import copy
 
 
-def create_tables():
-    """Function create_tables: Create the tables for the database
+def create_tables(tables=None):
+    """Function create_tables: Create the tables for the database.
+    Tables that already exist are migrated with :func:`add_missing_columns` instead, since creating their indexes
+    before their new columns exist would fail.
+
+    :param tables: The models, defaults to all the tables
+    :type tables: List[Type[Base_Model]]
     :returns: None
     :type return: None
     """
-    db.create_tables(tb.tables)
+    tables = tables if tables else tb.tables
+    database = tables[0]._meta.database
+    existing = set(database.get_tables())
+    database.create_tables(
+        [t for t in tables if t._meta.table_name not in existing]
+    )
+    add_missing_columns([t for t in tables if t._meta.table_name in existing])
+
+
+def add_missing_columns(tables):
+    """Function add_missing_columns: Add the columns that were added to the models after their tables were created, so that existing databases keep working.
+    New columns must either be nullable or have a default.
+
+    :param tables: The models to check
+    :type tables: List[Type[Base_Model]]
+    :returns: The names of the columns that were added
+    :type return: List[str]
+    """
+    added = []
+    for table in tables:
+        database = table._meta.database
+        name = table._meta.table_name
+        existing = {c.name for c in database.get_columns(name)}
+        missing = [f for f in table._meta.sorted_fields if f.column_name not in existing]
+        if missing:
+            migrator = SqliteMigrator(database)
+            with database.atomic():
+                # The columns are added without their indexes, which are only created once the columns exist
+                migrate(
+                    *[
+                        migrator.add_column(name, f.column_name, _without_index(f))
+                        for f in missing
+                    ]
+                )
+                table._schema.create_indexes(safe=True)
+            added.extend(f"{name}.{f.column_name}" for f in missing)
+    return added
+
+
+def _without_index(field):
+    field = copy.copy(field)
+    field.unique = False
+    field.index = False
+    return field
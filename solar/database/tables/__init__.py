@@ -3,6 +3,11 @@ from .service_request import Service_Request, Service_Parameter, Service_Paramet
 from .fits_file import Fits_File, Fits_Header_Elem, Fits_Header_Elem_List
 from .visual_file import Visual_File
 from .join_vis_fit import Join_Visual_Fits
+from .coverage import Service_Coverage
+from .join_event_fit import Join_Event_Fits
+from .service_stage import Service_Stage
+from .file_blob import File_Blob, File_Blob_Link
+from .join_request_event import Join_Request_Event
 
 # from .ucol import List_Storage
 
@@ -17,4 +22,10 @@ tables = [
     Fits_Header_Elem_List,
     Visual_File,
     Join_Visual_Fits,
+    Service_Coverage,
+    Join_Event_Fits,
+    Service_Stage,
+    File_Blob,
+    File_Blob_Link,
+    Join_Request_Event,
 ]
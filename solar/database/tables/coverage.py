@@ -0,0 +1,26 @@
+import peewee as pw
+from .base_models import Base_Model
+from .service_request import Service_Request
+
+
+class Service_Coverage(Base_Model):
+    """
+    A time range that has been completely searched by a service request.
+
+    Requests whose parameters (ignoring the time range) are the same share a param_hash,
+    which allows a new request to only search the time ranges that have not been covered yet.
+    """
+
+    #: Foreign key to the request that searched this range
+    service_request = pw.ForeignKeyField(Service_Request, backref="coverage")
+
+    #: Hash of the parameters of the request, excluding the time range
+    param_hash = pw.CharField(index=True)
+
+    #: Start of the covered range
+    start_time = pw.DateTimeField()
+    #: End of the covered range
+    end_time = pw.DateTimeField()
+
+    def __repr__(self) -> str:
+        return f"<Service_Coverage: {self.start_time} -- {self.end_time}>"
@@ -0,0 +1,181 @@
+import os
+import shutil
+import peewee as pw
+from pathlib import Path
+from solar.common.config import Config
+from solar.common.utils import checksum
+from solar.database.utils import dbroot
+from .base_models import Base_Model
+
+
+def _same_file(a, b):
+    try:
+        return os.path.samefile(a, b)
+    except OSError:
+        return False
+
+
+def _link(source, dest):
+    """
+    Replace dest by a hard link to source. Falls back to a copy when a link cannot be made (for example across file systems).
+    """
+    dest = Path(dest)
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dest.with_name(dest.name + ".link")
+    try:
+        os.link(source, tmp)
+    except OSError:
+        shutil.copy2(source, tmp)
+    os.replace(tmp, dest)
+
+
+class File_Blob(Base_Model):
+    """
+    A file in the content addressed store, which keeps a single copy of identical files.
+
+    The blob of a file is stored under ``Config.blob_store.path``, named after its checksum, and the files
+    with this content (the ``file_path`` of the :class:`~solar.database.tables.fits_file.Fits_File` rows) are hard links to it.
+    Each file stored is recorded in :class:`File_Blob_Link`, so that the blob is only removed when the last of them is released,
+    even if some of them were modified or deleted in the meantime.
+    The store must be on the same file system as the files, otherwise the files are copies of the blobs and nothing is saved.
+    """
+
+    #: The checksum of the content
+    digest = pw.CharField(unique=True)
+
+    #: The size of the content in bytes
+    size = pw.IntegerField(default=0)
+
+    #: The number of files linked to the blob
+    refs = pw.IntegerField(default=0)
+
+    def __repr__(self) -> str:
+        return f"<File_Blob: {self.digest} ({self.refs} refs)>"
+
+    @property
+    def blob_path(self) -> Path:
+        """
+        :return: Where the content is stored
+        :rtype: Path
+        """
+        return dbroot(Config.blob_store.path) / self.digest[:2] / self.digest
+
+    @staticmethod
+    def store(path, digest):
+        """
+        Add a file to the store. If the store already has this content, the file is replaced by a link to the existing blob,
+        otherwise the file becomes the blob.
+
+        :param path: The file
+        :type path: Union[str, Path]
+        :param digest: The checksum of the file
+        :type digest: str
+        :return: The blob
+        :rtype: File_Blob
+        """
+        with File_Blob._meta.database.atomic():
+            blob, _ = File_Blob.get_or_create(digest=digest)
+            if not _same_file(blob.blob_path, path):
+                if blob.blob_path.is_file():
+                    _link(blob.blob_path, path)
+                else:
+                    _link(path, blob.blob_path)
+                    blob.size = blob.blob_path.stat().st_size
+                    blob.save()
+            blob._add_link(path)
+        return blob
+
+    @staticmethod
+    def fetch(digest, path):
+        """
+        Create a file as a link to the blob with a given checksum, if the store has one.
+        This is used instead of downloading a file whose content is already known.
+
+        Since the files are hard links to their blob, a file modified in place also modifies the blob.
+        The checksum of the blob is therefore checked first, and a blob that does not match is dropped.
+
+        :param digest: The checksum of the content
+        :type digest: str
+        :param path: The file to create
+        :type path: Union[str, Path]
+        :return: Whether the file was restored from the store. False if the store does not have the content, or if the file already is a link to it.
+        :rtype: bool
+        """
+        blob = File_Blob.get_or_none(File_Blob.digest == digest)
+        if not blob:
+            return False
+        if not blob.is_valid():
+            blob.blob_path.unlink(missing_ok=True)
+            blob.delete_instance(recursive=True)
+            return False
+        if _same_file(blob.blob_path, path):
+            return False
+        _link(blob.blob_path, path)
+        with File_Blob._meta.database.atomic():
+            blob._add_link(path)
+        return True
+
+    def is_valid(self):
+        """
+        :return: Whether the blob exists and still has its checksum
+        :rtype: bool
+        """
+        return self.blob_path.is_file() and checksum(self.blob_path) == self.digest
+
+    @staticmethod
+    def release(path):
+        """
+        Delete a file. If it was stored, the blob it was stored in is deleted once no other file is linked to it.
+
+        :param path: The file
+        :type path: Union[str, Path]
+        """
+        p = Path(path)
+        if p.is_file():
+            p.unlink()
+        link = File_Blob_Link.get_or_none(File_Blob_Link.file_path == str(p))
+        if link is None:
+            return
+        with File_Blob._meta.database.atomic():
+            link.delete_instance()
+            File_Blob.get_by_id(link.blob_id)._count_refs()
+
+    def _add_link(self, path):
+        """
+        Record that a file is linked to this blob, instead of the blob it was linked to before, if any
+        """
+        key = str(Path(path))
+        old = File_Blob_Link.get_or_none(File_Blob_Link.file_path == key)
+        if old is not None and old.blob_id == self.id:
+            return
+        if old is not None:
+            old.delete_instance()
+            File_Blob.get_by_id(old.blob_id)._count_refs()
+        File_Blob_Link.create(blob=self, file_path=key)
+        self._count_refs()
+
+    def _count_refs(self):
+        """
+        Update the number of files linked to the blob, and delete the blob once there are none
+        """
+        self.refs = self.links.count()
+        if self.refs > 0:
+            self.save()
+            return
+        self.blob_path.unlink(missing_ok=True)
+        self.delete_instance()
+
+
+class File_Blob_Link(Base_Model):
+    """
+    A file stored in a blob. The row is kept until the file is released, whether or not the file is still a link to the blob.
+    """
+
+    #: The blob
+    blob = pw.ForeignKeyField(File_Blob, backref="links", on_delete="CASCADE")
+
+    #: The path of the file
+    file_path = pw.CharField(unique=True)
+
+    def __repr__(self) -> str:
+        return f"<File_Blob_Link: {self.file_path} -> {self.blob_id}>"
@@ -4,16 +4,19 @@ from solar.common.config import Config
 from datetime import datetime
 from solar.service.downloads import multi_downloader, download_single_file
 from pathlib import Path
-from sunpy.map import Map
 from .base_models import File_Model
 from .ucol import UnionCol, List_Storage
 from .hek_event import Hek_Event
 from tqdm import tqdm
 from typing import Any, Dict
 from .service_request import Service_Request
+from .service_stage import Service_Stage
+from .file_blob import File_Blob
 import shutil
 from solar.database.utils import dbformat, dbroot
-from solar.common.utils import into_number
+from solar.common.utils import checksum, into_number
+from solar.common.fits_io import compress_fits, read_map
+import os
 
 
 class Fits_File(File_Model):
@@ -44,6 +47,9 @@ class Fits_File(File_Model):
     #: The image time in the fits header
     image_time = pw.DateTimeField(default=None, null=True)
 
+    #: The wavelength of the image in angstrom, parsed from the name of the file on the server
+    channel = pw.IntegerField(null=True)
+
     def __repr__(self) -> str:
         return f"<fits_instance:{self.sol_standard}|{self.file_path}>"
 
@@ -82,9 +88,18 @@ Hash            = {self.file_hash}
         If integrity check fails, attempt to fetch and update a single fits file.
         """
         if not self.check_integrity():
+            if Config.blob_store.enabled and File_Blob.fetch(
+                self.file_hash, self.file_path
+            ):
+                return
             if self.server_full_path:
-                download_single_file(self.server_full_path, self.file_path)
-                self.get_hash()
+                self._store_downloaded(
+                    download_single_file(self.server_full_path, self.file_path)
+                )
+                if self.request_id and self._request_complete():
+                    Service_Stage.record(
+                        [(self.request_id, "downloaded", datetime.now())]
+                    )
                 self.extract_fits_data()
                 self.image_time = datetime.strptime(
                     self["date-obs"], Config.time_format.fits
@@ -100,6 +115,13 @@ Hash            = {self.file_hash}
         :type update_headers: bool, optional
         """
         bad_files = [x for x in Fits_File.select() if not x.check_integrity()]
+        if Config.blob_store.enabled:
+            # Files whose content is already in the store are linked instead of downloaded
+            missing = len(bad_files)
+            bad_files = [
+                x for x in bad_files if not File_Blob.fetch(x.file_hash, x.file_path)
+            ]
+            print(f"Restored {missing - len(bad_files)} files from the blob store")
         gettable = [x for x in bad_files if x.server_full_path]
         gettable_urls = {f.server_full_path: f.file_path for f in gettable}
         print(f"Found {len(bad_files)} missing/corrupted files")
@@ -107,9 +129,27 @@ Hash            = {self.file_hash}
         print(
             f"The remaining {len(bad_files) - len(gettable)} files cannot be retrieved automatically"
         )
-        multi_downloader(gettable_urls)
+        digests = multi_downloader(gettable_urls)
         for f in bad_files:
-            f.get_hash()
+            if f.server_full_path in digests:
+                # The checksum was computed while downloading
+                f._store_downloaded(digests[f.server_full_path])
+            elif Path(f.file_path).is_file():
+                f.get_hash()
+        # A request is only downloaded once all of its files are
+        incomplete = {
+            f.request_id for f in bad_files if f.server_full_path not in digests
+        }
+        downloaded_at = datetime.now()
+        Service_Stage.record(
+            (req, "downloaded", downloaded_at)
+            for req in {
+                f.request_id
+                for f in gettable
+                if f.request_id and f.server_full_path in digests
+            }
+            - incomplete
+        )
 
         num_rows = Fits_File.select().count()
         if update_headers:
@@ -121,12 +161,64 @@ Hash            = {self.file_hash}
 
         print(f"Update complete")
 
+    def _request_complete(self):
+        """
+        :return: Whether the other files of the request of this file are all on disk
+        :rtype: bool
+        """
+        others = Fits_File.select(Fits_File.file_path).where(
+            Fits_File.request == self.request_id, Fits_File.id != self.id
+        )
+        return all(f.file_path and Path(f.file_path).is_file() for f in others)
+
+    def _store_downloaded(self, digest):
+        """
+        Put a freshly downloaded file in its at rest format: compressed if Config.compression is enabled
+        (in which case the checksum is computed again), and added to the blob store if it is enabled.
+
+        :param digest: The checksum computed while downloading
+        :type digest: str
+        """
+        self.file_hash = digest
+        if Config.compression.enabled and compress_fits(self.file_path):
+            self.file_hash = checksum(self.file_path)
+        if Config.blob_store.enabled:
+            File_Blob.store(self.file_path, self.file_hash)
+        self.save()
+
+    def compress(self):
+        """
+        Rewrite the file tile compressed, and update its checksum. The file reads the same through
+        :func:`~solar.common.fits_io.read_map` and :meth:`extract_fits_data`.
+
+        :return: Whether the file was compressed, False if it already was
+        :rtype: bool
+        """
+        path = Path(self.file_path)
+        tmp = path.with_name(path.name + ".compressed")
+        if not compress_fits(path, tmp):
+            return False
+        # The blob is shared with other files, which keep the uncompressed content
+        File_Blob.release(path)
+        os.replace(tmp, path)
+        self.get_hash()
+        if Config.blob_store.enabled:
+            File_Blob.store(path, self.file_hash)
+        return True
+
+    def remove(self):
+        """
+        Delete the file and its row. A file linked into the blob store only removes the blob once no other file uses it.
+        """
+        File_Blob.release(self.file_path)
+        self.delete_instance(recursive=True)
+
     def extract_fits_data(self):
         """
         Extract data from the associated fits file, and save it in the Fits_Header_Elem table
         """
         if Path(self.file_path).is_file():
-            m = Map(self.file_path)
+            m = read_map(self.file_path)
             header = m.meta
             header = {x: y for x, y in m.meta.items() if not isinstance(y, dict)}
             for h_key in header:
@@ -0,0 +1,23 @@
+import peewee as pw
+from .base_models import Base_Model
+from .hek_event import Hek_Event
+from .fits_file import Fits_File
+
+
+class Join_Event_Fits(Base_Model):
+    """
+    This class is a many-to-many relationship between the events and the fits files that show them.
+
+    A single cutout request may cover several overlapping events (see :func:`~solar.service.cutout.coalesce_cutouts`).
+    :attr:`Fits_File.event <solar.database.tables.fits_file.Fits_File.event>` only holds the event the request was made for,
+    and this table links the files to every event they cover.
+    """
+
+    event = pw.ForeignKeyField(Hek_Event, backref="fits_join")
+    fits_file = pw.ForeignKeyField(Fits_File, backref="event_join")
+
+    class Meta:
+        indexes = ((("event", "fits_file"), True),)
+
+    def __repr__(self) -> str:
+        return f"<Join_Event_Fits: {self.event_id} -- {self.fits_file_id}>"
@@ -0,0 +1,43 @@
+import peewee as pw
+from solar.common.config import Config
+from .base_models import Base_Model
+from .hek_event import Hek_Event
+from .service_request import Service_Request
+
+
+class Join_Request_Event(Base_Model):
+    """
+    This class is a many-to-many relationship between the requests and the events they concern.
+
+    For a hek search, these are the events it found, so that a later identical search can load them instead of searching again.
+    For a cutout, these are the events it covers (see :func:`~solar.service.cutout.coalesce_cutouts`), of which
+    :attr:`Service_Request.event <solar.database.tables.service_request.Service_Request.event>` only holds the first.
+    """
+
+    service_request = pw.ForeignKeyField(Service_Request, backref="event_join")
+    event = pw.ForeignKeyField(Hek_Event, backref="request_join")
+
+    class Meta:
+        indexes = ((("service_request", "event"), True),)
+
+    def __repr__(self) -> str:
+        return f"<Join_Request_Event: {self.service_request_id} -- {self.event_id}>"
+
+    @staticmethod
+    def link(service_request, events):
+        """
+        Link events to a request. Links that already exist are kept.
+
+        :param service_request: The id of the request
+        :type service_request: int
+        :param events: The ids of the events
+        :type events: Iterable[int]
+        """
+        rows = [
+            {"service_request": service_request, "event": e}
+            for e in events
+            if e is not None
+        ]
+        with Join_Request_Event._meta.database.atomic():
+            for batch in pw.chunked(rows, Config.bulk.insert_chunk):
+                Join_Request_Event.insert_many(batch).on_conflict_ignore().execute()
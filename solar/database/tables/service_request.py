@@ -26,6 +26,9 @@ class Service_Request(Base_Model):
     #: The job id of the request (used only for ssw)
     job_id = pw.CharField(null=True)
 
+    #: Hash of the service type and the normalised parameters of the request, see :attr:`Base_Service.fingerprint <solar.service.request.Base_Service.fingerprint>`
+    fingerprint = pw.CharField(null=True, unique=True)
+
     def __getitem__(self, key: str) -> Any:
         """
         Get an item. References the Service_Parameters table to get the value of a header key
@@ -0,0 +1,51 @@
+import peewee as pw
+from datetime import datetime
+from solar.common.config import Config
+from .base_models import Base_Model
+from .service_request import Service_Request
+
+
+class Service_Stage(Base_Model):
+    """
+    The time at which a service request first reached one of the stages of its life.
+
+    The stages are:
+     - created
+     - submitted
+     - first_poll (cutouts only)
+     - ready (cutouts only, the job has been processed by the server)
+     - listed (cutouts only, the list of files has been fetched)
+     - completed (hek only, all the events have been fetched)
+     - downloaded (the files of the request have been downloaded)
+    """
+
+    #: Foreign key to the request
+    service_request = pw.ForeignKeyField(Service_Request, backref="stages")
+
+    #: The name of the stage
+    stage = pw.CharField()
+
+    #: When the stage was first reached
+    time = pw.DateTimeField(default=datetime.now)
+
+    class Meta:
+        indexes = ((("service_request", "stage"), True),)
+
+    def __repr__(self) -> str:
+        return f"<Service_Stage: {self.service_request_id} {self.stage} {self.time}>"
+
+    @staticmethod
+    def record(rows):
+        """
+        Store stage times. Stages that were already recorded for a request keep their first time.
+
+        :param rows: The request ids, stage names and times
+        :type rows: Iterable[Tuple[int, str, datetime.datetime]]
+        """
+        rows = [
+            dict(service_request=req, stage=stage, time=time)
+            for req, stage, time in rows
+        ]
+        with Service_Stage._meta.database.atomic():
+            for batch in pw.chunked(rows, Config.bulk.insert_chunk):
+                Service_Stage.insert_many(batch).on_conflict_ignore().execute()
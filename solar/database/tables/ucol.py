@@ -91,11 +91,11 @@ class UnionCol(Base_Model):
         elif self._field_type == "str":
             return self._value_string
         elif self._field_type == "list":
-            if self in self.__class__:
-                # Has the object been saved?
-                return [x.value for x in self.list_values]
-            elif hasattr(self, "list_refs"):
+            if hasattr(self, "list_refs"):
                 return [x.value for x in self.list_refs]
+            elif self.get_id() is not None:
+                # The object has been loaded from the database (list_values may have been prefetched)
+                return [x.value for x in self.list_values]
             else:
                 raise ValueError
 
@@ -118,9 +118,17 @@ class UnionCol(Base_Model):
                 self.list_refs.append(new)
 
     def save(self, *args, **kwargs):
+        stored = self.get_id() is not None
         x = super(UnionCol, self).save(*args, **kwargs)
+        replaced = hasattr(self, "list_refs") or self._field_type != "list"
+        if stored and replaced and self.list_storage_table is not None:
+            # A value that was set replaces the elements saved for this row before
+            lst = self.list_storage_table
+            lst.delete().where(lst.table == self.get_id()).execute()
         if hasattr(self, "list_refs"):
             for val in self.list_refs:
+                if stored:
+                    val.id = None
                 val.save()
         return x
 
@@ -4,6 +4,7 @@ from solar.common.config import Config
 from pathlib import Path
 from functools import wraps
 import inspect
+import peewee as pw
 
 
 def dbformat(format_string: str, *args, **kwargs) -> str:
@@ -43,3 +44,50 @@ def dbpathformat(fname, fpath, *args, **kwargs):
 def dbroot(path):
     new_path = Path(Config.db_save) / path
     return new_path
+
+
+def bulk_upsert(model, instances, key, insert_chunk=None, select_chunk=None):
+    """
+    Insert many rows at once, leaving the rows that already exist untouched.
+
+    The inserts are done in chunks inside a single transaction, after which the rows are loaded back
+    from the database using the key column.
+
+    :param model: The table
+    :type model: Type[Base_Model]
+    :param instances: The (unsaved) rows to insert
+    :type instances: List[Base_Model]
+    :param key: The name of a unique column used to match the instances with the rows in the database
+    :type key: str
+    :param insert_chunk: Number of rows per insert, defaults to Config.bulk.insert_chunk
+    :type insert_chunk: int, optional
+    :param select_chunk: Number of keys per select, defaults to Config.bulk.select_chunk
+    :type select_chunk: int, optional
+    :raises peewee.IntegrityError: If some instances could not be inserted nor found by their key (a null key, or a conflict on another unique column). Nothing is inserted then.
+    :return: The rows from the database, in the same order as instances
+    :rtype: List[Base_Model]
+    """
+    insert_chunk = insert_chunk if insert_chunk else Config.bulk.insert_chunk
+    select_chunk = select_chunk if select_chunk else Config.bulk.select_chunk
+    if not instances:
+        return []
+
+    primary_key = model._meta.primary_key
+    fields = [f for f in model._meta.sorted_fields if f is not primary_key]
+    rows = [tuple(x.__data__.get(f.name) for f in fields) for x in instances]
+    key_field = getattr(model, key)
+    keys = [getattr(x, key) for x in instances]
+    found = {}
+    with model._meta.database.atomic():
+        for batch in pw.chunked(rows, insert_chunk):
+            model.insert_many(batch, fields=fields).on_conflict_ignore().execute()
+
+        for batch in pw.chunked(list(set(keys)), select_chunk):
+            for row in model.select().where(key_field.in_(batch)):
+                found[getattr(row, key)] = row
+        missing = [k for k in dict.fromkeys(keys) if k not in found]
+        if missing:
+            raise pw.IntegrityError(
+                f"{len(missing)} {model.__name__} rows could not be saved, {key}: {missing[:10]}"
+            )
+    return [found[k] for k in keys]
@@ -79,6 +79,99 @@ class Attribute:
         )
 
 
+class Attribute_Store:
+    """
+    An ordered collection of attributes, indexed by name.
+
+    Iterating over the store yields the attributes in the order they were added.
+    Adding an attribute whose name is already in the store replaces the existing one, in place.
+    """
+
+    def __init__(self, attributes=()):
+        """
+        :param attributes: The initial attributes, defaults to ()
+        :type attributes: Iterable[Attribute]
+        """
+        self._attributes = {}
+        self.extend(attributes)
+
+    def __iter__(self):
+        return iter(self._attributes.values())
+
+    def __len__(self):
+        return len(self._attributes)
+
+    def __contains__(self, item):
+        """
+        :param item: Either the name of an attribute, or an attribute (which must match both name and value)
+        :type item: Union[str, Attribute]
+        """
+        if isinstance(item, str):
+            return item in self._attributes
+        return item.name in self._attributes and self._attributes[item.name] == item
+
+    def __getitem__(self, name):
+        """
+        :param name: The name of the attribute
+        :type name: str
+        :raises KeyError: If there is no attribute with this name
+        :rtype: Attribute
+        """
+        return self._attributes[name]
+
+    def get(self, name, default=None):
+        """
+        :param name: The name of the attribute
+        :type name: str
+        :return: The attribute, or default if there is no attribute with this name
+        :rtype: Attribute
+        """
+        return self._attributes.get(name, default)
+
+    def append(self, attribute):
+        """
+        Add an attribute, replacing any attribute with the same name
+
+        :type attribute: Attribute
+        """
+        self._attributes[attribute.name] = attribute
+
+    def extend(self, attributes):
+        """
+        Add several attributes, replacing any attributes with the same names
+
+        :type attributes: Iterable[Attribute]
+        """
+        for att in attributes:
+            self._attributes[att.name] = att
+
+    def merge(self, attributes):
+        """
+        Create a new store containing the attributes of this one, overridden by the given attributes
+
+        :type attributes: Iterable[Attribute]
+        :rtype: Attribute_Store
+        """
+        ret = Attribute_Store()
+        ret._attributes = dict(self._attributes)
+        ret.extend(attributes)
+        return ret
+
+    def as_dict(self, formatted=False):
+        """
+        :param formatted: Whether to use the formatted values (see :meth:`Attribute.f_value`), defaults to False
+        :type formatted: bool
+        :return: The values of the attributes, keyed by name
+        :rtype: Dict[str, Any]
+        """
+        if formatted:
+            return {name: att.f_value() for name, att in self._attributes.items()}
+        return {name: att.value for name, att in self._attributes.items()}
+
+    def __str__(self):
+        return "\n".join(str(x) for x in self)
+
+
 if __name__ == "__main__":
     print("Testing")
     from solar.database import create_tables
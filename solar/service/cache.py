@@ -0,0 +1,137 @@
+import json
+import os
+import time
+from pathlib import Path
+from threading import Lock
+from solar.common.config import Config
+from solar.common.printing import chat
+from solar.service.utils import params_digest
+
+
+class Response_Cache:
+    """
+    A persistent cache of json responses, stored on disk with one file per entry.
+
+    Entries are keyed by a hash of the query parameters. Entries older than the ttl are treated as missing,
+    and the least recently used entries are removed whenever the cache grows beyond its size budget.
+    """
+
+    def __init__(self, path, ttl=None, max_size=None):
+        """
+        :param path: The directory in which to store the entries
+        :type path: Union[str, Path]
+        :param ttl: Time to live of an entry in seconds, defaults to Config.cache.ttl
+        :type ttl: float, optional
+        :param max_size: Size budget of the cache in bytes, defaults to Config.cache.max_size
+        :type max_size: int, optional
+        """
+        self.path = Path(path)
+        self.ttl = ttl if ttl is not None else Config.cache.ttl
+        self.max_size = max_size if max_size is not None else Config.cache.max_size
+
+        #: Number of lookups that found a valid entry
+        self.hits = 0
+        #: Number of lookups that did not find a valid entry
+        self.misses = 0
+
+        self._lock = Lock()
+        self._size = None
+
+    def _entry_path(self, params):
+        return self.path / f"{params_digest(params)}.json"
+
+    def get(self, params):
+        """
+        Look up the response for a set of parameters
+
+        :param params: The query parameters
+        :type params: Dict[str, Any]
+        :return: The cached response, or None if there is no valid entry
+        :rtype: Any
+        """
+        p = self._entry_path(params)
+        try:
+            with open(p, "r") as f:
+                entry = json.load(f)
+        except (IOError, ValueError):
+            entry = None
+
+        if entry is None or time.time() - entry["created"] > self.ttl:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        # The modification time of the file is used as the last access time for the eviction
+        try:
+            os.utime(p)
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return entry["data"]
+
+    def put(self, params, data):
+        """
+        Store the response for a set of parameters
+
+        :param params: The query parameters
+        :type params: Dict[str, Any]
+        :param data: The response, must be json serializable
+        :type data: Any
+        """
+        self.path.mkdir(parents=True, exist_ok=True)
+        p = self._entry_path(params)
+        tmp = p.with_suffix(f".{os.getpid()}.{id(data)}.tmp")
+        with open(tmp, "w") as f:
+            json.dump({"created": time.time(), "data": data}, f)
+
+        with self._lock:
+            # The size is measured before the entry is in place, so that it is only counted once,
+            # and an entry that replaces another only counts the difference
+            if self._size is None:
+                self._size = self._disk_size()
+            old = p.stat().st_size if p.is_file() else 0
+            os.replace(tmp, p)
+            self._size += p.stat().st_size - old
+            if self._size > self.max_size:
+                self._evict()
+
+    def _entries(self):
+        return [x for x in self.path.glob("*.json") if x.is_file()]
+
+    def _disk_size(self):
+        return sum(x.stat().st_size for x in self._entries())
+
+    def _evict(self):
+        """
+        Remove the least recently used entries until the cache fits in its budget
+        """
+        entries = []
+        for x in self._entries():
+            try:
+                entries.append((x.stat().st_mtime, x.stat().st_size, x))
+            except OSError:
+                pass
+        entries.sort()
+        size = sum(x[1] for x in entries)
+        removed = 0
+        for _, entry_size, entry in entries:
+            if size <= self.max_size:
+                break
+            try:
+                entry.unlink()
+            except OSError:
+                continue
+            size -= entry_size
+            removed += 1
+        self._size = size
+        chat(f"Removed {removed} entries from the cache at {self.path}")
+
+    def clear(self):
+        """
+        Remove all the entries
+        """
+        with self._lock:
+            for x in self._entries():
+                x.unlink()
+            self._size = 0
@@ -0,0 +1,347 @@
+"""
+A thin http layer shared by the services.
+
+All requests go through a single pooled :class:`requests.Session`, so that repeated calls to the same
+server reuse their connections instead of paying for a new handshake every time.
+"""
+
+import random
+import time
+from collections import deque, namedtuple
+from threading import Condition, Lock
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, HTTPError, RequestException, Timeout
+from solar.common.config import Config
+from solar.common.printing import chat
+
+
+#: The timing information recorded for every request made through a :class:`Http_Client`
+Request_Timing = namedtuple(
+    "Request_Timing", ["url", "params", "start", "elapsed", "status_code"]
+)
+
+_session = None
+_session_lock = Lock()
+
+
+def shared_session():
+    """
+    Get the session shared by all the services, creating it if necessary.
+
+    :return: The session
+    :rtype: requests.Session
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=Config.http.pool_size,
+                pool_maxsize=Config.http.pool_size,
+            )
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+        return _session
+
+
+class Concurrency_Limiter:
+    """
+    Limit the number of requests in flight, adapting the limit to the observed latency.
+
+    The limit grows by one for each request that completes in a reasonable time, and is halved
+    whenever a request takes longer than latency_factor times the fastest request seen so far.
+    """
+
+    def __init__(self, max_limit, min_limit=1, latency_factor=2.0):
+        """
+        :param max_limit: The largest number of concurrent requests allowed
+        :type max_limit: int
+        :param min_limit: The limit will never be reduced below this, defaults to 1
+        :type min_limit: int
+        :param latency_factor: How much slower than the fastest request a request must be to trigger a back off, defaults to 2.0
+        :type latency_factor: float
+        """
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.latency_factor = latency_factor
+        self.limit = self.max_limit
+        self.in_flight = 0
+        self.baseline = None
+        self._cond = Condition()
+
+    def acquire(self):
+        """
+        Block until a slot is available
+        """
+        with self._cond:
+            while self.in_flight >= self.limit:
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, latency=None):
+        """
+        Release a slot, and update the limit using the latency of the finished request.
+
+        :param latency: The duration of the request in seconds, defaults to None
+        :type latency: float
+        """
+        with self._cond:
+            self.in_flight -= 1
+            if latency is not None:
+                self._adjust(latency)
+            self._cond.notify_all()
+
+    def _adjust(self, latency):
+        if self.baseline is None or latency < self.baseline:
+            self.baseline = latency
+        if latency > self.baseline * self.latency_factor:
+            self.limit = max(self.min_limit, self.limit // 2)
+        else:
+            self.limit = min(self.max_limit, self.limit + 1)
+
+
+class Retry_Policy:
+    """
+    Exponential backoff with full jitter: the n-th retry waits a random time between 0 and backoff * 2^n seconds, capped at max_backoff.
+    """
+
+    #: Http status codes worth retrying
+    retry_status = (429, 500, 502, 503, 504)
+
+    def __init__(self, attempts=None, backoff=None, max_backoff=None):
+        """
+        :param attempts: Total number of attempts, defaults to Config.http.retries + 1
+        :type attempts: int, optional
+        :param backoff: Base delay in seconds, defaults to Config.http.backoff
+        :type backoff: float, optional
+        :param max_backoff: Maximum delay in seconds, defaults to Config.http.max_backoff
+        :type max_backoff: float, optional
+        """
+        self.attempts = attempts if attempts else Config.http.retries + 1
+        self.backoff = backoff if backoff is not None else Config.http.backoff
+        self.max_backoff = (
+            max_backoff if max_backoff is not None else Config.http.max_backoff
+        )
+
+    def delay(self, attempt):
+        """
+        :param attempt: The number of attempts already made, starting at 0
+        :type attempt: int
+        :return: The time to wait before the next attempt, in seconds
+        :rtype: float
+        """
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+
+class Circuit_Open(RequestException):
+    """
+    Raised when a request is refused because its host has failed too many times in a row.
+    This is not a failure of the request: it can be made again after :attr:`retry_after` seconds.
+    """
+
+    def __init__(self, *args, retry_after=0, **kwargs):
+        """
+        :param retry_after: Time in seconds before requests to the host may be let through again, defaults to 0
+        :type retry_after: float
+        """
+        super().__init__(*args, **kwargs)
+        self.retry_after = retry_after
+
+
+class Circuit_Breaker:
+    """
+    Stops sending requests to a host that keeps failing.
+
+    After threshold consecutive failures the breaker opens, and requests are refused for reset_time seconds.
+    After that a single trial request is let through, which closes the breaker if it succeeds.
+    """
+
+    _breakers = {}
+    _breakers_lock = Lock()
+
+    def __init__(self, threshold=None, reset_time=None):
+        """
+        :param threshold: Number of consecutive failures that opens the breaker, defaults to Config.http.breaker_threshold
+        :type threshold: int, optional
+        :param reset_time: Time in seconds before a trial request is allowed, defaults to Config.http.breaker_reset
+        :type reset_time: float, optional
+        """
+        self.threshold = threshold if threshold else Config.http.breaker_threshold
+        self.reset_time = (
+            reset_time if reset_time is not None else Config.http.breaker_reset
+        )
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = Lock()
+
+    @staticmethod
+    def for_host(url):
+        """
+        Get the breaker shared by all the requests to the host of a url
+
+        :param url: The url
+        :type url: str
+        :rtype: Circuit_Breaker
+        """
+        host = urlparse(url).netloc
+        with Circuit_Breaker._breakers_lock:
+            if host not in Circuit_Breaker._breakers:
+                Circuit_Breaker._breakers[host] = Circuit_Breaker()
+            return Circuit_Breaker._breakers[host]
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow(self):
+        """
+        :return: Whether a request may be made
+        :rtype: bool
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if not self._trial and time.time() - self.opened_at >= self.reset_time:
+                self._trial = True
+                return True
+            return False
+
+    def retry_after(self):
+        """
+        :return: The time in seconds before a request may be let through again, 0 if the breaker is closed
+        :rtype: float
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return 0
+            remaining = self.opened_at + self.reset_time - time.time()
+            # Once a trial is running, check again shortly whether it succeeded
+            return remaining if remaining > 0 else min(1.0, self.reset_time)
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.threshold:
+                if self.opened_at is None:
+                    chat(f"Too many failures, pausing requests for {self.reset_time}s")
+                self.opened_at = time.time()
+                self._trial = False
+
+
+class Http_Client:
+    """
+    Makes requests through the shared session and records how long each one took.
+    """
+
+    def __init__(
+        self,
+        limiter=None,
+        timeout=None,
+        session=None,
+        retry=None,
+        use_breaker=True,
+        wait_open=False,
+    ):
+        """
+        :param limiter: Limits the number of concurrent requests, defaults to None (no limit)
+        :type limiter: Concurrency_Limiter
+        :param timeout: Timeout passed to each request in seconds, defaults to (Config.http.connect_timeout, Config.http.timeout)
+        :type timeout: Union[float, Tuple[float, float]]
+        :param session: The session to use, defaults to the shared session
+        :type session: requests.Session
+        :param retry: How to retry failed requests, defaults to Retry_Policy()
+        :type retry: Retry_Policy
+        :param use_breaker: Whether to use the circuit breaker of the host, defaults to True
+        :type use_breaker: bool
+        :param wait_open: Whether to wait for the breaker of the host to let requests through again, instead of raising :class:`Circuit_Open`, defaults to False
+        :type wait_open: bool
+        """
+        self.limiter = limiter
+        self.timeout = (
+            timeout if timeout else (Config.http.connect_timeout, Config.http.timeout)
+        )
+        self.session = session if session else shared_session()
+        self.retry = retry if retry else Retry_Policy()
+        self.use_breaker = use_breaker
+        self.wait_open = wait_open
+        #: The timings of the last Config.http.max_timings requests
+        self.timings = deque(maxlen=Config.http.max_timings)
+        self._timing_lock = Lock()
+
+    def get(self, url, **kwargs):
+        """
+        Make a get request. Takes the same arguments as :func:`requests.get`.
+
+        Connection errors, timeouts and server errors are retried according to the retry policy.
+        The circuit breaker of the host counts a single failure for the request, once all its attempts have failed.
+
+        :param url: The url
+        :type url: str
+        :raises HTTPError: If the server responds with an error status
+        :raises Circuit_Open: If the host has failed too many times in a row, unless wait_open is set
+        :return: The response
+        :rtype: requests.Response
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        breaker = Circuit_Breaker.for_host(url) if self.use_breaker else None
+        while breaker and not breaker.allow():
+            if not self.wait_open:
+                raise Circuit_Open(
+                    f"Requests to {urlparse(url).netloc} are paused",
+                    retry_after=breaker.retry_after(),
+                )
+            time.sleep(breaker.retry_after())
+        attempt = 0
+        while True:
+            try:
+                response = self._get_once(url, **kwargs)
+                status_code = getattr(response, "status_code", 200)
+                if status_code in Retry_Policy.retry_status:
+                    # Release the connection of a streamed response
+                    response.close()
+                    raise HTTPError(f"{status_code} for {url}", response=response)
+            except (ConnectionError, Timeout, HTTPError) as err:
+                attempt += 1
+                if attempt >= self.retry.attempts:
+                    if breaker:
+                        breaker.record_failure()
+                    raise
+                chat(f"Request to {url} failed ({err}), retrying")
+                time.sleep(self.retry.delay(attempt - 1))
+                continue
+            if breaker:
+                breaker.record_success()
+            if isinstance(status_code, int) and status_code >= 400:
+                response.close()
+                raise HTTPError(f"{status_code} for {url}", response=response)
+            return response
+
+    def _get_once(self, url, **kwargs):
+        if self.limiter:
+            self.limiter.acquire()
+        status_code = None
+        start = time.time()
+        begin = time.perf_counter()
+        try:
+            response = self.session.get(url, **kwargs)
+            status_code = getattr(response, "status_code", None)
+            return response
+        finally:
+            elapsed = time.perf_counter() - begin
+            if self.limiter:
+                self.limiter.release(elapsed)
+            with self._timing_lock:
+                self.timings.append(
+                    Request_Timing(
+                        url, kwargs.get("params"), start, elapsed, status_code
+                    )
+                )
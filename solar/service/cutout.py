@@ -1,22 +1,28 @@
 from __future__ import annotations
 from typing import List, Dict
-import requests
 from datetime import datetime, timedelta
-from requests.exceptions import HTTPError
 import re
 import time
 from solar.common.config import Config
 from solar.database.tables.hek_event import Hek_Event
 from solar.database.tables.fits_file import Fits_File
-from solar.database.tables.service_request import Service_Request
-from concurrent.futures import ThreadPoolExecutor
-import concurrent.futures
+from solar.database.tables.service_request import (
+    Service_Request,
+    Service_Parameter,
+    Service_Parameter_List,
+)
+from solar.database.tables.join_event_fit import Join_Event_Fits
+from solar.database.tables.join_request_event import Join_Request_Event
 from .attribute import Attribute as Att
 from .utils import build_from_defaults
 from .request import Base_Service
+from .client import Http_Client, Circuit_Open
+from .poller import Cutout_Poller
+from solar.database.utils import bulk_upsert
 import peewee as pw
 from solar.common import chat
 import math
+from solar.common.utils import into_number
 
 
 class Cutout_Service(Base_Service):
@@ -25,11 +31,15 @@ class Cutout_Service(Base_Service):
     base_api_url = "http://www.lmsal.com/cgi-ssw/ssw_service_track_fov.sh"
 
     data_response_url_template = "https://www.lmsal.com/solarsoft//archive/sdo/media/ssw/ssw_client/data/{ssw_id}/"
-    delay_time = 60  # seconds
     service_type = "cutout"
 
+    # The wavelength is the last number in the names of the files produced by the service
+    channel_re = re.compile(r"_(\d{2,4})_*\.f(?:i)?ts$", re.IGNORECASE)
+
     @staticmethod
-    def _from_event(event: Hek_Event, strict: bool = True) -> Cutout_Service:
+    def _from_event(
+        event: Hek_Event, strict: bool = True, size: Cutout_Size = None
+    ) -> Cutout_Service:
         """
         Create a cutout service object from a solar event.
 
@@ -37,11 +47,13 @@ class Cutout_Service(Base_Service):
         :type event: Hek_Event
         :param strict: Whether to allow the program to make decisions that reduce the possibility of duplicate requests, defaults to True
         :type strict: bool, optional
+        :param size: How to size the field of view and the number of frames of a new request, defaults to Cutout_Size()
+        :type size: Cutout_Size, optional
         :return: The constructed cutout service object
         :rtype: Cutout_Service
         """
 
-        # TODO: Add feature that detects if there is an existing request in a similar region as this event #
+        # Requests covering several overlapping events are built by coalesce_cutouts
         if strict:
             try:
                 # Can we find an an existing service request that used this event?
@@ -55,42 +67,161 @@ class Cutout_Service(Base_Service):
                 pass
         chat("I could not find request matching this event, I will create a new one")
         # Either way, we get the parameters we need from the event
-        hek_xr = abs(event.x_max - event.x_min)
-        hek_yr = abs(event.y_max - event.y_min)
-        min_xyr = 120. # in arcsec 
+        return Cutout_Service._from_box([event], *event_box(event, size), size=size)
+
+    @staticmethod
+    def _from_events(
+        events: List[Hek_Event], strict: bool = True, size: Cutout_Size = None
+    ) -> List[Cutout_Service]:
+        """
+        Create cutout service objects for many events at once.
+
+        This is equivalent to calling :meth:`_from_event` on every event, but the existing requests and their parameters
+        are loaded with at most five queries (per Config.bulk.select_chunk events), instead of several queries per event.
+
+        :param events: The events, as a list or a query
+        :type events: Iterable[Hek_Event]
+        :param strict: Whether to reuse the existing requests made for the events, defaults to True
+        :type strict: bool, optional
+        :param size: How to size the field of view and the number of frames of the new requests, defaults to Cutout_Size()
+        :type size: Cutout_Size, optional
+        :return: The cutout service objects, in the same order as events
+        :rtype: List[Cutout_Service]
+        """
+        events = list(events)
+        existing = {}
+        if strict:
+            for batch in pw.chunked([e.id for e in events], Config.bulk.select_chunk):
+                reqs = (
+                    Service_Request.select()
+                    .where(
+                        Service_Request.event.in_(batch),
+                        Service_Request.service_type == "cutout",
+                    )
+                    .order_by(Service_Request.id)
+                )
+                params = Service_Parameter.select().order_by(Service_Parameter.id)
+                values = Service_Parameter_List.select().order_by(
+                    Service_Parameter_List.id
+                )
+                for req in pw.prefetch(reqs, params, values):
+                    existing.setdefault(req.event_id, req)
+
+        covered = Cutout_Service._covered_events([r.id for r in existing.values()])
+        ret = []
+        for event in events:
+            if event.id in existing:
+                req = existing[event.id]
+                # Avoid loading the event again
+                req.event = event
+                ret.append(
+                    Cutout_Service._from_model(
+                        req, events=covered.get(req.id, [event])
+                    )
+                )
+            else:
+                box = event_box(event, size)
+                ret.append(Cutout_Service._from_box([event], *box, size=size))
+        chat(
+            f"I found existing cutout requests for {len(existing)} of {len(events)} events"
+        )
+        return ret
+
+    @staticmethod
+    def _from_box(events, x_min, x_max, y_min, y_max, size=None):
+        """
+        Create a cutout service object covering a box, for a group of events.
+
+        :param events: The events covered by the request. The first one is the event the request is saved with
+        :type events: List[Hek_Event]
+        :param size: Sets the number of frames, defaults to Cutout_Size()
+        :type size: Cutout_Size, optional
+        :return: The constructed cutout service object
+        :rtype: Cutout_Service
+        """
+        size = size if size else Cutout_Size()
+        start = min(e.start_time for e in events)
+        end = max(e.end_time for e in events)
         to_pass = dict(
-            xcen=event.hpc_x,
-            ycen=event.hpc_y,
-            fovx=max(min_xyr,hek_xr),
-            fovy=max(min_xyr,hek_yr),
+            xcen=(x_min + x_max) / 2,
+            ycen=(y_min + y_max) / 2,
+            fovx=x_max - x_min,
+            fovy=y_max - y_min,
             notrack=1,
-            starttime=event.start_time,
-            endtime=event.end_time,
+            starttime=start,
+            endtime=end,
+            max_frames=size.frames(start, end),
         )
         c = Cutout_Service(**to_pass)
-        c.event = event
+        c.event = events[0]
+        c.events = list(events)
         return c
 
-    @staticmethod
-    def _from_model(mod):
+    @classmethod
+    def _from_model(cls, mod, events=None):
         """
-        Load a Cutout_Service object from an existing request
+        Load a cutout service object (of the class it is called on) from an existing request
 
 
         :param mod: The Service_Request object
         :type mod: Service_Request
+        :param events: The events covered by the request, defaults to None (they are loaded, see :meth:`_covered_events`)
+        :type events: List[Hek_Event], optional
         :return: A request with parameters built from mod
         :rtype: Cutout_Service
         """
         params = [Att.from_model(x) for x in mod.parameters]
-        cut = Cutout_Service(*params)
+        cut = cls(*params)
         cut.event = mod.event
+        if events is None:
+            events = Cutout_Service._covered_events([mod.id]).get(mod.id)
+        cut.events = events if events else ([cut.event] if cut.event else [])
         cut.status = mod.status
         cut.service_request_id = mod.id
         cut.job_id = mod.job_id
 
         return cut
 
+    @staticmethod
+    def _covered_events(request_ids):
+        """
+        Load the events covered by saved requests, from their links in :class:`~solar.database.tables.join_request_event.Join_Request_Event`.
+        Requests saved before these links existed get the events linked to their fits files instead.
+
+        :param request_ids: The ids of the requests
+        :type request_ids: List[int]
+        :return: The events of each request that has any, by request id
+        :rtype: Dict[int, List[Hek_Event]]
+        """
+        ret = {}
+        for batch in pw.chunked(request_ids, Config.bulk.select_chunk):
+            query = (
+                Hek_Event.select(
+                    Hek_Event, Join_Request_Event.service_request.alias("covered_by")
+                )
+                .join(Join_Request_Event)
+                .where(Join_Request_Event.service_request.in_(batch))
+                .order_by(Join_Request_Event.id)
+                .objects()
+            )
+            for e in query:
+                ret.setdefault(e.covered_by, []).append(e)
+            missing = [r for r in batch if r not in ret]
+            if not missing:
+                continue
+            query = (
+                Hek_Event.select(Hek_Event, Fits_File.request.alias("covered_by"))
+                .join(Join_Event_Fits)
+                .join(Fits_File)
+                .where(Fits_File.request.in_(missing))
+                .order_by(Hek_Event.id)
+                .distinct()
+                .objects()
+            )
+            for e in query:
+                ret.setdefault(e.covered_by, []).append(e)
+        return ret
+
     def __init__(self, *args, **kwargs):
         """
         Initialize a cutout request.
@@ -115,6 +246,7 @@ class Cutout_Service(Base_Service):
         fovx = Att("fovx", kwargs.get("fovx", 100))
         fovy = Att("fovy", kwargs.get("fovy", 100))
         queue = Att("queue_job", kwargs.get("queue", 1))
+        # Several wavelengths may be requested at once, as a list
         channel = Att("waves", kwargs.get("channel", 304))
         notrack = Att("notrack", kwargs.get("notrack", 1))
         start_time = Att("starttime", start, t_format=Config.time_format.hek)
@@ -142,21 +274,29 @@ class Cutout_Service(Base_Service):
         # Replace default arguments with user submitted ones when possible
         self.params = build_from_defaults(defaults, temp)
 
-        temp_start, = [x for x in self.params if x.name == "starttime"]
-        temp_end, = [x for x in self.params if x.name == "endtime"]
-        self.params.append(self.__compute_frames(temp_start, temp_end))
+        if "max_frames" not in self.params:
+            frames = Cutout_Size().frames(
+                self.params["starttime"].value, self.params["endtime"].value
+            )
+            self.params.append(Att("max_frames", frames))
 
         self.event = None
+        # All the events covered by this request, see coalesce_cutouts
+        self.events = []
 
         self.status = "unsubmitted"
 
         self._data = None  # The text from the response
+        self._status_page = None  # The page of the processed job
 
-    def __compute_frames(self, start_time, end_time, cadence=24):
-        seconds = math.ceil(
-            (end_time.value - start_time.value) / timedelta(seconds=cadence)
-        )
-        return Att("max_frames", seconds)
+        self.client = Http_Client()
+
+        # The steps of the job that failed, even after retrying
+        self.failures = []
+
+        # When the request reached each stage, see Service_Stage
+        self.stage_times = {}
+        self._mark_stage("created")
 
     @property
     def data(self):
@@ -178,108 +318,213 @@ class Cutout_Service(Base_Service):
         other = [
             Att(key, kwargs[key], t_format=Config.time_format.hek) for key in kwargs
         ]
-        new_params = build_from_defaults(self.params, other)
-        return {att.name: att.f_value() for att in new_params}
+        ret = self.params.merge(other).as_dict(formatted=True)
+        # The api expects lists (for example of wavelengths) as comma separated values
+        return {
+            key: ",".join(str(x) for x in val) if isinstance(val, list) else val
+            for key, val in ret.items()
+        }
+
+    @property
+    def waves(self):
+        """
+        The wavelengths requested, in angstrom
+
+        :rtype: List[int]
+        """
+        waves = self.params["waves"].value
+        if isinstance(waves, str):
+            waves = waves.split(",")
+        if not isinstance(waves, list):
+            waves = [waves]
+        return [into_number(w) for w in waves]
+
+    def _channel_of(self, fits_server_file):
+        """
+        Find the wavelength of a file produced by the request
+
+        :param fits_server_file: The name of the file on the server, for example ssw_cutout_20140607_215306_AIA_304_.fts
+        :type fits_server_file: str
+        :return: The wavelength in angstrom, None if it could not be found
+        :rtype: int
+        """
+        found = Cutout_Service.channel_re.search(fits_server_file)
+        if found:
+            return int(found[1])
+        # A request for a single wavelength only produces files of this wavelength
+        waves = self.waves
+        return waves[0] if len(waves) == 1 else None
 
     def submit_request(self, auto_save=True):
         """
         Make a request to the SSW server in order to begin processing. 
+        If a saved request has the same parameters (see :attr:`~solar.service.request.Base_Service.fingerprint`), its job, and its files if it has completed, are reused instead.
 
         :param auto_save: whether to autosave the request, defaults to True
         :type auto_save: bool
+        :raises Circuit_Open: If requests to the server are paused
+        :return: Whether the job was submitted
+        :rtype: bool
         """
         if not self.job_id:
+            existing = self._find_duplicate()
+            if existing and existing.job_id:
+                chat(
+                    f"Request {existing.id} has the same parameters, I will reuse its job {existing.job_id}"
+                )
+                self.__reuse(existing)
+                if auto_save:
+                    self.save_request()
+                return True
             try:
-                response = requests.get(
+                response = self.client.get(
                     Cutout_Service.base_api_url, params=self.__parse_attributes()
                 )
-            except HTTPError as http_err:
-                print(f"HTTP error occurred: {http_err}")  # Python 3.6
-            except Exception as err:
-                print(f"Other error occurred: {err}")  # Python 3.6
-            else:
                 # Extract the job_id from the response
                 self.job_id = re.search(
                     '<param name="JobID">(.*)</param>', response.text
                 )[1]
+            except Circuit_Open:
+                # Not a failure of the request, it can be submitted again later
+                raise
+            except Exception as err:
+                self._record_failure(self.event, "submit", err)
+                return False
 
+        self._mark_stage("submitted")
         self.status = "submitted"
         if auto_save:
             self.save_request()
+        return True
+
+    def save_request(self):
+        """
+        Save the request, and link it to every event it covers (see :class:`~solar.database.tables.join_request_event.Join_Request_Event`)
+        """
+        super().save_request()
+        if self.service_request_id and self.events:
+            Join_Request_Event.link(self.service_request_id, [e.id for e in self.events])
+
+    def __reuse(self, req):
+        """
+        Take over the job of an identical saved request. The request keeps its own row, since the other request may be for another event.
+
+        :type req: Service_Request
+        """
+        self.job_id = req.job_id
+        self.status = req.status
+        if self.status == "completed":
+            self._data = list(req.fits_files)
 
     def fetch_data(self, delay=None, auto_save=True):
         """Function fetch_data: 
-        Attempt to fetch the data from the ssw_server.
+        Attempt to fetch the data from the ssw_server. Blocks until the job is finished, or abandoned (see :class:`~solar.service.poller.Cutout_Poller`).
 
-        :param delay: The time to wait between requests, defaults to None
+        :param delay: The time to wait between requests, defaults to None (the delay grows with the age of the job)
         :type delay: int
         :param auto_save: Save the request automatically, defaults to True
         :type auto_save: bool
+        :return: Whether the list of files was retrieved
+        :rtype: bool
         """
 
-        if not self.job_id:
-            self.submit_request(auto_save=auto_save)
+        while not self.job_id:
+            try:
+                if not self.submit_request(auto_save=auto_save):
+                    return False
+            except Circuit_Open as err:
+                chat(f"{err}, I will submit the job again in {err.retry_after:.0f}s")
+                time.sleep(err.retry_after)
+        if self.status == "completed" and self._data:
+            # The files of an identical request were reused
+            return True
+
+        if delay:
+            poller = Cutout_Poller(max_workers=1, min_delay=delay, max_delay=delay)
+        else:
+            poller = Cutout_Poller(max_workers=1)
+        poller.add(self)
+        return bool(poller.run())
 
-        data_response_url = Cutout_Service.data_response_url_template.format(
-            ssw_id=self.job_id
-        )
-        data_acquired = False  # Have we been able to get the data_file list?
+    @property
+    def data_response_url(self):
+        return Cutout_Service.data_response_url_template.format(ssw_id=self.job_id)
 
-        delay_time = delay if delay else Cutout_Service.delay_time
+    def check_status(self):
+        """
+        Check once whether the job has been processed.
 
-        while not data_acquired:
+        :raises requests.RequestException: If the status page could not be retrieved
+        :return: Whether the files are ready
+        :rtype: bool
+        """
+        # The job has been processed once the page contains the string "Per-Wave file lists"
+        self._mark_stage("first_poll")
+        response = self.client.get(self.data_response_url)
+        if re.search("Per-Wave file lists", response.text):
+            self._mark_stage("ready")
+            self._status_page = response.text
+            return True
+        chat(f"Data not available yet for job {self.job_id}")
+        return False
+
+    def fetch_file_list(self):
+        """
+        Once the job has been processed, get the list of fits files it produced and store them in :attr:`data`.
 
-            # In the below statements, we fetch the html from the data_response_url
-            # We then check if the response contains the string "Per-Wave file lists", to determine
-            # if the request has been processed
-            try:
-                data_response = requests.get(data_response_url)
-            except HTTPError as http_err:
-                print(f"HTTP error occurred: {http_err}")  # Python 3.6
-            except Exception as err:
-                print(f"Other error occurred: {err}")  # Python 3.6
-            else:
-                if re.search("Per-Wave file lists", data_response.text):
-                    data_acquired = True
-                else:
-                    chat("Data not available")
-                    time.sleep(delay_time)
-                    chat(f"Attempting to fetch data from {data_response_url}")
-        # print("Data now available")
-        # Once the response has been processed we need to extract the list of fits files
-        if data_acquired:
+        :raises Circuit_Open: If requests to the server are paused
+        :return: Whether the list of files was retrieved
+        :rtype: bool
+        """
+        fits_list_url = re.search('<p><a href="(.*)">.*</a>', self._status_page)
+        if not fits_list_url:
+            # print(f"Looks like there are no cut out files available")
             self.status = "completed"
-            fits_list_url = re.search('<p><a href="(.*)">.*</a>', data_response.text)[1]
-
-            if not fits_list_url:
-                # print(f"Looks like there are no cut out files available")
-                return False
-
-            # List_files_raw contains the pure text from the page listing the urls
-            # We then split and extract the actial name
-            try:
-                list_files_raw = requests.get(data_response_url + fits_list_url).text
-            except HTTPError as http_err:
-                print(f"HTTP error occurred: {http_err}")  # Python 3.6
-            except Exception as err:
-                print(f"Other error occurred: {err}")  # Python 3.6
-            else:
-                file_list = list_files_raw.split("\n")
-                file_list = [re.search(".*/(.*)$", x)[1] for x in file_list if x]
-                self._data = [self._as_fits(x) for x in file_list]
+            return False
+
+        # List_files_raw contains the pure text from the page listing the urls
+        # We then split and extract the actial name
+        try:
+            list_files_raw = self.client.get(
+                self.data_response_url + fits_list_url[1]
+            ).text
+        except Circuit_Open:
+            raise
+        except Exception as err:
+            self._record_failure(self.job_id, "listing", err)
+            return False
+        file_list = list_files_raw.split("\n")
+        file_list = [re.search(".*/(.*)$", x)[1] for x in file_list if x]
+        self._data = [self._as_fits(x) for x in file_list]
+        # Only mark the job as completed once the files are known, so that an interrupted job is resumed
+        self._mark_stage("listed")
+        self.status = "completed"
+        return True
 
     def save_data(self):
-        """Save the fits files generated by the request to the database
+        """Save the fits files generated by the request to the database, in a single transaction.
+        Files that are already in the database (matched by their path on the server) are replaced by the existing rows.
+        If some files cannot be saved, nothing is, and the :class:`peewee.IntegrityError` of :func:`~solar.database.utils.bulk_upsert` is raised.
         """
-        for i in range(len(self._data)):
-            try:
-                self._data[i].save()
-            except pw.IntegrityError as e:
-                self._data[i] = Fits_File.get(
-                    Fits_File.server_full_path == self._data[i].server_full_path
-                )
-            except Exception as e:
-                print(e)
+        if not self._data:
+            return
+        with Fits_File._meta.database.atomic():
+            self._data = bulk_upsert(Fits_File, self._data, "server_full_path")
+            self._link_events()
+
+    def _link_events(self):
+        """Link the fits files of the request to every event it covers
+        """
+        if not self.events or not self._data:
+            return
+        rows = [
+            {"event": e.id, "fits_file": f.id}
+            for e in self.events
+            for f in self._data
+        ]
+        with Join_Event_Fits._meta.database.atomic():
+            for batch in pw.chunked(rows, Config.bulk.insert_chunk):
+                Join_Event_Fits.insert_many(batch).on_conflict_ignore().execute()
 
     def _as_fits(self, fits_server_file) -> Fits_File:
         """
@@ -296,9 +541,7 @@ class Cutout_Service(Base_Service):
         event_id = self.event.event_id if self.event else None
         req_id = self.service_request_id if self.service_request_id else None
 
-        data_response_url = Cutout_Service.data_response_url_template.format(
-            ssw_id=self.job_id
-        )
+        data_response_url = self.data_response_url
 
         f = Fits_File(
             event=self.event,
@@ -308,11 +551,223 @@ class Cutout_Service(Base_Service):
             server_full_path=data_response_url + fits_server_file,
             file_name=fits_server_file,
             request_id=req_id,
+            channel=self._channel_of(fits_server_file),
         )
         f.file_path = Fits_File.make_path(f, event_id=event_id)
         return f
 
 
+class Cutout_Size:
+    """
+    Decides how large a cutout of an event should be, so that requests only pull the pixels and frames that are actually used.
+
+    The field of view is the bounding box of the event padded by a fraction of its size, at least Config.cutout.min_fov wide and at most max_fov_pix pixels wide.
+    The number of frames covers the time range at the target cadence, up to the frame budget.
+    """
+
+    def __init__(
+        self, cadence=None, frame_budget=None, max_fov_pix=None, padding=None
+    ):
+        """
+        :param cadence: Target time between frames in seconds, defaults to Config.cutout.cadence
+        :type cadence: float, optional
+        :param frame_budget: Largest number of frames per request, defaults to Config.cutout.frame_budget
+        :type frame_budget: int, optional
+        :param max_fov_pix: Largest side of the field of view in pixels, defaults to Config.cutout.max_fov_pix
+        :type max_fov_pix: int, optional
+        :param padding: Fraction of the size of the bounding box added around it, defaults to Config.cutout.fov_padding
+        :type padding: float, optional
+        """
+        self.cadence = cadence if cadence else Config.cutout.cadence
+        self.frame_budget = frame_budget if frame_budget else Config.cutout.frame_budget
+        self.max_fov_pix = max_fov_pix if max_fov_pix else Config.cutout.max_fov_pix
+        self.padding = padding if padding is not None else Config.cutout.fov_padding
+
+    @property
+    def max_fov(self):
+        """
+        The largest side of the field of view in arcsec, None if there is no limit
+
+        :rtype: float
+        """
+        if not self.max_fov_pix:
+            return None
+        return self.max_fov_pix * Config.cutout.plate_scale
+
+    def fov(self, extent):
+        """
+        :param extent: The size of the bounding box along one axis, in arcsec
+        :type extent: float
+        :return: The size of the field of view along this axis, in arcsec
+        :rtype: float
+        """
+        fov = max(Config.cutout.min_fov, abs(extent) * (1 + self.padding))
+        if self.max_fov:
+            fov = min(fov, self.max_fov)
+        return fov
+
+    def frames(self, start, end):
+        """
+        :param start: Start of the time range
+        :type start: datetime.datetime
+        :param end: End of the time range
+        :type end: datetime.datetime
+        :return: The number of frames to request
+        :rtype: int
+        """
+        frames = max(1, math.ceil((end - start) / timedelta(seconds=self.cadence)))
+        if self.frame_budget:
+            frames = min(frames, self.frame_budget)
+        return frames
+
+
+def event_box(event: Hek_Event, size: Cutout_Size = None):
+    """
+    The box a cutout of an event should cover: the padded bounding box of the event, centered on the event (see :class:`Cutout_Size`).
+
+    :param event: The event
+    :type event: Hek_Event
+    :param size: How to size the box, defaults to Cutout_Size()
+    :type size: Cutout_Size, optional
+    :return: x_min, x_max, y_min, y_max in arcsec
+    :rtype: Tuple[float, float, float, float]
+    """
+    size = size if size else Cutout_Size()
+    fovx = size.fov(event.x_max - event.x_min)
+    fovy = size.fov(event.y_max - event.y_min)
+    return (
+        event.hpc_x - fovx / 2,
+        event.hpc_x + fovx / 2,
+        event.hpc_y - fovy / 2,
+        event.hpc_y + fovy / 2,
+    )
+
+
+def group_events(
+    events: List[Hek_Event], max_fov: float = None, size: Cutout_Size = None
+) -> List[List[Hek_Event]]:
+    """
+    Group the events whose time ranges and boxes (see :func:`event_box`) overlap, so that each group can be covered by a single cutout.
+
+    The events are swept in order of start time, and each one joins the first open group it overlaps, as long as the box covering the group stays within max_fov.
+
+    :param events: The events
+    :type events: List[Hek_Event]
+    :param max_fov: The largest side of the box covering a group in arcsec, defaults to Config.cutout.coalesce_fov
+    :type max_fov: float, optional
+    :param size: How to size the box of each event, defaults to Cutout_Size()
+    :type size: Cutout_Size, optional
+    :return: The groups, each sorted by start time
+    :rtype: List[List[Hek_Event]]
+    """
+    max_fov = max_fov if max_fov else Config.cutout.coalesce_fov
+    groups = []
+    # Each open group is [events, end_time, box]
+    open_groups = []
+    for event in sorted(events, key=lambda e: e.start_time):
+        open_groups = [g for g in open_groups if g[1] >= event.start_time]
+        box = event_box(event, size)
+        for group in open_groups:
+            g_box = group[2]
+            overlap = (
+                box[0] <= g_box[1]
+                and g_box[0] <= box[1]
+                and box[2] <= g_box[3]
+                and g_box[2] <= box[3]
+            )
+            if not overlap:
+                continue
+            union = (
+                min(box[0], g_box[0]),
+                max(box[1], g_box[1]),
+                min(box[2], g_box[2]),
+                max(box[3], g_box[3]),
+            )
+            if union[1] - union[0] > max_fov or union[3] - union[2] > max_fov:
+                continue
+            group[0].append(event)
+            group[1] = max(group[1], event.end_time)
+            group[2] = union
+            break
+        else:
+            group = [[event], event.end_time, box]
+            groups.append(group)
+            open_groups.append(group)
+    return [g[0] for g in groups]
+
+
+def _saved_group_request(c: Cutout_Service) -> Cutout_Service:
+    """
+    Find the saved request made for the same group of events as c: it was saved with the first event of the group, and has the same parameters.
+
+    :param c: A new request covering a group of events
+    :type c: Cutout_Service
+    :return: The saved request, covering the events of c, None if there is none
+    :rtype: Cutout_Service
+    """
+    fingerprint = c.fingerprint
+    query = (
+        Service_Request.select()
+        .where(
+            Service_Request.service_type == "cutout",
+            (Service_Request.fingerprint == fingerprint)
+            | (Service_Request.event == c.event),
+        )
+        .order_by(Service_Request.id)
+    )
+    for req in query:
+        found = Cutout_Service._from_model(req, events=c.events)
+        if found.fingerprint == fingerprint:
+            chat(f"I found a cutout request for the group of {len(c.events)} events")
+            return found
+    return None
+
+
+def coalesce_cutouts(
+    events: List[Hek_Event],
+    strict: bool = True,
+    max_fov: float = None,
+    size: Cutout_Size = None,
+) -> List[Cutout_Service]:
+    """
+    Create the cutout requests for a list of events, using a single request for each group of overlapping events (see :func:`group_events`).
+    The fits files of a request are linked to all of its events when the data is saved (see :class:`~solar.database.tables.join_event_fit.Join_Event_Fits`).
+
+    :param events: The events
+    :type events: List[Hek_Event]
+    :param strict: Whether to reuse the existing requests, made for the events that do not overlap with any other (see :meth:`Cutout_Service._from_events`), or with the same parameters as a group, defaults to True
+    :type strict: bool, optional
+    :param max_fov: The largest side of a request covering several events in arcsec, defaults to Config.cutout.coalesce_fov
+    :type max_fov: float, optional
+    :param size: How to size the field of view and the number of frames of the requests, defaults to Cutout_Size()
+    :type size: Cutout_Size, optional
+    :return: The requests
+    :rtype: List[Cutout_Service]
+    """
+    ret = []
+    groups = group_events(events, max_fov=max_fov, size=size)
+    single = [g[0] for g in groups if len(g) == 1]
+    if single:
+        ret.extend(Cutout_Service._from_events(single, strict=strict, size=size))
+    for group in groups:
+        if len(group) == 1:
+            continue
+        boxes = [event_box(e, size) for e in group]
+        c = Cutout_Service._from_box(
+            group,
+            min(b[0] for b in boxes),
+            max(b[1] for b in boxes),
+            min(b[2] for b in boxes),
+            max(b[3] for b in boxes),
+            size=size,
+        )
+        if strict:
+            c = _saved_group_request(c) or c
+        ret.append(c)
+    chat(f"{len(events)} events are covered by {len(ret)} cutout requests")
+    return ret
+
+
 def c_fetch(c: Cutout_Service, auto_save=True) -> Cutout_Service:
     """
     A wrapper function for processing cutout requests
@@ -328,41 +783,79 @@ def c_fetch(c: Cutout_Service, auto_save=True) -> Cutout_Service:
     return c
 
 
-def multi_cutout(list_of_reqs: List[Cutout_Service]) -> List[Cutout_Service]:
+def multi_cutout(
+    list_of_reqs: List[Cutout_Service], save_data: bool = False
+) -> List[Cutout_Service]:
     """
-    A multi threaded cutout requester. 
-    Accepts a list of cutout requests, processes them in parallel and then returns a list of the 
-    processed requests
+    A concurrent cutout requester. 
+    Accepts a list of cutout requests, submits them and tracks all of them with a single :class:`~solar.service.poller.Cutout_Poller`, and then returns a list of the 
+    processed requests. The requests are saved as soon as they are submitted, and again once they are finished, so that an interrupted run can be picked up by :func:`resume_cutouts`.
 
     WARNING: The order of the original list is not guaranteed to be preserved in the returned list
 
     :pram list_of_reds: List of requests to be processed
     :type list_of_reds: List[Cutout_Service]
+    :param save_data: Whether to save the fits files of each request as soon as it is finished, defaults to False
+    :type save_data: bool
     :return: List of completed request
     :retype: List[Cutout_Service]
     """
-    with ThreadPoolExecutor(max_workers=20) as executor:
-        total_jobs = len(list_of_reqs)
-        completed = 0
-        chat("Starting Requests")
+    total_jobs = len(list_of_reqs)
+    ret = []
+
+    def report(c):
+        # The files are saved before the request is marked as completed
+        if save_data and c.data:
+            c.save_data()
+        c.save_request()
+        ret.append(c)
         chat(
-            f"Currently there are {completed} finished fetches and {total_jobs-completed} pending fetches",
+            f"Currently there are {len(ret)} finished fetches and {total_jobs-len(ret)} pending fetches",
             end="\r",
         )
-        cmap = {executor.submit(c_fetch, c): c for c in list_of_reqs}
-        ret = []
 
-        for future in concurrent.futures.as_completed(cmap):
-            ret.append(future.result())
-            completed += 1
-            chat(
-                f"Currently there are {completed} finished fetches and {total_jobs-completed} pending fetches",
-                end="\r",
-            )
-        chat("\nDone")
+    poller = Cutout_Poller(on_complete=report, on_submit=lambda c: c.save_request())
+    chat("Starting Requests")
+    chat(
+        f"Currently there are 0 finished fetches and {total_jobs} pending fetches",
+        end="\r",
+    )
+    for c in list_of_reqs:
+        poller.add(c)
+    poller.run()
+    chat("\nDone")
+
+    failed = [c for c in ret if c.failures]
+    if failed:
+        print(f"{len(failed)} requests had failures:")
+        for c in failed:
+            for f in c.failures:
+                print(f"    {c.job_id or c.event}: {f.stage} -- {f.error}")
     return ret
 
 
+def resume_cutouts(save_data: bool = True) -> List[Cutout_Service]:
+    """
+    Pick up every saved cutout request that was submitted but never completed, for example because the process running :func:`multi_cutout` died,
+    and fetch its files. The jobs are not submitted again.
+
+    :param save_data: Whether to save the fits files of each request as soon as it is finished, defaults to True
+    :type save_data: bool
+    :return: List of processed requests
+    :rtype: List[Cutout_Service]
+    """
+    query = Service_Request.select().where(
+        (Service_Request.service_type == Cutout_Service.service_type)
+        & (Service_Request.status == "submitted")
+        & Service_Request.job_id.is_null(False)
+    )
+    reqs = [Cutout_Service._from_model(x) for x in query]
+    chat(f"Resuming {len(reqs)} submitted cutout requests")
+    if not reqs:
+        return []
+    return multi_cutout(reqs, save_data=save_data)
+
+
 if __name__ == "__main__":
     from solar.database import create_tables
 
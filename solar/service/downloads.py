@@ -1,43 +1,597 @@
+"""
+Downloads of the files found by the services.
+
+Files are staged in a ``.part`` file, resumed with range requests, and checked before being moved into place.
+Many files are downloaded at once by a :class:`Download_Engine`, which uses asyncio and aiohttp when they are available,
+and a pool of threads otherwise.
+"""
+
+import asyncio
+import hashlib
+import heapq
+import itertools
+import os
+import time
 import requests
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.exceptions import ChunkedEncodingError, HTTPError
+from concurrent.futures import ThreadPoolExecutor
+from threading import Condition, Lock
+from urllib.parse import urlparse
 import tqdm
 from pathlib import Path
+from solar.common.config import Config
+from solar.common.printing import chat
+from solar.service.client import Http_Client, Retry_Policy
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+#: Suffix of the file a download is written to, before it is moved to its final path
+part_suffix = ".part"
+
+
+class Download_Error(IOError):
+    """
+    Raised when a download is interrupted, or the downloaded file does not have the expected length or checksum
+    """
+
+
+def _expected_length(response, offset):
+    """
+    :return: The total length of the file, from the Content-Range or Content-Length header, None if unknown
+    :rtype: int
+    """
+    content_range = response.headers.get("Content-Range", "")
+    if "/" in content_range and not content_range.endswith("*"):
+        return int(content_range.rsplit("/", 1)[1])
+    # A compressed body does not have the length of the file
+    if "Content-Length" in response.headers and not response.headers.get(
+        "Content-Encoding"
+    ):
+        return offset + int(response.headers["Content-Length"])
+    return None
 
 
-def download_single_file(url, save_path):
+def _seed_hash(part, offset, hash_factory, chunk_size):
+    """
+    :return: A hash object fed with the first offset bytes already in the staging file
+    """
+    h = hash_factory()
+    if offset:
+        with open(part, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                h.update(chunk)
+    return h
+
+
+def _append(f, h, chunk):
+    f.write(chunk)
+    h.update(chunk)
+
+
+def _finish(url, part, path, h, expected_hash):
+    """
+    Check the checksum of a complete staging file, and move it to its final path.
+
+    :return: The checksum of the file
+    :rtype: str
+    """
+    digest = h.hexdigest()
+    if expected_hash and digest != expected_hash:
+        part.unlink()
+        raise Download_Error(f"Checksum of {url} is {digest}, expected {expected_hash}")
+    os.replace(part, path)
+    return digest
+
+
+def _resume(client, url, part, hash_factory, chunk_size, throttle=None):
+    """
+    Append the rest of the file to the staging file, restarting from the beginning if the server does not honour the range.
+
+    :return: The hash object, and the expected length of the file
+    :rtype: Tuple[Any, int]
+    """
+    offset = part.stat().st_size if part.is_file() else 0
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+    try:
+        response = client.get(url, stream=True, headers=headers)
+    except HTTPError as err:
+        if offset and getattr(err.response, "status_code", None) == 416:
+            # The staging file does not match the file on the server anymore
+            part.unlink()
+            return _resume(client, url, part, hash_factory, chunk_size, throttle)
+        raise
+    with response:
+        if offset and response.status_code != 206:
+            offset = 0
+        h = _seed_hash(part, offset, hash_factory, chunk_size)
+        expected = _expected_length(response, offset)
+        with open(part, "ab" if offset else "wb") as f:
+            try:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    if throttle:
+                        throttle(len(chunk))
+                    f.write(chunk)
+                    h.update(chunk)
+            except (
+                requests.ConnectionError,
+                requests.Timeout,
+                ChunkedEncodingError,
+            ) as err:
+                # What was received is kept, and resumed by download_single_file
+                raise Download_Error(f"Transfer of {url} interrupted: {err}") from err
+    return h, expected
+
+
+def download_single_file(
+    url,
+    save_path,
+    hash_factory=hashlib.md5,
+    chunk_size=8192,
+    expected_hash=None,
+    throttle=None,
+):
     """
     Download a file from a url.
 
+    The file is written to a staging file next to save_path (see :data:`part_suffix`), and only moved to save_path
+    once its length and checksum have been checked. An interrupted transfer is resumed with a range request,
+    both on the next attempt and by a later call, instead of starting again from the first byte.
+    The checksum is computed on the chunks as they are written, so the downloaded part is never read back nor held in memory.
+    Failed requests are retried by the http client, while this function only resumes the transfers interrupted after the response started.
+
     :param url: The url where the file is stored
     :type url: str
     :param save_path: The same location
     :type save_path: Union[str,Path]
+    :param hash_factory: The hashing function, defaults to hashlib.md5 (the same as :func:`~solar.common.utils.checksum`)
+    :type hash_factory: optional
+    :param chunk_size: Number of bytes written at a time, defaults to 8192
+    :type chunk_size: int, optional
+    :param expected_hash: The checksum the file must have, defaults to None (not checked)
+    :type expected_hash: str, optional
+    :param throttle: Called with the size of each chunk before it is written, to limit the bandwidth, defaults to None
+    :type throttle: Callable[[int], None], optional
+    :raises Download_Error: If the file is still incomplete after all the attempts, or does not have the expected checksum
+    :return: The checksum of the file
+    :rtype: str
     """
     p = Path(save_path)
     p.parent.mkdir(parents=True, exist_ok=True)
+    part = p.with_name(p.name + part_suffix)
 
-    with requests.get(url, stream=True) as r:
-        with open(p, "wb") as f:
-            for chunk in r.iter_content(chunk_size=8192):
-                f.write(chunk)
-    with open(p, "rb") as r:
-        h = hash(r.read())
-    return h
+    # Downloads wait for a failing server to recover rather than giving up
+    client = Http_Client(wait_open=True)
+    attempt = 0
+    while True:
+        try:
+            h, expected = _resume(client, url, part, hash_factory, chunk_size, throttle)
+            if expected is None or part.stat().st_size == expected:
+                break
+            error = Download_Error(
+                f"Received {part.stat().st_size} of {expected} bytes of {url}"
+            )
+        except Download_Error as e:
+            error = e
+        attempt += 1
+        if attempt >= client.retry.attempts:
+            raise error
+        chat(f"Download of {url} interrupted ({error}), resuming")
+        time.sleep(client.retry.delay(attempt - 1))
 
+    return _finish(url, part, p, h, expected_hash)
 
-def multi_downloader(download_struct):
+
+class Token_Bucket:
+    """
+    Limits the rate at which bytes are received. Up to burst bytes can be taken at once, after which
+    takers wait until the bucket has refilled at rate bytes per second.
+    Can be shared by threads and by coroutines.
     """
-    Download multiple files concurrently
+
+    def __init__(self, rate=None, burst=None):
+        """
+        :param rate: Bytes per second, defaults to None (no limit)
+        :type rate: float, optional
+        :param burst: Size of the bucket in bytes, defaults to one second of rate
+        :type burst: float, optional
+        """
+        self.rate = rate
+        self.burst = burst if burst else rate
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = Lock()
+
+    def _reserve(self, n):
+        """
+        Take n bytes from the bucket, which may go into debt.
+
+        :return: The time to wait before the bytes may be used, in seconds
+        :rtype: float
+        """
+        if not self.rate:
+            return 0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._last) * self.rate
+            )
+            self._last = now
+            self._tokens -= n
+            return max(0.0, -self._tokens / self.rate)
+
+    def take(self, n):
+        """
+        Take n bytes, sleeping until they are available.
+
+        :param n: Number of bytes
+        :type n: int
+        """
+        wait = self._reserve(n)
+        if wait:
+            time.sleep(wait)
+
+    async def wait(self, n):
+        """
+        Take n bytes, without blocking the event loop.
+
+        :param n: Number of bytes
+        :type n: int
+        """
+        wait = self._reserve(n)
+        if wait:
+            await asyncio.sleep(wait)
+
+
+class _Host_Queue:
+    """
+    The queued files, handed out in order of priority, but only while their host has fewer than per_host transfers in flight.
+    A file for a busy host therefore does not hold up the files for the other hosts.
+    """
+
+    def __init__(self, jobs, per_host):
+        self.per_host = per_host
+        self._waiting = {}
+        self._active = {}
+        for job in jobs:
+            heapq.heappush(self._waiting.setdefault(_host(job), []), job)
+
+    def __len__(self):
+        return sum(len(h) for h in self._waiting.values())
+
+    def pop(self):
+        """
+        :return: The file with the lowest priority among the hosts that have room, None if there is none
+        :rtype: Optional[tuple]
+        """
+        ready = [
+            heap
+            for host, heap in self._waiting.items()
+            if heap and self._active.get(host, 0) < self.per_host
+        ]
+        if not ready:
+            return None
+        job = heapq.heappop(min(ready, key=lambda heap: heap[0]))
+        self._active[_host(job)] = self._active.get(_host(job), 0) + 1
+        return job
+
+    def done(self, job):
+        self._active[_host(job)] -= 1
+
+
+def _host(job):
+    return urlparse(job[2]).netloc
+
+
+class Download_Engine:
+    """
+    Downloads many files at once.
+
+    Files are started in order of priority (lowest first), with at most max_concurrency transfers in flight,
+    at most per_host of them to the same host, and a total bandwidth of at most bandwidth bytes per second.
+    The asyncio backend keeps a pool of connections for each host, which makes thousands of small cutout files cheap.
+    It needs aiohttp; without it, or when an event loop is already running, the files are downloaded by a pool of threads.
+
+    Each file is staged and checked as in :func:`download_single_file`.
+    """
+
+    def __init__(
+        self,
+        max_concurrency=None,
+        per_host=None,
+        bandwidth=None,
+        chunk_size=None,
+        backend=None,
+        hash_factory=hashlib.md5,
+    ):
+        """
+        :param max_concurrency: Maximum number of transfers in flight, defaults to Config.download.max_concurrency
+        :type max_concurrency: int, optional
+        :param per_host: Maximum number of transfers to a single host, defaults to Config.download.per_host
+        :type per_host: int, optional
+        :param bandwidth: Maximum total bytes per second, defaults to Config.download.bandwidth
+        :type bandwidth: float, optional
+        :param chunk_size: Bytes read at a time, defaults to Config.download.chunk_size
+        :type chunk_size: int, optional
+        :param backend: "async", "threads" or "auto", defaults to Config.download.backend
+        :type backend: str, optional
+        :param hash_factory: The hashing function, defaults to hashlib.md5
+        :type hash_factory: optional
+        """
+        self.max_concurrency = (
+            max_concurrency if max_concurrency else Config.download.max_concurrency
+        )
+        self.per_host = per_host if per_host else Config.download.per_host
+        self.bucket = Token_Bucket(
+            bandwidth if bandwidth is not None else Config.download.bandwidth
+        )
+        self.chunk_size = chunk_size if chunk_size else Config.download.chunk_size
+        self.backend = backend if backend else Config.download.backend
+        self.hash_factory = hash_factory
+        self.retry = Retry_Policy()
+
+        self._queue = []
+        self._count = itertools.count()
+        self._stats_lock = Lock()
+
+        #: The checksum of each downloaded file, keyed by url
+        self.digests = {}
+        #: The error of each file that could not be downloaded, keyed by url
+        self.errors = {}
+        #: Number of bytes received during the last run
+        self.bytes_received = 0
+        #: Duration of the last run, in seconds
+        self.elapsed = 0
+
+    def __len__(self):
+        return len(self._queue)
+
+    def add(self, url, path, priority=0, expected_hash=None):
+        """
+        Queue a file.
+
+        :param url: The url of the file
+        :type url: str
+        :param path: Where to save the file
+        :type path: Union[str, Path]
+        :param priority: Files with a lower priority are started first, defaults to 0
+        :type priority: float, optional
+        :param expected_hash: The checksum the file must have, defaults to None (not checked)
+        :type expected_hash: str, optional
+        """
+        heapq.heappush(
+            self._queue,
+            (priority, next(self._count), url, Path(path), expected_hash),
+        )
+
+    @property
+    def throughput(self):
+        """
+        :return: Average bytes per second received during the last run
+        :rtype: float
+        """
+        return self.bytes_received / self.elapsed if self.elapsed else 0.0
+
+    def report(self):
+        """
+        :return: A summary of the last run
+        :rtype: str
+        """
+        return (
+            f"Downloaded {len(self.digests)} files ({self.bytes_received / 1024 ** 2:.1f} MB) "
+            f"in {self.elapsed:.1f}s, {self.throughput / 1024 ** 2:.2f} MB/s"
+            + (f", {len(self.errors)} failed" if self.errors else "")
+        )
+
+    def run(self, desc="Downloading files"):
+        """
+        Download all the queued files.
+
+        :param desc: Label of the progress bar, defaults to "Downloading files"
+        :type desc: str, optional
+        :return: The checksum of each downloaded file, keyed by url. Files that could not be downloaded are in :attr:`errors`.
+        :rtype: Dict[str, str]
+        """
+        jobs = [heapq.heappop(self._queue) for _ in range(len(self._queue))]
+        self.bytes_received = 0
+        start = time.perf_counter()
+        with tqdm.tqdm(total=len(jobs), desc=desc) as progress:
+            if self._use_async():
+                asyncio.run(self._run_async(jobs, progress))
+            else:
+                self._run_threads(jobs, progress)
+        self.elapsed = time.perf_counter() - start
+        return self.digests
+
+    def _use_async(self):
+        if self.backend == "threads" or (self.backend == "auto" and not aiohttp):
+            return False
+        if not aiohttp:
+            raise ImportError("The async download backend needs aiohttp")
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return True
+        # asyncio.run cannot be nested, for example in a notebook
+        return False
+
+    def _received(self, n):
+        with self._stats_lock:
+            self.bytes_received += n
+
+    def _done(self, url, progress, digest=None, error=None):
+        if error is None:
+            self.digests[url] = digest
+        else:
+            self.errors[url] = error
+            print(f"Could not download {url}: {error}")
+        progress.update()
+
+    def _run_threads(self, jobs, progress):
+        queue = _Host_Queue(jobs, self.per_host)
+        ready = Condition()
+
+        def throttle(n):
+            self.bucket.take(n)
+            self._received(n)
+
+        def worker():
+            while True:
+                with ready:
+                    job = queue.pop()
+                    while job is None and len(queue):
+                        # Only files for busy hosts are left
+                        ready.wait()
+                        job = queue.pop()
+                if job is None:
+                    return
+                _, _, url, path, expected_hash = job
+                try:
+                    digest = download_single_file(
+                        url,
+                        path,
+                        hash_factory=self.hash_factory,
+                        chunk_size=self.chunk_size,
+                        expected_hash=expected_hash,
+                        throttle=throttle,
+                    )
+                except (requests.RequestException, OSError) as e:
+                    digest, error = None, e
+                else:
+                    error = None
+                with ready:
+                    queue.done(job)
+                    self._done(url, progress, digest=digest, error=error)
+                    ready.notify_all()
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            for future in [
+                executor.submit(worker)
+                for _ in range(min(self.max_concurrency, len(jobs)))
+            ]:
+                future.result()
+
+    async def _run_async(self, jobs, progress):
+        queue = _Host_Queue(jobs, self.per_host)
+        ready = asyncio.Condition()
+        connector = aiohttp.TCPConnector(
+            limit=self.max_concurrency, limit_per_host=self.per_host
+        )
+        timeout = aiohttp.ClientTimeout(
+            sock_connect=Config.http.connect_timeout, sock_read=Config.http.timeout
+        )
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+
+            async def worker():
+                while True:
+                    async with ready:
+                        job = queue.pop()
+                        while job is None and len(queue):
+                            await ready.wait()
+                            job = queue.pop()
+                    if job is None:
+                        return
+                    _, _, url, path, expected_hash = job
+                    try:
+                        digest = await self._fetch_async(
+                            session, url, path, expected_hash
+                        )
+                    except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+                        self._done(url, progress, error=e)
+                    else:
+                        self._done(url, progress, digest=digest)
+                    async with ready:
+                        queue.done(job)
+                        ready.notify_all()
+
+            await asyncio.gather(
+                *[worker() for _ in range(min(self.max_concurrency, len(jobs)))]
+            )
+
+    async def _fetch_async(self, session, url, path, expected_hash):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        part = path.with_name(path.name + part_suffix)
+        attempt = 0
+        while True:
+            try:
+                h, expected = await self._resume_async(session, url, part)
+                if expected is None or part.stat().st_size == expected:
+                    break
+                error = Download_Error(
+                    f"Received {part.stat().st_size} of {expected} bytes of {url}"
+                )
+            except aiohttp.ClientResponseError as e:
+                if e.status not in Retry_Policy.retry_status:
+                    raise
+                error = e
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = e
+            attempt += 1
+            if attempt >= self.retry.attempts:
+                raise error
+            chat(f"Download of {url} interrupted ({error}), resuming")
+            await asyncio.sleep(self.retry.delay(attempt - 1))
+        return _finish(url, part, path, h, expected_hash)
+
+    async def _resume_async(self, session, url, part):
+        """
+        The asyncio version of :func:`_resume`
+        """
+        offset = part.stat().st_size if part.is_file() else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        async with session.get(url, headers=headers) as response:
+            stale = offset and response.status == 416
+            if not stale:
+                h, expected = await self._stream_async(response, part, offset)
+        if stale:
+            # The staging file does not match the file on the server anymore
+            part.unlink()
+            return await self._resume_async(session, url, part)
+        return h, expected
+
+    async def _stream_async(self, response, part, offset):
+        """
+        Append the body of a response to the staging file
+
+        :return: The hash object, and the expected length of the file
+        :rtype: Tuple[Any, int]
+        """
+        response.raise_for_status()
+        if offset and response.status != 206:
+            offset = 0
+        # Reading the staging file, writing and hashing are done on a thread, so the event loop keeps serving the other transfers
+        h = await asyncio.to_thread(
+            _seed_hash, part, offset, self.hash_factory, self.chunk_size
+        )
+        expected = _expected_length(response, offset)
+        with open(part, "ab" if offset else "wb") as f:
+            async for chunk in response.content.iter_chunked(self.chunk_size):
+                await self.bucket.wait(len(chunk))
+                self._received(len(chunk))
+                await asyncio.to_thread(_append, f, h, chunk)
+        return h, expected
+
+
+def multi_downloader(download_struct, priorities=None, engine=None):
+    """
+    Download multiple files concurrently, with a :class:`Download_Engine`.
 
     :param download_struct: A structure describing the desired download
     :type download_struct: Dict[str,Union[str,Path]]
+    :param priorities: The priority of some of the urls, lower first, defaults to None (all 0)
+    :type priorities: Dict[str, float], optional
+    :param engine: The engine to use, defaults to a Download_Engine configured by Config.download
+    :type engine: Download_Engine, optional
+    :return: The checksum of each downloaded file, keyed by url. Files that could not be downloaded are left out.
+    :rtype: Dict[str, str]
     """
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        futures = [
-            executor.submit(download_single_file, url, download_struct[url])
-            for url in download_struct
-        ]
-        for _ in tqdm.tqdm(
-            as_completed(futures), total=len(futures), desc="Downloading fits files"
-        ):
-            pass
+    priorities = priorities if priorities else {}
+    engine = engine if engine is not None else Download_Engine()
+    for url, path in download_struct.items():
+        engine.add(url, path, priority=priorities.get(url, 0))
+    digests = engine.run(desc="Downloading fits files")
+    if download_struct:
+        print(engine.report())
+    return digests
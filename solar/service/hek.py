@@ -1,20 +1,27 @@
 from __future__ import annotations
 from typing import List, Dict, Any
-import requests
 from datetime import datetime, timedelta
-from requests.exceptions import HTTPError
 import json
+from collections import OrderedDict
 import concurrent.futures as cf
 from solar.database.tables.hek_event import Hek_Event
 from solar.database.tables.service_request import Service_Request, Service_Parameter
+from solar.database.tables.coverage import Service_Coverage
+from solar.database.tables.join_request_event import Join_Request_Event
 from solar.service.attribute import Attribute as Att
 from solar.common.config import Config
-from threading import Lock
+from threading import Lock, Thread, Event
+import queue
 from tqdm import tqdm
 from solar.service.request import Base_Service
+from solar.service.utils import build_from_defaults, params_digest
+from solar.service.client import Http_Client, Concurrency_Limiter
+from solar.service.intervals import Interval_Planner, merge_ranges, uncovered
+from solar.service.cache import Response_Cache
+from solar.service.stream import Json_Array_Reader
 import peewee as pw
-from solar.service.utils import build_from_defaults
 from solar.common.printing import chat
+from solar.database.utils import bulk_upsert, dbroot
 
 
 class Hek_Service(Base_Service):
@@ -27,9 +34,6 @@ class Hek_Service(Base_Service):
 
     service_type = "hek"
 
-    # Lock to prevent data races
-    event_adder_lock = Lock()
-
     def __init__(self, *args, **kwargs):
         """
         Initialize the request.
@@ -83,115 +87,431 @@ class Hek_Service(Base_Service):
         # Construct the final parameter list by replacing defaults with user defined values
         self.params = build_from_defaults(defaults, temp)
 
-        self.start_time = [x for x in self.params if x.name == "event_starttime"][
-            0
-        ].value
-        self.end_time = [x for x in self.params if x.name == "event_endtime"][0].value
+        self.start_time = self.params["event_starttime"].value
+        self.end_time = self.params["event_endtime"].value
 
         self.found_count = 0
 
-        self._data = []
+        # The number of windows requested from the server during the last submission
+        self.windows_issued = 0
+
+        # The time ranges that have been completely searched, and not yet saved as coverage
+        self.covered = []
+        self.submitted_at = None
+
+        # The found events, keyed by event_id so that duplicates are dropped in constant time
+        self._data = {}
+        # Lock to prevent data races when merging the results of the interval requests
+        self._data_lock = Lock()
 
         self.status = "unsubmitted"
 
+        # The intervals that could not be fetched, even after retrying
+        self.failures = []
+
+        # When the request reached each stage, see Service_Stage
+        self.stage_times = {}
+        self._mark_stage("created")
+
+        # The raw json results are only kept if keep_raw is set, since they take a lot of memory on long searches
+        self.keep_raw = False
         self.for_testing_data = {"result": []}
 
+        # The client used to talk to the server. It also records the timing of each request.
+        # A search is split in many intervals, they wait for the server to recover rather than failing one after the other
+        self.client = Http_Client(wait_open=True)
+
+        # Responses are looked up here before being requested from the server
+        self.cache = (
+            Response_Cache(dbroot(Config.cache.path) / self.service_type)
+            if Config.cache.enabled
+            else None
+        )
+
     def __parse_attributes(self, params, **kwargs):
         """
         Parse attributes and return a dictionary that can be passed to a request object
 
         :param params: The params to parse
-        :type params: List[Attribute]
+        :type params: Attribute_Store
         :param kwargs: Additional key value pairs. 
         :rtype: Dict[str,Any]
         """
         other = [Att(key, kwargs[key]) for key in kwargs]
-        new_params = build_from_defaults(params, other)
-        return {att.name: att.value for att in new_params}
+        return params.merge(other).as_dict()
 
-    def __break_into_intervals(self, days=60):
-        """
-        Break the time interval into subintervals, to avoid reaching the HEK response limit
+    def __time_range(self):
+        return (
+            datetime.strptime(self.start_time, Config.time_format.hek),
+            datetime.strptime(self.end_time, Config.time_format.hek),
+        )
 
-        :param days: Interval length in days, defaults to 60
-        :type days: int, optional
-        :return: None
-        :rtype: None
+    def __make_planner(self, ranges):
         """
+        Create the planner that breaks the time ranges into windows, to avoid reaching the HEK response limit
 
-        start = datetime.strptime(self.start_time, Config.time_format.hek)
-        end = datetime.strptime(self.end_time, Config.time_format.hek)
-
-        interval = timedelta(days=days)
-        ret = []
-
-        current_time = start
-        while current_time < end:
-            next_time = current_time + interval
-            if next_time < end:
-                ret.append((current_time, next_time))
-            else:
-                ret.append((current_time, end))
-            current_time = next_time
-        return [
-            (x.strftime(Config.time_format.hek), y.strftime(Config.time_format.hek))
-            for x, y in ret
-        ]
+        :param ranges: The time ranges to search
+        :type ranges: List[Tuple[datetime.datetime, datetime.datetime]]
+        :return: The planner
+        :rtype: Interval_Planner
+        """
+        (start, end), *rest = ranges
+        return Interval_Planner(
+            start,
+            end,
+            ranges=rest,
+            days=Config.hek.interval_days,
+            limit=Config.hek.result_limit,
+            min_window=timedelta(hours=Config.hek.min_interval_hours),
+            max_window=timedelta(days=Config.hek.max_interval_days),
+        )
 
-    def _request_one_interval(self, start_time, end_time):
+    def _request_one_interval(self, start_time, end_time, sink=None):
         """
         Make a request to the HEK server for a single time interval
 
         :param start_time: Start time
-        :type start_time: datetime.datetime
+        :type start_time: str
         :param end_time: End time
-        :type end_time: datetime.datetime
-        :return: None   
-        :rtype: None
+        :type end_time: str
+        :param sink: If given, the response is parsed as it is received and each event is passed to this function instead of being stored in the data, defaults to None
+        :type sink: Callable[[Hek_Event], None], optional
+        :return: The number of events returned and whether the server reported that there were more, or None if the request failed
+        :rtype: Optional[Tuple[int, bool]]
         """
         to_pass = self.__parse_attributes(
             self.params, event_starttime=start_time, event_endtime=end_time
         )
+        json_data = self.cache.get(to_pass) if self.cache else None
+        if json_data is None and sink:
+            return self.__stream_interval(to_pass, sink)
+        if json_data is None:
+            try:
+                response = self.client.get(self.base_url, params=to_pass)
+                json_data = response.json()
+            except Exception as err:
+                self._record_failure((start_time, end_time), "request", err)
+            else:
+                if self.cache:
+                    self.cache.put(to_pass, json_data)
+        if json_data is not None:
+            # Parsing happens outside the lock, only the merge is serialized
+            events = [Hek_Event.from_hek(x, source="HEK") for x in json_data["result"]]
+            if self.keep_raw:
+                with self._data_lock:
+                    self.for_testing_data["result"].extend(json_data["result"])
+            if sink:
+                for e in events:
+                    sink(e)
+            else:
+                with self._data_lock:
+                    for e in events:
+                        self._data.setdefault(e.event_id, e)
+            self.status = "completed"
+            return len(json_data["result"]), bool(json_data.get("overmax", False))
+        return None
+
+    def __stream_interval(self, to_pass, sink):
+        """
+        Request a single interval, passing each event to the sink as soon as it has been parsed.
+        Responses are not added to the cache in this mode.
+        """
         try:
-            response = requests.get(Hek_Service.base_url, params=to_pass)
-        except HTTPError as http_err:
-            print(f"HTTP error occurred: {http_err}")  # Python 3.6
+            response = self.client.get(self.base_url, params=to_pass, stream=True)
+            reader = Json_Array_Reader(
+                response.iter_content(chunk_size=Config.hek.stream_chunk), "result"
+            )
+            for raw in reader:
+                if self.keep_raw:
+                    with self._data_lock:
+                        self.for_testing_data["result"].append(raw)
+                sink(Hek_Event.from_hek(raw, source="HEK"))
         except Exception as err:
-            print(f"Other error occurred: {err}")  # Python 3.6
+            interval = (to_pass["event_starttime"], to_pass["event_endtime"])
+            self._record_failure(interval, "request", err)
         else:
-            json_data = response.json()
-            with Hek_Service.event_adder_lock:
-                events = [
-                    Hek_Event.from_hek(x, source="HEK") for x in json_data["result"]
-                ]
-                self.for_testing_data["result"].extend(json_data["result"])
-                for e in events:
-                    if not e in self._data:
-                        self.data.append(e)
             self.status = "completed"
+            return reader.count, reader.flag("overmax")
+        return None
 
     @property
     def data(self):
-        return self._data
+        """
+        The events found by the request, in the order they were found.
 
-    def submit_request(self):
+        :rtype: List[Hek_Event]
+        """
+        return list(self._data.values())
+
+    @data.setter
+    def data(self, events):
+        self._data = {}
+        for e in events:
+            self._data.setdefault(e.event_id, e)
+
+    @property
+    def timings(self):
+        """
+        The timing of the requests made to the server by this service, at most the last Config.http.max_timings of them.
+
+        :return: The timings, in the order the requests completed
+        :rtype: Deque[Request_Timing]
+        """
+        return self.client.timings
+
+    @property
+    def coverage_hash(self):
+        """
+        Hash of the parameters of this request, ignoring the time range.
+        Requests with the same hash search for the same events, and can share their coverage.
+
+        :rtype: str
+        """
+        return params_digest(self.params, exclude=("event_starttime", "event_endtime"))
+
+    def find_gaps(self):
+        """
+        Find the parts of the time range of this request that have not yet been searched by an equivalent saved request
+
+        :return: The time ranges that have not been covered
+        :rtype: List[Tuple[datetime.datetime, datetime.datetime]]
+        """
+        start, end = self.__time_range()
+        query = Service_Coverage.select().where(
+            (Service_Coverage.param_hash == self.coverage_hash)
+            & (Service_Coverage.end_time > start)
+            & (Service_Coverage.start_time < end)
+        )
+        return uncovered(start, end, [(c.start_time, c.end_time) for c in query])
+
+    def __covered_events(self):
+        """
+        :return: The saved events of the time range, found by the equivalent requests that covered it
+        :rtype: List[Hek_Event]
+        """
+        start, end = self.__time_range()
+        requests = Service_Coverage.select(Service_Coverage.service_request).where(
+            Service_Coverage.param_hash == self.coverage_hash
+        )
+        return list(
+            Hek_Event.select()
+            .join(Join_Request_Event)
+            .where(
+                Join_Request_Event.service_request.in_(requests),
+                Hek_Event.end_time >= start,
+                Hek_Event.start_time <= end,
+            )
+            .distinct()
+        )
+
+    def submit_request(self, max_workers=None, incremental=False):
         """
         Submit a request to the HEK service.
+
+        The time range is broken into intervals that are requested concurrently.
+        The number of requests in flight starts at max_workers and is reduced if the server starts responding slowly.
+
+        :param max_workers: The maximum number of concurrent requests, defaults to Config.hek.max_workers
+        :type max_workers: int, optional
+        :param incremental: Only search the parts of the time range that have not been covered by an equivalent saved request, defaults to False
+        :type incremental: bool, optional
         """
-        intervals = self.__break_into_intervals()
-        with cf.ThreadPoolExecutor(max_workers=5) as executor:
-            ret = [
-                executor.submit(self._request_one_interval, *interval)
-                for interval in intervals
-            ]
-            for _ in tqdm(
-                cf.as_completed(ret),
-                total=len(intervals),
-                desc="Requesting Events from HEK",
-            ):
-                pass
-
-        print(f"Found {len(self._data)} new events")
+        self.__run(max_workers, incremental)
+        print(
+            f"Found {len(self._data)} new events using {self.windows_issued} requests"
+        )
+        if self.cache:
+            chat(f"Cache hits: {self.cache.hits}, misses: {self.cache.misses}")
+
+    def iter_events(self, max_workers=None, incremental=False):
+        """
+        Submit a request to the HEK service, yielding the events as they are received.
+
+        The responses are parsed incrementally, and the events are not stored in :attr:`data`,
+        so the memory used does not grow with the length of the search.
+        Events found by several windows are only yielded once, as long as they are found within Config.hek.stream_seen events of each other.
+
+        :param max_workers: The maximum number of concurrent requests, defaults to Config.hek.max_workers
+        :type max_workers: int, optional
+        :param incremental: Only search the parts of the time range that have not been covered by an equivalent saved request, defaults to False
+        :type incremental: bool, optional
+        :return: Generator of the new events
+        :rtype: Iterator[Hek_Event]
+        """
+        events = queue.Queue(maxsize=Config.hek.stream_buffer)
+        stop = Event()
+        # The ids of the most recent events, oldest first
+        seen = OrderedDict()
+        seen_lock = Lock()
+        found = 0
+        finished = object()
+        errors = []
+
+        def sink(e):
+            nonlocal found
+            with seen_lock:
+                if e.event_id in seen:
+                    seen.move_to_end(e.event_id)
+                    return
+                seen[e.event_id] = None
+                if len(seen) > Config.hek.stream_seen:
+                    seen.popitem(last=False)
+                found += 1
+            while not stop.is_set():
+                try:
+                    events.put(e, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+
+        def produce():
+            try:
+                self.__run(max_workers, incremental, sink=sink, stop=stop)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                while not stop.is_set():
+                    try:
+                        events.put(finished, timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+
+        # The windows covered before this search, the others are dropped if it is not read to the end
+        covered = len(self.covered)
+        producer = Thread(target=produce, daemon=True)
+        producer.start()
+        complete = False
+        try:
+            while True:
+                e = events.get()
+                if e is finished:
+                    complete = True
+                    break
+                yield e
+        finally:
+            stop.set()
+            producer.join()
+            if not complete:
+                del self.covered[covered:]
+        if errors:
+            raise errors[0]
+        chat(f"Found {found} new events using {self.windows_issued} requests")
+
+    def save_stream(self, max_workers=None, incremental=False, chunk_size=None):
+        """
+        Submit a request to the HEK service, saving the events to the database as they are received.
+        The events are not stored in :attr:`data`.
+
+        :param max_workers: The maximum number of concurrent requests, defaults to Config.hek.max_workers
+        :type max_workers: int, optional
+        :param incremental: Only search the parts of the time range that have not been covered by an equivalent saved request, defaults to False
+        :type incremental: bool, optional
+        :param chunk_size: Number of events saved at a time, defaults to Config.bulk.insert_chunk
+        :type chunk_size: int, optional
+        :return: The number of events received
+        :rtype: int
+        """
+        chunk_size = chunk_size if chunk_size else Config.bulk.insert_chunk
+        total = 0
+        saved = []
+        for batch in pw.chunked(self.iter_events(max_workers, incremental), chunk_size):
+            saved.extend(e.id for e in bulk_upsert(Hek_Event, batch, "event_id"))
+            total += len(batch)
+        # Only now are all the events of the covered time ranges in the database
+        self.__commit_events(saved)
+        return total
+
+    def __run(self, max_workers=None, incremental=False, sink=None, stop=None):
+        """
+        Request all the intervals of the search
+
+        :param sink: Passed to :meth:`_request_one_interval`, defaults to None
+        :type sink: Callable[[Hek_Event], None], optional
+        :param stop: Once set, no more windows are requested, and the windows still in flight are not marked as covered, defaults to None
+        :type stop: threading.Event, optional
+        """
+
+        def stopped():
+            return stop is not None and stop.is_set()
+
+        self.submitted_at = datetime.utcnow()
+        self._mark_stage("submitted")
+        if not incremental:
+            duplicate = self._find_duplicate()
+            if duplicate:
+                chat(
+                    f"Request {duplicate.id} made the same search, I will load the events it saved and only search the time ranges it did not cover"
+                )
+                for e in self.__covered_events():
+                    if stopped():
+                        return
+                    if sink:
+                        sink(e)
+                    else:
+                        with self._data_lock:
+                            self._data.setdefault(e.event_id, e)
+                incremental = True
+        ranges = self.find_gaps() if incremental else [self.__time_range()]
+        if not ranges:
+            chat("The whole time range has already been searched")
+            self.windows_issued = 0
+            self.status = "completed"
+            self._mark_stage("completed")
+            return
+
+        max_workers = max_workers if max_workers else Config.hek.max_workers
+        self.client.limiter = Concurrency_Limiter(
+            max_workers,
+            min_limit=Config.hek.min_workers,
+            latency_factor=Config.hek.latency_factor,
+        )
+        planner = self.__make_planner(ranges)
+        hek_format = Config.time_format.hek
+        with cf.ThreadPoolExecutor(max_workers=max_workers) as executor, tqdm(
+            desc="Requesting Events from HEK"
+        ) as progress:
+            pending = {}
+            while (planner.has_next() and not stopped()) or pending:
+                while (
+                    planner.has_next() and not stopped() and len(pending) < max_workers
+                ):
+                    window = planner.next_window()
+                    future = executor.submit(
+                        self._request_one_interval,
+                        *[x.strftime(hek_format) for x in window],
+                        sink=sink,
+                    )
+                    pending[future] = window
+                done, _ = cf.wait(pending, return_when=cf.FIRST_COMPLETED)
+                for future in done:
+                    window = pending.pop(future)
+                    result = future.result()
+                    progress.update()
+                    # Once stopped, the events of the window may have been dropped
+                    if stopped() or result is None:
+                        continue
+                    outcome = planner.report(window, *result)
+                    if outcome == Interval_Planner.COMPLETE:
+                        self.covered.append(window)
+                    elif outcome == Interval_Planner.TRUNCATED:
+                        # Some events of the window are missing, it must be searched again
+                        self._record_failure(
+                            tuple(x.strftime(hek_format) for x in window),
+                            "truncated",
+                            RuntimeError(
+                                f"The window reached the limit of {planner.limit} events and is too short to be split"
+                            ),
+                        )
+
+        self.windows_issued = planner.issued
+        if self.status == "completed":
+            self._mark_stage("completed")
+        if self.failures:
+            print(
+                f"{len(self.failures)} intervals could not be fetched, see the failures attribute. "
+                "Once the data is saved, they can be fetched with an incremental request."
+            )
 
     def fetch_data(self):
         """
@@ -205,22 +525,49 @@ class Hek_Service(Base_Service):
 
     def save_data(self):
         """
-        Save the data found from the request to the database
+        Save the data found from the request to the database.
+        Events that are already in the database are replaced by the existing rows.
         """
-        self._data = [
-            e
-            if Hek_Event.select().where(Hek_Event.event_id == e.event_id).count() == 0
-            else Hek_Event.select().where(Hek_Event.event_id == e.event_id).get()
-            for e in self._data
+        self.data = bulk_upsert(Hek_Event, self.data, "event_id")
+        chat(f"Saved {len(self._data)} events to the database")
+        self.__commit_events([e.id for e in self.data])
+
+    def __commit_events(self, event_ids):
+        """
+        Link the saved events to the request, and save the time ranges that have been completely searched,
+        so that incremental requests skip them. This must only be called once the events are in the database.
+        The request is saved first if needed.
+
+        :param event_ids: The ids of the saved events
+        :type event_ids: List[int]
+        """
+        if not event_ids and not self.covered:
+            return
+        if not self.service_request_id:
+            self.save_request()
+        if not self.service_request_id:
+            return
+        Join_Request_Event.link(self.service_request_id, event_ids)
+        self.__save_coverage()
+
+    def __save_coverage(self):
+        if not self.covered:
+            return
+        # Events show up in HEK some time after they occur, so recent times are not considered covered
+        limit = self.submitted_at - timedelta(days=Config.hek.settle_days)
+        rows = [
+            dict(
+                service_request=self.service_request_id,
+                param_hash=self.coverage_hash,
+                start_time=start,
+                end_time=min(end, limit),
+            )
+            for start, end in merge_ranges(self.covered)
+            if start < limit
         ]
-        for e in self.data:
-            try:
-                e.save()
-            except pw.IntegrityError as err:
-                print(err)
-                chat(
-                    f"Looks like the event {e} is already in the database, so I am replacing it with the existing one"
-                )
+        if rows:
+            Service_Coverage.insert_many(rows).execute()
+        self.covered = []
 
     @staticmethod
     def _from_model(serv_obj):
@@ -237,7 +584,7 @@ class Hek_Service(Base_Service):
         return h
 
     def __getitem__(self, key):
-        return [x for x in self.params if x.name == key][0].value
+        return self.params[key].value
 
 
 if __name__ == "__main__":
@@ -246,8 +593,9 @@ if __name__ == "__main__":
     create_tables()
     x, y = ("2010-06-01T00:00:00", "2010-07-01T00:00:00")
     h = Hek_Service(event_starttime=x, event_endtime=y)
+    h.keep_raw = True
     h.submit_request()
     with open("hek_1.txt", "w") as f:
-        f.write(json.dumps({"params": {a.name: a.value for a in h.params}}))
+        f.write(json.dumps({"params": h.params.as_dict()}))
         f.write("\n")
         f.write(json.dumps(h.for_testing_data, indent=4))
@@ -0,0 +1,195 @@
+from collections import deque
+from datetime import timedelta
+
+
+class Interval_Planner:
+    """
+    Plans the time windows used to query a service with a cap on the number of results per response.
+
+    Windows that come back full are split in half and requested again, so that no results are lost.
+    The length of the windows that have not yet been issued is chosen from the event density seen so far,
+    so that sparse periods are covered by a few long windows and dense periods by many short ones.
+    """
+
+    # The outcomes of a reported window
+    COMPLETE = "complete"
+    SPLIT = "split"
+    TRUNCATED = "truncated"
+
+    def __init__(
+        self,
+        start,
+        end,
+        days=60,
+        limit=None,
+        min_window=timedelta(hours=1),
+        max_window=timedelta(days=360),
+        target_fill=0.5,
+        ranges=(),
+    ):
+        """
+        :param start: Start of the time range
+        :type start: datetime.datetime
+        :param end: End of the time range
+        :type end: datetime.datetime
+        :param days: Length of the windows issued before any density information is available, defaults to 60
+        :type days: int, optional
+        :param limit: The maximum number of results the server returns for one request, defaults to None (no limit)
+        :type limit: int, optional
+        :param min_window: Windows shorter than this are never split, defaults to one hour
+        :type min_window: datetime.timedelta, optional
+        :param max_window: The longest window that will be issued, defaults to 360 days
+        :type max_window: datetime.timedelta, optional
+        :param target_fill: The fraction of the limit new windows are sized to reach, defaults to 0.5
+        :type target_fill: float, optional
+        :param ranges: Additional time ranges to cover after the first one, defaults to ()
+        :type ranges: List[Tuple[datetime.datetime, datetime.datetime]], optional
+        """
+        self.start = start
+        self.end = end
+        self.cursor = start
+        # Ranges still to be covered once the current one is done
+        self.ranges = deque(ranges)
+        self.initial_window = timedelta(days=days)
+        self.limit = limit
+        self.min_window = min_window
+        self.max_window = max(max_window, self.initial_window)
+        self.target_fill = target_fill
+
+        # Windows that were split and must be requested again
+        self.retry = deque()
+
+        self._events = 0
+        self._covered = timedelta(0)
+
+        #: Number of windows handed out
+        self.issued = 0
+        #: Number of windows that were split because they reached the limit
+        self.splits = 0
+        #: Number of windows that reached the limit but were too short to be split
+        self.truncations = 0
+
+    @property
+    def rate(self):
+        """
+        The number of events per second observed in the completed windows, or None if nothing has been completed
+
+        :rtype: float
+        """
+        if not self._covered:
+            return None
+        return self._events / self._covered.total_seconds()
+
+    def has_next(self):
+        """
+        :return: True if there are windows left to request
+        :rtype: bool
+        """
+        self._next_range()
+        return bool(self.retry) or self.cursor < self.end
+
+    def _next_range(self):
+        while self.cursor >= self.end and self.ranges:
+            self.start, self.end = self.ranges.popleft()
+            self.cursor = self.start
+
+    def next_window(self):
+        """
+        Get the next window to request. Split windows are always handed out first.
+
+        :return: The start and end of the window
+        :rtype: Tuple[datetime.datetime, datetime.datetime]
+        """
+        self._next_range()
+        if self.retry:
+            window = self.retry.popleft()
+        else:
+            next_time = min(self.cursor + self._next_length(), self.end)
+            window = (self.cursor, next_time)
+            self.cursor = next_time
+        self.issued += 1
+        return window
+
+    def _next_length(self):
+        rate = self.rate
+        if rate is None or not self.limit:
+            return self.initial_window
+        if rate == 0:
+            return self.max_window
+        length = timedelta(seconds=self.target_fill * self.limit / rate)
+        return max(self.min_window, min(self.max_window, length))
+
+    def report(self, window, count, truncated=False):
+        """
+        Report the result of a request.
+
+        :param window: The window that was requested
+        :type window: Tuple[datetime.datetime, datetime.datetime]
+        :param count: The number of results returned
+        :type count: int
+        :param truncated: Whether the server indicated that there were more results, defaults to False
+        :type truncated: bool, optional
+        :return: SPLIT if the window was split and must be requested again, TRUNCATED if it reached the limit
+            but is too short to be split, so that some of its results are missing, COMPLETE otherwise
+        :rtype: str
+        """
+        start, end = window
+        full = truncated or (self.limit and count >= self.limit)
+        if full and end - start >= 2 * self.min_window:
+            middle = start + (end - start) / 2
+            middle = middle.replace(microsecond=0)
+            self.retry.extend([(start, middle), (middle, end)])
+            self.splits += 1
+            return self.SPLIT
+        self._events += count
+        self._covered += end - start
+        if full:
+            self.truncations += 1
+            return self.TRUNCATED
+        return self.COMPLETE
+
+
+def merge_ranges(ranges):
+    """
+    Merge overlapping or touching time ranges
+
+    :param ranges: The ranges
+    :type ranges: List[Tuple[datetime.datetime, datetime.datetime]]
+    :return: Sorted list of disjoint ranges
+    :rtype: List[Tuple[datetime.datetime, datetime.datetime]]
+    """
+    ret = []
+    for start, end in sorted(ranges):
+        if ret and start <= ret[-1][1]:
+            ret[-1] = (ret[-1][0], max(ret[-1][1], end))
+        else:
+            ret.append((start, end))
+    return ret
+
+
+def uncovered(start, end, covered):
+    """
+    Find the parts of a time range that are not covered by a list of ranges
+
+    :param start: Start of the time range
+    :type start: datetime.datetime
+    :param end: End of the time range
+    :type end: datetime.datetime
+    :param covered: The ranges that are already covered
+    :type covered: List[Tuple[datetime.datetime, datetime.datetime]]
+    :return: The gaps, in order
+    :rtype: List[Tuple[datetime.datetime, datetime.datetime]]
+    """
+    gaps = []
+    cursor = start
+    for c_start, c_end in merge_ranges(covered):
+        if c_end <= cursor:
+            continue
+        if c_start >= end:
+            break
+        if c_start > cursor:
+            gaps.append((cursor, c_start))
+        cursor = max(cursor, c_end)
+    if cursor < end:
+        gaps.append((cursor, end))
+    return gaps
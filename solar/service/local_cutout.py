@@ -0,0 +1,355 @@
+"""
+Cutouts made from full-disk fits files that are already stored on the local disk, without going through the SSW queue.
+"""
+
+from __future__ import annotations
+from typing import List
+import bisect
+import fnmatch
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from threading import Lock
+from astropy.io import fits
+from solar.common.config import Config
+from solar.common.fits_io import compress_fits, image_hdu
+from solar.common.printing import chat
+from solar.common.utils import checksum, into_number
+from solar.database.tables.file_blob import File_Blob
+from solar.database.tables.fits_file import Fits_File
+from solar.database.tables.hek_event import Hek_Event
+from solar.database.utils import dbroot
+from .cutout import Cutout_Service, Cutout_Size
+from .utils import params_digest
+
+# Header keywords that describe the layout of the original file, and must not be copied to the cutouts
+_layout_keys = ["XTENSION", "PCOUNT", "GCOUNT", "EXTNAME", "BSCALE", "BZERO", "BLANK"]
+_layout_keys += ["CHECKSUM", "DATASUM"]
+
+_index = {}
+_scans = {}
+_index_lock = Lock()
+
+
+def _read_info(path):
+    with fits.open(path, memmap=True) as hdul:
+        header = image_hdu(hdul).header
+        time = datetime.strptime(header["DATE-OBS"][:19], Config.time_format.hek)
+        return time, into_number(header.get("WAVELNTH"))
+
+
+def _scan(root, rescan=False):
+    """
+    List the full-disk files under a directory, sorted by observation time.
+
+    The listing is kept, along with the modification time of every directory it went through, and is only made again
+    when one of them changed (a file was added, removed or replaced) or when rescan is set.
+    The headers are only read for the files that are new or were modified since they were last read.
+
+    :return: The observation times, and the paths, observation times and wavelengths of the files, in the same order
+    :rtype: Tuple[List[datetime.datetime], List[Tuple[Path, datetime.datetime, int]]]
+    """
+    with _index_lock:
+        scan = _scans.get(root)
+    if scan and not rescan:
+        dirs, times, entries = scan
+        try:
+            if all(os.stat(d).st_mtime_ns == m for d, m in dirs.items()):
+                return times, entries
+        except OSError:
+            pass
+
+    dirs = {}
+    entries = []
+    for d, _, names in os.walk(root):
+        dirs[d] = os.stat(d).st_mtime_ns
+        for name in fnmatch.filter(names, Config.local_cutout.pattern):
+            p = Path(d) / name
+            mtime = p.stat().st_mtime
+            with _index_lock:
+                entry = _index.get(p)
+            if not entry or entry[0] != mtime:
+                try:
+                    entry = (mtime, *_read_info(p))
+                except (OSError, KeyError, ValueError) as e:
+                    chat(f"Skipping {p}: {e}")
+                    continue
+                with _index_lock:
+                    _index[p] = entry
+            entries.append((p, entry[1], entry[2]))
+    entries.sort(key=lambda x: x[1])
+    times = [x[1] for x in entries]
+    with _index_lock:
+        _scans[root] = (dirs, times, entries)
+    return times, entries
+
+
+def find_full_disk(start, end, waves=None, path=None, rescan=False):
+    """
+    Find the local full-disk files observed in a time range.
+
+    Only the headers of the files are read, and the directory is only listed again once it changed (see :func:`_scan`),
+    so repeated searches neither read the files nor walk the directory again.
+    A file modified in place, without being replaced, is only read again with rescan.
+
+    :param start: Start of the time range
+    :type start: datetime.datetime
+    :param end: End of the time range
+    :type end: datetime.datetime
+    :param waves: The wavelengths to keep, defaults to None (all)
+    :type waves: List[int], optional
+    :param path: The directory to search (recursively), defaults to Config.local_cutout.path under Config.db_save
+    :type path: Union[str, Path], optional
+    :param rescan: Whether to list the directory again, even if it did not change, defaults to False
+    :type rescan: bool, optional
+    :return: The paths, observation times and wavelengths of the files, sorted by time
+    :rtype: List[Tuple[Path, datetime.datetime, int]]
+    """
+    root = Path(path) if path else dbroot(Config.local_cutout.path)
+    times, entries = _scan(root, rescan)
+    found = entries[bisect.bisect_left(times, start) : bisect.bisect_right(times, end)]
+    return [x for x in found if not waves or x[2] in waves]
+
+
+def crop_fits(source, dest, x_min, x_max, y_min, y_max):
+    """
+    Crop a box out of a fits image, and write it as a new file.
+
+    Only the part of the image inside the box is read from the disk (through a memory map, or the tiles covering the box for compressed files).
+    The box is converted to pixels using the reference pixel and the plate scale in the header. The header of the cutout is adjusted so that its coordinates are still correct.
+
+    :param source: The full image
+    :type source: Union[str, Path]
+    :param dest: Where to write the cutout
+    :type dest: Union[str, Path]
+    :param x_min: The box, in arcsec
+    :type x_min: float
+    :return: The shape of the cutout, None if the box is outside of the image
+    :rtype: Tuple[int, int]
+    """
+    with fits.open(source, memmap=True) as hdul:
+        hdu = image_hdu(hdul)
+        header = hdu.header
+
+        def to_pixel(value, axis):
+            return (
+                header[f"CRPIX{axis}"]
+                - 1
+                + (value - header.get(f"CRVAL{axis}", 0)) / header[f"CDELT{axis}"]
+            )
+
+        x0 = max(0, int(round(to_pixel(x_min, 1))))
+        x1 = min(header["NAXIS1"], int(round(to_pixel(x_max, 1))))
+        y0 = max(0, int(round(to_pixel(y_min, 2))))
+        y1 = min(header["NAXIS2"], int(round(to_pixel(y_max, 2))))
+        if x1 <= x0 or y1 <= y0:
+            return None
+
+        data = hdu.section[y0:y1, x0:x1]
+        new_header = header.copy()
+        for key in _layout_keys:
+            new_header.remove(key, ignore_missing=True, remove_all=True)
+        new_header["CRPIX1"] = header["CRPIX1"] - x0
+        new_header["CRPIX2"] = header["CRPIX2"] - y0
+
+    Path(dest).parent.mkdir(parents=True, exist_ok=True)
+    fits.PrimaryHDU(data, header=new_header).writeto(dest, overwrite=True)
+    return data.shape
+
+
+class Local_Cutout_Service(Cutout_Service):
+    """
+    A cutout service with the same interface as :class:`~solar.service.cutout.Cutout_Service`, that crops full-disk files stored on the local disk
+    (see ``Config.local_cutout``) instead of submitting a job to SSW.
+
+    :meth:`submit_request` finds the full-disk files matching the request, and :meth:`fetch_data` crops them in parallel.
+    """
+
+    service_type = "local_cutout"
+
+    @staticmethod
+    def _from_event(
+        event: Hek_Event, strict: bool = False, size: Cutout_Size = None
+    ) -> Local_Cutout_Service:
+        """
+        Create a local cutout from a solar event, with the same parameters as a cutout from SSW.
+
+        :param event: The event
+        :type event: Hek_Event
+        :param strict: Unused, local cutouts are cheap enough to be remade, defaults to False
+        :type strict: bool, optional
+        :param size: How to size the field of view and the number of frames, defaults to Cutout_Size()
+        :type size: Cutout_Size, optional
+        :rtype: Local_Cutout_Service
+        """
+        remote = Cutout_Service._from_event(event, strict=False, size=size)
+        c = Local_Cutout_Service(*remote.params)
+        c.event = remote.event
+        c.events = remote.events
+        return c
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._sources = []
+
+    def box(self):
+        """
+        :return: x_min, x_max, y_min, y_max of the field of view, in arcsec
+        :rtype: Tuple[float, float, float, float]
+        """
+        xcen, ycen = self.params["xcen"].value, self.params["ycen"].value
+        fovx, fovy = self.params["fovx"].value, self.params["fovy"].value
+        return (xcen - fovx / 2, xcen + fovx / 2, ycen - fovy / 2, ycen + fovy / 2)
+
+    def submit_request(self, auto_save=True):
+        """
+        Find the local full-disk files covering the request. At most max_frames files are kept for each wavelength, evenly spread in time.
+
+        :param auto_save: whether to autosave the request, defaults to True
+        :type auto_save: bool
+        :return: Whether any file was found
+        :rtype: bool
+        """
+        found = find_full_disk(
+            self.params["starttime"].value, self.params["endtime"].value, self.waves
+        )
+        max_frames = self.params["max_frames"].value
+        self._sources = []
+        for wave in sorted({x[2] for x in found}, key=str):
+            files = [x for x in found if x[2] == wave]
+            if max_frames and len(files) > max_frames:
+                step = len(files) / max_frames
+                files = [files[int(i * step)] for i in range(max_frames)]
+            self._sources.extend(files)
+        if not self._sources:
+            self._record_failure(
+                self.event, "submit", FileNotFoundError("No local full-disk files")
+            )
+            return False
+
+        # The same parameters always produce the same cutouts
+        self.job_id = "local_" + params_digest(self.params)[:16]
+        self._mark_stage("submitted")
+        self.status = "submitted"
+        if auto_save:
+            self.save_request()
+        return True
+
+    def fetch_data(self, delay=None, auto_save=True):
+        """
+        Crop the full-disk files, using Config.local_cutout.workers threads. The cutouts are stored in :attr:`data`.
+
+        :param delay: Unused
+        :param auto_save: Save the request automatically, defaults to True
+        :type auto_save: bool
+        :return: Whether any cutout was made
+        :rtype: bool
+        """
+        if not self._sources and not self.submit_request(auto_save=auto_save):
+            return False
+        with ThreadPoolExecutor(max_workers=Config.local_cutout.workers) as executor:
+            data = list(executor.map(self._crop, self._sources))
+        return self._cropped(data, auto_save)
+
+    def _crop(self, source):
+        """
+        Crop a single full-disk file. Runs on a worker thread.
+
+        :param source: The path, observation time and wavelength of a full-disk file
+        :type source: Tuple[Path, datetime.datetime, int]
+        :return: The cutout, None if it could not be made
+        :rtype: Fits_File
+        """
+        f = self._as_fits(source)
+        try:
+            if not crop_fits(source[0], f.file_path, *self.box()):
+                return None
+            if Config.compression.enabled:
+                compress_fits(f.file_path)
+        except (OSError, KeyError, ValueError) as err:
+            self._record_failure(source[0], "crop", err)
+            return None
+        f.file_hash = checksum(f.file_path)
+        return f
+
+    def _cropped(self, data, auto_save=True):
+        """
+        Store the cutouts once all the files have been cropped.
+
+        :param data: The result of :meth:`_crop` for each source
+        :type data: List[Fits_File]
+        :return: Whether any cutout was made
+        :rtype: bool
+        """
+        self._data = [f for f in data if f]
+        if Config.blob_store.enabled:
+            for f in self._data:
+                File_Blob.store(f.file_path, f.file_hash)
+        self._mark_stage("listed")
+        self.status = "completed"
+        if auto_save:
+            self.save_request()
+        return bool(self._data)
+
+    def save_data(self, headers=True):
+        """
+        Save the cutouts to the database
+
+        :param headers: Whether to also store the headers of the cutouts, defaults to True
+        :type headers: bool, optional
+        """
+        super().save_data()
+        if headers and self._data:
+            for f in self._data:
+                f.extract_fits_data()
+
+    def _as_fits(self, source) -> Fits_File:
+        """
+        :param source: The path, observation time and wavelength of a full-disk file
+        :type source: Tuple[Path, datetime.datetime, int]
+        :rtype: Fits_File
+        """
+        path, time, wave = source
+        sol = self.event.sol_standard if self.event else "unknown"
+        event_id = self.event.event_id if self.event else None
+        name = f"{path.stem}_{self.job_id}.fits"
+        f = Fits_File(
+            event=self.event,
+            sol_standard=sol,
+            ssw_cutout_id=self.job_id,
+            server_file_name=name,
+            # Identifies the cutout, so that saving it twice does not create two rows
+            server_full_path=f"{path.resolve().as_uri()}#{self.job_id}",
+            file_name=name,
+            request_id=self.service_request_id,
+            image_time=time,
+            channel=wave if isinstance(wave, int) else None,
+        )
+        f.file_path = Fits_File.make_path(f, event_id=event_id)
+        return f
+
+
+def local_cutouts(events: List[Hek_Event], size: Cutout_Size = None, save_data=True):
+    """
+    Make local cutouts for a list of events.
+
+    :param events: The events
+    :type events: List[Hek_Event]
+    :param size: How to size the cutouts, defaults to Cutout_Size()
+    :type size: Cutout_Size, optional
+    :param save_data: Whether to save the cutouts and the requests, defaults to True
+    :type save_data: bool
+    :return: The requests
+    :rtype: List[Local_Cutout_Service]
+    """
+    reqs = [Local_Cutout_Service._from_event(e, size=size) for e in events]
+    ready = [c for c in reqs if c.submit_request(auto_save=save_data)]
+    # The files of all the events are cropped by a single pool, and each request is saved as soon as its files are done
+    with ThreadPoolExecutor(max_workers=Config.local_cutout.workers) as executor:
+        crops = [(c, [executor.submit(c._crop, s) for s in c._sources]) for c in ready]
+        for c, futures in crops:
+            c._cropped([f.result() for f in futures], auto_save=save_data)
+            if save_data and c.data:
+                c.save_data()
+    return reqs
@@ -0,0 +1,215 @@
+"""
+Tracks outstanding cutout jobs from a single scheduling thread.
+"""
+
+import concurrent.futures as cf
+import heapq
+import itertools
+import queue
+import time
+from solar.common.config import Config
+from .client import Circuit_Open
+
+
+class _Job:
+    def __init__(self, service, deadline):
+        self.service = service
+        self.added = time.time()
+        self.timeout = deadline
+        self.deadline = self.added + deadline
+        self.errors = 0
+
+
+class Cutout_Poller:
+    """
+    Submits any number of cutout jobs and polls them until their files are listed.
+
+    Jobs are kept in a heap ordered by the time of their next check, and only the scheduling thread ever sleeps.
+    The http calls themselves run on a small pool of workers.
+    Young jobs are checked often, and old jobs less and less often: the delay before the next check is a fraction (backoff) of the age of the job, clamped between min_delay and max_delay.
+    Jobs still running after their deadline are abandoned.
+    While requests to the server are paused (see :class:`~solar.service.client.Circuit_Open`), the jobs wait, without counting an error.
+
+    Every job that leaves the poller, whether it completed or failed, is passed to on_complete and put on the :attr:`completed` queue.
+    The callbacks are called from the thread running :meth:`run`.
+    """
+
+    def __init__(
+        self,
+        on_complete=None,
+        on_submit=None,
+        max_workers=None,
+        min_delay=None,
+        max_delay=None,
+        backoff=None,
+        deadline=None,
+    ):
+        """
+        :param on_complete: Called with each service once it leaves the poller, defaults to None
+        :type on_complete: Callable[[Cutout_Service], None], optional
+        :param on_submit: Called with each service once its job has been submitted, defaults to None
+        :type on_submit: Callable[[Cutout_Service], None], optional
+        :param max_workers: Maximum number of concurrent http calls, defaults to Config.cutout.poll_workers
+        :type max_workers: int, optional
+        :param min_delay: Shortest time between two checks of a job in seconds, defaults to Config.cutout.min_delay
+        :type min_delay: float, optional
+        :param max_delay: Longest time between two checks of a job in seconds, defaults to Config.cutout.max_delay
+        :type max_delay: float, optional
+        :param backoff: Fraction of the age of a job to wait before checking it again, defaults to Config.cutout.backoff
+        :type backoff: float, optional
+        :param deadline: Time in seconds after which a job is abandoned, defaults to Config.cutout.deadline
+        :type deadline: float, optional
+        """
+        self.on_complete = on_complete
+        self.on_submit = on_submit
+        self.max_workers = max_workers if max_workers else Config.cutout.poll_workers
+        self.min_delay = min_delay if min_delay is not None else Config.cutout.min_delay
+        self.max_delay = max(
+            self.min_delay,
+            max_delay if max_delay is not None else Config.cutout.max_delay,
+        )
+        self.backoff = backoff if backoff is not None else Config.cutout.backoff
+        self.deadline = deadline if deadline is not None else Config.cutout.deadline
+
+        #: The services that left the poller, in the order they did
+        self.completed = queue.Queue()
+        #: The services whose files were listed
+        self.finished = []
+        #: The services that were abandoned
+        self.failed = []
+        #: Number of http calls made
+        self.checks = 0
+
+        self._heap = []
+        self._counter = itertools.count()
+        self._in_flight = 0
+
+    def __len__(self):
+        """
+        :return: The number of jobs still tracked
+        :rtype: int
+        """
+        return len(self._heap) + self._in_flight
+
+    def add(self, service, deadline=None):
+        """
+        Start tracking a job. It is checked right away, and services without a job id are submitted first.
+
+        :param service: The cutout request
+        :type service: Cutout_Service
+        :param deadline: Time in seconds after which the job is abandoned, defaults to the deadline of the poller
+        :type deadline: float, optional
+        """
+        job = _Job(service, deadline if deadline is not None else self.deadline)
+        self._schedule(job, job.added)
+
+    def delay(self, age):
+        """
+        :param age: Time since the job was submitted, in seconds
+        :type age: float
+        :return: The time to wait before the next check, in seconds
+        :rtype: float
+        """
+        return min(self.max_delay, max(self.min_delay, age * self.backoff))
+
+    def _schedule(self, job, when=None):
+        now = time.time()
+        if when is None:
+            when = min(now + self.delay(now - job.added), job.deadline)
+        heapq.heappush(self._heap, (when, next(self._counter), job))
+
+    def run(self):
+        """
+        Process the jobs until none is left. Blocks.
+
+        :return: The services whose files were listed
+        :rtype: List[Cutout_Service]
+        """
+        in_flight = {}
+        with cf.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while self._heap or in_flight:
+                now = time.time()
+                while (
+                    self._heap
+                    and self._heap[0][0] <= now
+                    and len(in_flight) < self.max_workers
+                ):
+                    _, _, job = heapq.heappop(self._heap)
+                    in_flight[executor.submit(self._step, job)] = job
+                self._in_flight = len(in_flight)
+
+                timeout = None
+                if self._heap and len(in_flight) < self.max_workers:
+                    timeout = max(0, self._heap[0][0] - time.time())
+                if not in_flight:
+                    time.sleep(timeout)
+                    continue
+                done, _ = cf.wait(
+                    in_flight, timeout=timeout, return_when=cf.FIRST_COMPLETED
+                )
+                for future in done:
+                    self._handle(in_flight.pop(future), future)
+                self._in_flight = len(in_flight)
+        return self.finished
+
+    def _step(self, job):
+        """
+        Make the next http call of a job. Runs on a worker thread.
+
+        :return: One of "submitted", "pending", "completed" or "failed"
+        :rtype: str
+        """
+        service = job.service
+        if not service.job_id:
+            return "submitted" if service.submit_request(auto_save=False) else "failed"
+        if service.status == "completed" and service.data:
+            # The files of an identical request were reused
+            return "completed"
+        if not service.check_status():
+            return "pending"
+        return "completed" if service.fetch_file_list() else "failed"
+
+    def _handle(self, job, future):
+        service = job.service
+        self.checks += 1
+        err = future.exception()
+        if isinstance(err, Circuit_Open):
+            if time.time() + err.retry_after < job.deadline:
+                return self._schedule(job, time.time() + err.retry_after)
+            service._record_failure(service.job_id, "poll", err)
+            return self._finish(job, False)
+        if err:
+            job.errors += 1
+            if job.errors >= Config.cutout.max_poll_failures:
+                service._record_failure(service.job_id, "poll", err)
+                return self._finish(job, False)
+        else:
+            state = future.result()
+            if state == "completed":
+                return self._finish(job, True)
+            if state == "failed":
+                return self._finish(job, False)
+            job.errors = 0
+            if state == "submitted":
+                # The age of the job starts with its submission
+                job.added = time.time()
+                if self.on_submit:
+                    self.on_submit(service)
+                if service.status == "completed" and service.data:
+                    # The files of an identical request were reused
+                    return self._finish(job, True)
+
+        if time.time() >= job.deadline:
+            service._record_failure(
+                service.job_id,
+                "deadline",
+                TimeoutError(f"Job not finished after {job.timeout}s"),
+            )
+            return self._finish(job, False)
+        self._schedule(job)
+
+    def _finish(self, job, success):
+        (self.finished if success else self.failed).append(job.service)
+        self.completed.put(job.service)
+        if self.on_complete:
+            self.on_complete(job.service)
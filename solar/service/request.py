@@ -2,7 +2,15 @@ from solar.database import *
 from solar.database.tables.base_models import Base_Model
 from solar.common.printing import chat
 from solar.database.tables.service_request import Service_Request
+from solar.database.tables.service_stage import Service_Stage
+from solar.service.utils import params_digest
 import peewee as pw
+from collections import namedtuple
+from datetime import datetime
+
+
+#: A part of a request that could not be completed, for example a time interval of a hek search or a cutout job id
+Failure = namedtuple("Failure", ["key", "stage", "error", "time"])
 
 
 class Base_Service:
@@ -35,6 +43,60 @@ class Base_Service:
     def save_request(self):
         self.__save_request_impl()
 
+    @property
+    def fingerprint(self):
+        """
+        A hash of the service type and the normalised parameters of the request.
+        Two requests with the same fingerprint ask the same question, and get the same results.
+
+        :rtype: str
+        """
+        params = self.params.as_dict()
+        params["service_type"] = self.service_type
+        return params_digest(params)
+
+    def _find_duplicate(self):
+        """
+        Find a saved request with the same fingerprint as this one
+
+        :return: The request, None if there is none
+        :rtype: Service_Request
+        """
+        query = Service_Request.select().where(
+            Service_Request.fingerprint == self.fingerprint,
+            Service_Request.service_type == self.service_type,
+        )
+        if self.service_request_id:
+            query = query.where(Service_Request.id != self.service_request_id)
+        try:
+            return query.first()
+        except pw.OperationalError:
+            # The tables have not been created
+            return None
+
+    def _mark_stage(self, stage):
+        """
+        Remember when the request first reached a stage. The times are stored in :class:`~solar.database.tables.service_stage.Service_Stage` when the request is saved.
+
+        :param stage: The name of the stage
+        :type stage: str
+        """
+        self.stage_times.setdefault(stage, datetime.now())
+
+    def _record_failure(self, key, stage, error):
+        """
+        Add an entry to the failure ledger of this request
+
+        :param key: What failed (a time interval, a job id, ...)
+        :type key: Any
+        :param stage: The step that failed
+        :type stage: str
+        :param error: The exception that caused the failure
+        :type error: Exception
+        """
+        print(f"{stage} failed for {key}: {error}")
+        self.failures.append(Failure(key, stage, str(error), datetime.now()))
+
     def __save_request_impl(self):
         """Function __save_request_impl: Basic implementation for storing the service_request
         :returns: None
@@ -46,14 +108,23 @@ class Base_Service:
 
         # First check if this request already has an id
         if not self.service_request_id:
+            match = Service_Request.fingerprint == self.fingerprint
+            if self.job_id:
+                match = match | (Service_Request.job_id == self.job_id)
+            # Requests for different events that share a job keep their own rows
+            event = getattr(self, "event", None)
+            same_event = (
+                Service_Request.event == event
+                if event
+                else Service_Request.event.is_null()
+            )
             try:
                 req = Service_Request.get(
-                    Service_Request.job_id == self.job_id,
-                    Service_Request.service_type == self.service_type,
+                    match, same_event, Service_Request.service_type == self.service_type
                 )
                 chat(
                     (
-                        "While saving this request, I found an existing request with a matching job id.\n"
+                        "While saving this request, I found an existing request with a matching job id or the same parameters.\n"
                         "I am going to update that request instead"
                     )
                 )
@@ -100,24 +171,37 @@ class Base_Service:
 
         req.job_id = self.job_id
 
-        # We also want to store the parameters of the request
-        param_list = [p for p in req.parameters]
-        my_params = [a.as_model(req) for a in self.params]
+        # The fingerprint is unique, it is left empty if another request already has it
+        fingerprint = self.fingerprint
+        if req.fingerprint != fingerprint:
+            taken = (
+                Service_Request.select()
+                .where(
+                    Service_Request.fingerprint == fingerprint,
+                    Service_Request.id != req.id,
+                )
+                .exists()
+            )
+            req.fingerprint = None if taken else fingerprint
 
+        # We also want to store the parameters of the request, reusing the rows of the parameters that are already stored
+        existing = {p.key: p.id for p in req.parameters}
         new_list = []
 
-        for param in my_params:
-            search = [x for x in param_list if x.key == param.key]
-            if not search:
-                new_list.append(param)
-            else:
-                param.id = search[0].id
-                new_list.append(param)
+        for att in self.params:
+            param = att.as_model(req)
+            if param.key in existing:
+                param.id = existing[param.key]
+            new_list.append(param)
 
         req.save()
         for p in new_list:
             p.save()
 
+        Service_Stage.record(
+            (req.id, stage, time) for stage, time in self.stage_times.items()
+        )
+
     def _verify_request(self):
         pass
 
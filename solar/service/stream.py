@@ -0,0 +1,108 @@
+import codecs
+import json
+import re
+
+
+class Json_Array_Reader:
+    """
+    Incrementally parse the elements of an array stored under a key of a json object.
+
+    The document is read chunk by chunk, and only the element currently being parsed is kept in memory.
+    Iterating over the reader yields the decoded elements.
+    The text outside of the array is kept, so small flags such as HEK's "overmax" can be read with :meth:`flag` once the array has been consumed.
+    """
+
+    _whitespace = re.compile(r"[\s,]*")
+
+    def __init__(self, chunks, key="result"):
+        """
+        :param chunks: The document, as an iterable of bytes or str (for example response.iter_content())
+        :type chunks: Iterable[Union[bytes, str]]
+        :param key: The key of the array, defaults to "result"
+        :type key: str
+        """
+        self.chunks = iter(chunks)
+        self.key = key
+        self.count = 0
+        self._start = re.compile(r'"' + re.escape(key) + r'"\s*:\s*\[')
+        self._decoder = json.JSONDecoder()
+        self._bytes = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._outside = ""
+        self._exhausted = False
+
+    def _read(self):
+        """
+        Add a chunk to the buffer
+
+        :return: False if the document has been exhausted
+        :rtype: bool
+        """
+        if self._exhausted:
+            return False
+        try:
+            chunk = next(self.chunks)
+        except StopIteration:
+            self._exhausted = True
+            self._buffer += self._bytes.decode(b"", final=True)
+            return False
+        if isinstance(chunk, bytes):
+            chunk = self._bytes.decode(chunk)
+        self._buffer += chunk
+        return True
+
+    def __iter__(self):
+        # Find the start of the array
+        match = self._start.search(self._buffer)
+        while not match:
+            if not self._read():
+                self._outside += self._buffer
+                self._buffer = ""
+                return
+            match = self._start.search(self._buffer)
+        self._outside += self._buffer[: match.start()]
+        self._buffer = self._buffer[match.end() :]
+
+        while True:
+            pos = self._whitespace.match(self._buffer).end()
+            if pos == len(self._buffer):
+                if not self._read():
+                    raise ValueError(f"Unterminated array {self.key}")
+                continue
+            if self._buffer[pos] == "]":
+                self._buffer = self._buffer[pos + 1 :]
+                break
+            try:
+                element, end = self._decoder.raw_decode(self._buffer, pos)
+                # An element ending exactly at the end of the buffer may be truncated (for example a number)
+                complete = end < len(self._buffer) or self._exhausted
+            except ValueError:
+                complete = False
+            if not complete:
+                if not self._read():
+                    raise ValueError(f"Could not decode an element of {self.key}")
+                continue
+            self._buffer = self._buffer[end:]
+            self.count += 1
+            yield element
+
+        # Keep the rest of the document
+        while self._read():
+            pass
+        self._outside += self._buffer
+        self._buffer = ""
+
+    def flag(self, name):
+        """
+        Read a boolean value stored outside of the array
+
+        :param name: The key of the value
+        :type name: str
+        :return: The value, False if it was not found
+        :rtype: bool
+        """
+        match = re.search(
+            r'"' + re.escape(name) + r'"\s*:\s*(true|false|1|0|"true"|"false")',
+            self._outside,
+        )
+        return bool(match) and match[1].strip('"') in ("true", "1")
@@ -0,0 +1,133 @@
+"""
+Latency and throughput of the service requests, computed from the stage times stored in
+:class:`~solar.database.tables.service_stage.Service_Stage`.
+"""
+
+import math
+from collections import Counter, defaultdict
+from datetime import datetime
+import peewee as pw
+from solar.database.tables.service_request import Service_Request
+from solar.database.tables.service_stage import Service_Stage
+
+#: The reported latencies, as (name, first stage, last stage)
+spans = [
+    ("first_poll", "submitted", "first_poll"),
+    ("queue", "submitted", "ready"),
+    ("listing", "ready", "listed"),
+    ("download", "listed", "downloaded"),
+    ("search", "submitted", "completed"),
+    ("total", "created", "downloaded"),
+]
+
+#: The stages after which a request is counted as done, for the throughput
+final_stages = ["listed", "completed"]
+
+
+def percentile(values, q):
+    """
+    Nearest-rank percentile.
+
+    :param values: The sorted values
+    :type values: List[float]
+    :param q: The percentile, between 0 and 100
+    :type q: float
+    :return: The percentile, None if there are no values
+    :rtype: float
+    """
+    if not values:
+        return None
+    rank = max(0, math.ceil(q / 100 * len(values)) - 1)
+    return values[rank]
+
+
+def stage_times(service_type=None, since=None):
+    """
+    Load the stage times of the requests.
+
+    :param service_type: Only keep the requests of this type, defaults to None (all)
+    :type service_type: str, optional
+    :param since: Only keep the requests created after this time, defaults to None
+    :type since: datetime.datetime, optional
+    :return: The service type and the time of each stage, for each request id
+    :rtype: Dict[int, Tuple[str, Dict[str, datetime.datetime]]]
+    """
+    query = Service_Stage.select(Service_Stage, Service_Request.service_type).join(
+        Service_Request
+    )
+    if service_type:
+        query = query.where(Service_Request.service_type == service_type)
+    if since:
+        # A request starts when it is created, or submitted for those saved before their creation was recorded
+        started_before = (
+            Service_Stage.select(Service_Stage.service_request)
+            .where(Service_Stage.stage.in_(["created", "submitted"]))
+            .group_by(Service_Stage.service_request)
+            .having(pw.fn.MIN(Service_Stage.time) < since)
+        )
+        query = query.where(Service_Stage.service_request.not_in(started_before))
+    ret = {}
+    for s in query.objects():
+        ret.setdefault(s.service_request_id, (s.service_type, {}))[1][s.stage] = s.time
+    return ret
+
+
+def latency_report(service_type=None, since=None, quantiles=(50, 90, 99)):
+    """
+    Summarize how long the requests spend in each stage, and how many requests complete each day.
+
+    :param service_type: Only report the requests of this type, defaults to None (all)
+    :type service_type: str, optional
+    :param since: Only report the requests created after this time, defaults to None
+    :type since: datetime.datetime, optional
+    :param quantiles: The percentiles to compute, defaults to (50, 90, 99)
+    :type quantiles: Tuple[float]
+    :return: For each service type, the number of requests, the percentiles (in seconds) of each span, and the number of completed requests per day
+    :rtype: Dict[str, Dict[str, Any]]
+    """
+    report = {}
+    for service, times in stage_times(service_type, since).values():
+        entry = report.setdefault(
+            service,
+            {"requests": 0, "spans": defaultdict(list), "per_day": Counter()},
+        )
+        entry["requests"] += 1
+        for name, first, last in spans:
+            if first in times and last in times:
+                entry["spans"][name].append((times[last] - times[first]).total_seconds())
+        done = [times[s] for s in final_stages if s in times]
+        if done:
+            entry["per_day"][min(done).date()] += 1
+
+    for entry in report.values():
+        entry["spans"] = {
+            name: dict(
+                count=len(values),
+                **{f"p{q}": percentile(sorted(values), q) for q in quantiles},
+            )
+            for name, values in entry["spans"].items()
+        }
+        entry["per_day"] = dict(sorted(entry["per_day"].items()))
+    return report
+
+
+def print_report(report):
+    """
+    Print a report made by :func:`latency_report`
+
+    :param report: The report
+    :type report: Dict[str, Dict[str, Any]]
+    """
+    if not report:
+        print("No request has recorded its stages yet")
+    for service, entry in report.items():
+        print(f"{service}: {entry['requests']} requests")
+        for name, stats in entry["spans"].items():
+            values = ", ".join(
+                f"{k}={v:.1f}s" for k, v in stats.items() if k != "count"
+            )
+            print(f"    {name:<12} n={stats['count']:<6} {values}")
+        if entry["per_day"]:
+            print(f"    completed per day:")
+            for day, count in entry["per_day"].items():
+                print(f"        {day}: {count}")
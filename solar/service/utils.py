@@ -1,19 +1,66 @@
+import hashlib
+import json
+from datetime import datetime
+from solar.common.config import Config
+from solar.common.utils import into_number
+from solar.service.attribute import Attribute_Store
+
+
 def build_from_defaults(default_list, new_list):
     """Function build_from_defaults: A utility function for "merging" two attribute lists.
 
     Effectively join the two lists, giving priority to the elements of new_list
     
     :param default_list: The of "default" attributes
-    :type default_list: List[Attribute]
+    :type default_list: Iterable[Attribute]
     :param new_list: List of the attributes to add to the result 
-    :type new_list: List[Attribute]
-    :returns: New list created by combining the inputs
-    :type return: List[Attribute]
+    :type new_list: Iterable[Attribute]
+    :returns: New collection created by combining the inputs
+    :type return: Attribute_Store
+    """
+    return Attribute_Store(default_list).merge(new_list)
+
+
+def normalize_value(value):
+    """
+    Convert a parameter value into a canonical form, so that equivalent values compare equal.
+    For example "304", 304 and 304.0 are all normalized to 304.
+
+    :param value: The value
+    :type value: Any
+    :return: The normalized value
+    :rtype: Union[int, float, str, list, None]
+    """
+    if isinstance(value, datetime):
+        return value.strftime(Config.time_format.hek)
+    if isinstance(value, (list, tuple)):
+        return [normalize_value(x) for x in value]
+    if isinstance(value, str):
+        value = into_number(value.strip())
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if value is None or isinstance(value, (int, float, str)):
+        return value
+    return str(value)
+
+
+def params_digest(params, exclude=()):
+    """
+    Compute a stable hash of a set of parameters.
+
+    :param params: Either a dict of name value pairs, or a list of attributes
+    :type params: Union[Dict[str, Any], List[Attribute]]
+    :param exclude: Names of the parameters to leave out of the hash, defaults to ()
+    :type exclude: Iterable[str]
+    :return: The hex digest
+    :rtype: str
     """
-    ret = []
-    for i in default_list:
-        search = [x for x in new_list if x.name == i.name]
-        if not search:
-            ret.append(i)
-    ret.extend(new_list)
-    return ret
+    if not isinstance(params, dict):
+        params = {att.name: att.value for att in params}
+    normalized = {
+        str(key): normalize_value(val)
+        for key, val in params.items()
+        if key not in exclude
+    }
+    encoded = json.dumps(normalized, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
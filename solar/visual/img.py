@@ -3,7 +3,7 @@ import sunpy.map as sm
 from pathlib import Path
 from .base_visual import Visual_Builder
 from solar.common.printing import chat
-import os
+from solar.common.fits_io import fits_size, read_map
 import numpy as np
 
 
@@ -59,7 +59,7 @@ class Image_Builder(Visual_Builder):
         self.generate_image_data()
         p = Path(save_path)
         p.parent.mkdir(parents=True, exist_ok=True)
-        size_fits_file = os.path.getsize(fits.file_path)
+        size_fits_file = fits_size(fits.file_path)
                 
         if fits:
             self.fig.savefig(save_path, metadata=self.generate_metadata(fits))
@@ -116,7 +116,7 @@ class Unframed_Image(Image_Builder):
         """
         if not Path(file_path).is_file():
             return False
-        self.map = sm.Map(file_path)
+        self.map = read_map(file_path)
         x = self.map.meta["naxis1"]
         y = self.map.meta["naxis2"]
         larger = max(x, y)
@@ -164,7 +164,7 @@ class Basic_Image(Image_Builder):
         # Refractor this class so there is less stuff in the create() function.
         # <06-08-20, yourname> #
         if not issubclass(type(file_path), sm.GenericMap):
-            self.map = sm.Map(file_path)
+            self.map = read_map(file_path)
             if not Path(file_path).is_file():
                 print(
                     "You are asking me to create an image from a fits file that does not exist"
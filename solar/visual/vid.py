@@ -1,5 +1,6 @@
 from .base_visual import Visual_Builder
 import sunpy.map as sm
+from solar.common.fits_io import read_map
 from pathlib import Path
 import matplotlib.animation as animation
 
@@ -29,7 +30,7 @@ class Video_Builder(Visual_Builder):
         self.ani.save(save_path, writer=writer)
 
     def create(self, file_list):
-        maps = [sm.Map(path) for path in file_list]
+        maps = [read_map(path) for path in file_list]
         seq = sm.mapsequence.MapSequence(maps, sequence=True)
         self.fig.set_size_inches(5, 4)
         self.ani = seq.plot()
@@ -64,7 +65,7 @@ class Basic_Video(Video_Builder):
             :param file_list: a list of fits files string
             :type file_list: List[str]
         """
-        maps = [sm.Map(path) for path in file_list]
+        maps = [read_map(path) for path in file_list]
         seq = sm.mapsequence.MapSequence(maps, sequence=True)
         self.fig.set_size_inches(5, 4)
         self.ani = seq.plot()
@@ -0,0 +1,127 @@
+import unittest
+from solar.common.fits_io import compress_fits, fits_size, is_compressed, read_map
+from solar.common.config import Config
+from solar.database.tables.fits_file import Fits_File
+from solar.database.tables.file_blob import File_Blob
+from solar.common.utils import checksum
+from tests.utils import test_db
+from astropy.io import fits
+from pathlib import Path
+import numpy as np
+import os
+import tempfile
+
+
+def cutout(path, dtype):
+    """
+    A small fake AIA cutout, with a smooth image
+    """
+    y, x = np.mgrid[0:200, 0:200]
+    data = (100 * np.sin(x / 20.0) * np.cos(y / 30.0) + 500).astype(dtype)
+    header = fits.Header()
+    header["DATE-OBS"] = "2012-01-01T00:00:00.000"
+    header["TELESCOP"], header["INSTRUME"] = "SDO/AIA", "AIA_3"
+    header["WAVELNTH"], header["WAVEUNIT"] = 171, "angstrom"
+    header["CTYPE1"], header["CTYPE2"] = "HPLN-TAN", "HPLT-TAN"
+    header["CUNIT1"], header["CUNIT2"] = "arcsec", "arcsec"
+    header["CRPIX1"], header["CRPIX2"] = 100.0, 100.0
+    header["CRVAL1"], header["CRVAL2"] = 0.0, 0.0
+    header["CDELT1"], header["CDELT2"] = 0.6, 0.6
+    fits.PrimaryHDU(data, header=header).writeto(path)
+
+
+def plain_meta(m):
+    return {k: str(v) for k, v in m.meta.items() if not isinstance(v, dict)}
+
+
+class TestFitsIO(unittest.TestCase):
+
+    """Test case docstring."""
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.dir.name)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_roundtrip(self):
+        for dtype in [np.int16, np.int32, np.float32]:
+            original = self.root / f"{np.dtype(dtype).name}.fits"
+            compressed = self.root / f"{np.dtype(dtype).name}_c.fits"
+            cutout(original, dtype)
+            self.assertTrue(compress_fits(original, compressed))
+            self.assertTrue(is_compressed(compressed))
+            self.assertFalse(is_compressed(original))
+
+            a, b = read_map(original), read_map(compressed)
+            self.assertTrue(np.array_equal(a.data, b.data))
+            self.assertEqual(plain_meta(a), plain_meta(b))
+            self.assertEqual(fits_size(compressed), os.path.getsize(original))
+            if dtype != np.float32:
+                self.assertLess(
+                    os.path.getsize(compressed), os.path.getsize(original) / 2
+                )
+
+    def test_already_compressed(self):
+        p = self.root / "a.fits"
+        cutout(p, np.int16)
+        self.assertTrue(compress_fits(p))
+        digest = checksum(p)
+        self.assertFalse(compress_fits(p))
+        self.assertEqual(checksum(p), digest)
+
+
+class TestFitsFileCompression(unittest.TestCase):
+
+    """Test case docstring."""
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.db_save = Config.db_save
+        Config.db_save = self.dir.name
+        self.root = Path(self.dir.name)
+
+    def tearDown(self):
+        Config.db_save = self.db_save
+        self.dir.cleanup()
+
+    @test_db()
+    def test_headers(self):
+        files = []
+        for name in ["a.fits", "b.fits"]:
+            cutout(self.root / name, np.int16)
+            f = Fits_File.create(file_path=self.root / name)
+            f.get_hash()
+            files.append(f)
+        self.assertTrue(files[1].compress())
+        self.assertTrue(files[1].check_integrity())
+        for f in files:
+            f.extract_fits_data()
+        self.assertEqual(files[0].get_header_as_dict(), files[1].get_header_as_dict())
+
+    @test_db()
+    def test_compress_blob(self):
+        enabled = Config.blob_store.enabled
+        Config.blob_store.enabled = True
+        try:
+            files = []
+            for name in ["a.fits", "b.fits"]:
+                cutout(self.root / name, np.int16)
+                f = Fits_File.create(file_path=self.root / name)
+                f.get_hash()
+                File_Blob.store(f.file_path, f.file_hash)
+                files.append(f)
+            old_hash = files[0].file_hash
+            files[0].compress()
+
+            self.assertNotEqual(files[0].file_hash, old_hash)
+            self.assertTrue(all(f.check_integrity() for f in files))
+            refs = {b.digest: b.refs for b in File_Blob.select()}
+            self.assertEqual(refs, {old_hash: 1, files[0].file_hash: 1})
+        finally:
+            Config.blob_store.enabled = enabled
+
+
+if __name__ == "__main__":
+    unittest.main()
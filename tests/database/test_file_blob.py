@@ -0,0 +1,126 @@
+import unittest
+from solar.database.tables.file_blob import File_Blob, File_Blob_Link
+from solar.database.tables.fits_file import Fits_File
+from solar.common.config import Config
+from solar.common.utils import checksum
+from tests.utils import test_db
+from pathlib import Path
+import tempfile
+
+
+class TestFileBlob(unittest.TestCase):
+
+    """Test case docstring."""
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.db_save = Config.db_save
+        Config.db_save = self.dir.name
+        self.root = Path(self.dir.name)
+
+    def tearDown(self):
+        Config.db_save = self.db_save
+        self.dir.cleanup()
+
+    def write(self, name, content):
+        p = self.root / "fits" / name
+        p.parent.mkdir(parents=True, exist_ok=True)
+        p.write_bytes(content)
+        return p, checksum(p)
+
+    @test_db()
+    def test_dedup(self):
+        a, digest = self.write("1/a.fits", b"SIMPLE" * 1000)
+        b, _ = self.write("2/b.fits", b"SIMPLE" * 1000)
+        File_Blob.store(a, digest)
+        blob = File_Blob.store(b, digest)
+        # Storing the same file twice does not count it twice
+        File_Blob.store(b, digest)
+
+        blob = File_Blob.get_by_id(blob.id)
+        self.assertEqual(blob.refs, 2)
+        self.assertEqual(blob.size, 6000)
+        self.assertEqual(blob.blob_path.stat().st_nlink, 3)
+        self.assertEqual(b.read_bytes(), b"SIMPLE" * 1000)
+
+        File_Blob.release(a)
+        self.assertFalse(a.exists())
+        self.assertTrue(b.exists())
+        self.assertEqual(File_Blob.get_by_id(blob.id).refs, 1)
+
+        File_Blob.release(b)
+        self.assertFalse(blob.blob_path.exists())
+        self.assertEqual(File_Blob.select().count(), 0)
+
+    @test_db()
+    def test_unlinked(self):
+        a, digest = self.write("1/a.fits", b"SIMPLE" * 1000)
+        b, _ = self.write("2/b.fits", b"SIMPLE" * 1000)
+        c, _ = self.write("3/c.fits", b"SIMPLE" * 1000)
+        for p in (a, b, c):
+            File_Blob.store(p, digest)
+        blob = File_Blob.get(File_Blob.digest == digest)
+        # b is replaced by a copy, and c is deleted, behind the back of the store
+        b.unlink()
+        b.write_bytes(b"SIMPLE" * 1000)
+        c.unlink()
+
+        File_Blob.release(b)
+        File_Blob.release(c)
+        self.assertEqual(File_Blob.get_by_id(blob.id).refs, 1)
+        File_Blob.release(a)
+        self.assertFalse(blob.blob_path.exists())
+        self.assertEqual(File_Blob.select().count(), 0)
+        self.assertEqual(File_Blob_Link.select().count(), 0)
+
+    @test_db()
+    def test_fetch(self):
+        a, digest = self.write("1/a.fits", b"data" * 100)
+        File_Blob.store(a, digest)
+        c = self.root / "fits" / "3" / "c.fits"
+        self.assertTrue(File_Blob.fetch(digest, c))
+        self.assertEqual(checksum(c), digest)
+        self.assertFalse(File_Blob.fetch("unknown", self.root / "d.fits"))
+        self.assertEqual(File_Blob.get(File_Blob.digest == digest).refs, 2)
+
+    @test_db()
+    def test_corrupted(self):
+        a, digest = self.write("1/a.fits", b"data" * 100)
+        File_Blob.store(a, digest)
+        # Modifying the file in place also modifies the blob
+        with open(a, "r+b") as f:
+            f.write(b"junk")
+        self.assertFalse(File_Blob.fetch(digest, a))
+        self.assertFalse(File_Blob.fetch(digest, self.root / "fits" / "b.fits"))
+        self.assertEqual(File_Blob.select().count(), 0)
+
+    @test_db()
+    def test_already_linked(self):
+        a, digest = self.write("1/a.fits", b"data" * 100)
+        File_Blob.store(a, digest)
+        self.assertFalse(File_Blob.fetch(digest, a))
+        self.assertEqual(File_Blob.get(File_Blob.digest == digest).refs, 1)
+
+    @test_db()
+    def test_update_table(self):
+        enabled = Config.blob_store.enabled
+        Config.blob_store.enabled = True
+        try:
+            a, digest = self.write("1/a.fits", b"data" * 100)
+            File_Blob.store(a, digest)
+            f = Fits_File.create(
+                file_path=self.root / "fits" / "2" / "a.fits", file_hash=digest
+            )
+            Fits_File.update_table(update_headers=False)
+            self.assertTrue(f.check_integrity())
+
+            f.remove()
+            self.assertEqual(Fits_File.select().count(), 0)
+            self.assertTrue(a.exists())
+            self.assertEqual(File_Blob.get(File_Blob.digest == digest).refs, 1)
+        finally:
+            Config.blob_store.enabled = enabled
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,8 +2,11 @@ import unittest
 import solar.database.utils as ut
 from solar.database.tables.hek_event import Hek_Event
 from solar.database.tables.visual_file import Visual_File
+from solar.database.tables.fits_file import Fits_File
 from pathlib import Path
 from solar.common.config import Config
+from tests.utils import test_db
+from peewee import IntegrityError
 
 
 class TestDBFormat(unittest.TestCase):
@@ -65,3 +68,93 @@ class Testdbroot(unittest.TestCase):
         desired = [Path(Config.db_save) / x for x in bases]
         for x, y in zip(bases, desired):
             self.assertEqual(ut.dbroot(x), y)
+
+
+class TestBulkUpsert(unittest.TestCase):
+
+    """Test case docstring."""
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    @test_db()
+    def test_insert(self):
+        events = [Hek_Event(event_id=str(x), description="new") for x in range(25)]
+        rows = ut.bulk_upsert(Hek_Event, events, "event_id", insert_chunk=7)
+        self.assertEqual(Hek_Event.select().count(), 25)
+        self.assertEqual([x.event_id for x in rows], [x.event_id for x in events])
+        self.assertTrue(all(x.id for x in rows))
+
+    @test_db()
+    def test_existing(self):
+        Hek_Event.create(event_id="3", description="old")
+        events = [Hek_Event(event_id=str(x), description="new") for x in range(5)]
+        rows = ut.bulk_upsert(Hek_Event, events + events[:2], "event_id")
+        self.assertEqual(Hek_Event.select().count(), 5)
+        self.assertEqual(len(rows), 7)
+        self.assertEqual(rows[3].description, "old")
+        self.assertEqual(rows[5].id, rows[0].id)
+
+    @test_db()
+    def test_not_saved(self):
+        # A file without a server path cannot be matched with its row
+        files = [Fits_File(server_full_path=f"x/{i}.fits") for i in range(3)]
+        files.append(Fits_File(server_full_path=None))
+        with self.assertRaises(IntegrityError):
+            ut.bulk_upsert(Fits_File, files, "server_full_path")
+        self.assertEqual(Fits_File.select().count(), 0)
+
+
+class TestMissingColumns(unittest.TestCase):
+
+    """Test case docstring."""
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    @test_db()
+    def test_add_column(self):
+        from solar.database import add_missing_columns
+        from solar.database.tables.fits_file import Fits_File
+
+        db = Fits_File._meta.database
+        db.execute_sql('ALTER TABLE "fits_file" DROP COLUMN "channel"')
+        self.assertEqual(add_missing_columns([Fits_File]), ["fits_file.channel"])
+        self.assertEqual(add_missing_columns([Fits_File]), [])
+        f = Fits_File.create(server_full_path="http://x/a.fts", channel=171)
+        self.assertEqual(Fits_File.get_by_id(f.id).channel, 171)
+
+    @test_db()
+    def test_baseline_schema(self):
+        from solar.database import create_tables
+        from solar.database.tables import tables
+        from solar.database.tables.service_request import Service_Request
+
+        # A database made before the fingerprint column existed, with several requests
+        db = Service_Request._meta.database
+        db.execute_sql('DROP INDEX "service_request_fingerprint"')
+        db.execute_sql('ALTER TABLE "service_request" DROP COLUMN "fingerprint"')
+        for job_id in ["a", "b", "c"]:
+            db.execute_sql(
+                'INSERT INTO "service_request" ("service_type", "status", "job_id") VALUES (?, ?, ?)',
+                ("cutout", "completed", job_id),
+            )
+
+        create_tables(tables)
+
+        self.assertEqual(
+            [r.fingerprint for r in Service_Request.select()], [None, None, None]
+        )
+        indexes = {i.name: i.unique for i in db.get_indexes("service_request")}
+        self.assertTrue(indexes["service_request_fingerprint"])
+        Service_Request.create(service_type="hek", status="completed", fingerprint="x")
+        with self.assertRaises(IntegrityError):
+            Service_Request.create(
+                service_type="hek", status="completed", fingerprint="x"
+            )
@@ -0,0 +1,107 @@
+"""
+Measure the throughput of Hek_Service against the local replay server.
+
+Run with:
+
+    python -m tests.service.benchmark --days 365 --rate 20 --latency 0.2 --workers 1 5 10
+"""
+
+import argparse
+import time
+from datetime import datetime, timedelta
+from peewee import SqliteDatabase
+from solar.common.config import Config
+from solar.database.tables import tables
+from solar.database.tables.hek_event import Hek_Event
+from solar.service.hek import Hek_Service
+from .replay import Hek_Replay_Server
+
+
+def run_once(server, start, end, workers, stream=False):
+    """
+    Run a single search and save the results to an in memory database
+
+    :return: The measurements
+    :rtype: dict
+    """
+    hek_format = Config.time_format.hek
+    db = SqliteDatabase(":memory:")
+    with db.bind_ctx(tables):
+        db.create_tables(tables)
+        hek = Hek_Service(
+            event_starttime=start.strftime(hek_format),
+            event_endtime=end.strftime(hek_format),
+        )
+        hek.base_url = server.url
+        before = server.requests
+
+        begin = time.perf_counter()
+        if stream:
+            found = hek.save_stream(max_workers=workers)
+            request_time = time.perf_counter() - begin
+        else:
+            hek.submit_request(max_workers=workers)
+            request_time = time.perf_counter() - begin
+            found = len(hek.data)
+            hek.save_data()
+        total_time = time.perf_counter() - begin
+
+        saved = Hek_Event.select().count()
+        db.drop_tables(tables)
+    db.close()
+    return dict(
+        workers=workers,
+        events=saved,
+        found=found,
+        requests=server.requests - before,
+        windows=hek.windows_issued,
+        failures=len(hek.failures),
+        request_time=request_time,
+        total_time=total_time,
+        rate=saved / total_time if total_time else 0,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--days", type=float, default=365, help="Length of the search")
+    parser.add_argument("--rate", type=float, default=20, help="Events per day")
+    parser.add_argument("--latency", type=float, default=0.1, help="Server latency (s)")
+    parser.add_argument("--limit", type=int, default=500, help="Rows per response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of 503s")
+    parser.add_argument(
+        "--workers", type=int, nargs="+", default=[1, 2, 5, 10], help="Worker counts"
+    )
+    parser.add_argument("--stream", action="store_true", help="Use save_stream")
+    args = parser.parse_args(argv)
+
+    Config.chatty = False
+    Config.http.backoff = 0.05
+    Config.hek.result_limit = args.limit
+
+    start = datetime(2012, 1, 1)
+    end = start + timedelta(days=args.days)
+    with Hek_Replay_Server(
+        rate=args.rate,
+        latency=args.latency,
+        limit=args.limit,
+        error_rate=args.error_rate,
+    ) as server:
+        print(f"Expecting {server.expected_events(start, end)} events")
+        rows = [run_once(server, start, end, w, args.stream) for w in args.workers]
+
+    print(
+        f"{'workers':>8} {'events':>8} {'requests':>9} {'windows':>8} {'failed':>7} "
+        f"{'request s':>10} {'total s':>8} {'events/s':>9}"
+    )
+    for r in rows:
+        print(
+            f"{r['workers']:>8} {r['events']:>8} {r['requests']:>9} {r['windows']:>8} "
+            f"{r['failures']:>7} {r['request_time']:>10.2f} {r['total_time']:>8.2f} "
+            f"{r['rate']:>9.0f}"
+        )
+    return rows
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""
+A local stand-in for the HEK server.
+
+It replays the recorded responses in tests/service/resp, and answers every other query with synthetic events,
+with a configurable latency, event rate, row limit and error rate.
+"""
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from datetime import datetime, timedelta
+from threading import Thread, Lock
+import json
+import random
+import time
+from solar.common.config import Config
+from solar.service.utils import normalize_value
+from .utils import load_responses
+
+
+def _normalize(params):
+    ret = {}
+    for key, val in params.items():
+        if isinstance(val, list) and len(val) == 1:
+            val = val[0]
+        ret[key] = normalize_value(val)
+    return json.dumps(ret, sort_keys=True)
+
+
+def synthetic_event(index, when):
+    """
+    Make a fake HEK event. Events with the same index are identical.
+
+    :param index: The index of the event
+    :type index: int
+    :param when: The start time of the event
+    :type when: datetime.datetime
+    :rtype: dict
+    """
+    start = when.strftime(Config.time_format.hek)
+    end = (when + timedelta(minutes=10)).strftime(Config.time_format.hek)
+    x = (index * 37) % 1800 - 900
+    y = (index * 53) % 1800 - 900
+    return {
+        "SOL_standard": f"SOL{start}L{index % 360:03d}C{index % 180:03d}",
+        "event_starttime": start,
+        "event_endtime": end,
+        "event_coordunit": "arcsec",
+        "boundbox_c1ll": x - 30,
+        "boundbox_c1ur": x + 30,
+        "boundbox_c2ll": y - 30,
+        "boundbox_c2ur": y + 30,
+        "hgc_x": x / 20,
+        "hgc_y": y / 20,
+        "hpc_x": x,
+        "hpc_y": y,
+        "frm_identifier": "replay",
+        "search_frm_name": "replay",
+        "event_description": f"Synthetic event {index}",
+    }
+
+
+class Hek_Replay_Server:
+    """
+    Serves HEK responses on localhost.
+
+    Synthetic events are spread evenly in time at rate events per day, so overlapping windows return the same events.
+    """
+
+    epoch = datetime(2000, 1, 1)
+
+    def __init__(
+        self, rate=10, latency=0.0, limit=None, error_rate=0.0, responses=None, seed=0
+    ):
+        """
+        :param rate: Number of synthetic events per day, defaults to 10
+        :type rate: float
+        :param latency: Delay before each response in seconds, defaults to 0
+        :type latency: float
+        :param limit: Maximum number of events in a response, defaults to None
+        :type limit: int
+        :param error_rate: Fraction of the requests answered with a 503, defaults to 0
+        :type error_rate: float
+        :param responses: Recorded parameter/response pairs, defaults to the ones in tests/service/resp
+        :type responses: List[Tuple[dict, dict]]
+        :param seed: Seed for the random errors, defaults to 0
+        :type seed: int
+        """
+        self.rate = rate
+        self.latency = latency
+        self.limit = limit
+        self.error_rate = error_rate
+        responses = responses if responses is not None else load_responses()
+        self.responses = {_normalize(params): resp for params, resp in responses}
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+        self._lock = Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/hek/her"
+
+    def start(self):
+        handler = type("Handler", (_Handler,), {"replay": self})
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self._server.daemon_threads = True
+        self._thread = Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def expected_events(self, start, end):
+        """
+        :return: The number of distinct synthetic events in a time range
+        :rtype: int
+        """
+        return len(self._indices(start, end))
+
+    def _indices(self, start, end):
+        step = 86400 / self.rate
+        first = int(max(0, (start - self.epoch).total_seconds()) // step)
+        last = int((end - self.epoch).total_seconds() // step)
+        return [
+            i
+            for i in range(first, last + 1)
+            if start <= self.epoch + timedelta(seconds=i * step) <= end
+        ]
+
+    def respond(self, params):
+        """
+        Build the response for a query
+
+        :return: The status code and the body
+        :rtype: Tuple[int, dict]
+        """
+        with self._lock:
+            self.requests += 1
+            fail = self.random.random() < self.error_rate
+            if fail:
+                self.errors += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if fail:
+            return 503, {"error": "Service unavailable"}
+
+        recorded = self.responses.get(_normalize(params))
+        if recorded is not None:
+            return 200, recorded
+
+        hek = Config.time_format.hek
+        start = datetime.strptime(params["event_starttime"][0], hek)
+        end = datetime.strptime(params["event_endtime"][0], hek)
+        step = 86400 / self.rate
+        indices = self._indices(start, end)
+        overmax = bool(self.limit) and len(indices) > self.limit
+        if overmax:
+            indices = indices[: self.limit]
+        result = [
+            synthetic_event(i, self.epoch + timedelta(seconds=i * step))
+            for i in indices
+        ]
+        return 200, {"result": result, "overmax": overmax}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Keep connections alive, like the real server
+    protocol_version = "HTTP/1.1"
+    replay = None
+
+    def do_GET(self):
+        params = parse_qs(urlparse(self.path).query)
+        status, body = self.replay.respond(params)
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
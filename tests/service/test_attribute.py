@@ -1,4 +1,4 @@
-from solar.service.attribute import Attribute
+from solar.service.attribute import Attribute, Attribute_Store
 from solar.database.tables.service_request import Service_Request, Service_Parameter
 import unittest
 from tests.utils import test_db
@@ -61,3 +61,44 @@ class TestAttribute(unittest.TestCase):
         for a, m in zip(new_att, models):
             self.assertEqual(a.value, m.value)
             self.assertEqual(a.name, m.key)
+
+
+class TestAttributeStore(unittest.TestCase):
+
+    """Test case docstring."""
+
+    def setUp(self):
+        self.store = Attribute_Store(
+            [Attribute("param1", 30), Attribute("param2", "lorem")]
+        )
+
+    def tearDown(self):
+        pass
+
+    def test_lookup(self):
+        self.assertEqual(self.store["param1"].value, 30)
+        self.assertIn("param2", self.store)
+        self.assertIn(Attribute("param2", "lorem"), self.store)
+        self.assertNotIn(Attribute("param2", "ipsum"), self.store)
+        self.assertIsNone(self.store.get("missing"))
+        with self.assertRaises(KeyError):
+            self.store["missing"]
+
+    def test_override(self):
+        self.store.append(Attribute("param1", 100))
+        self.store.append(Attribute("new", [1, 2]))
+        self.assertEqual(len(self.store), 3)
+        self.assertEqual([a.name for a in self.store], ["param1", "param2", "new"])
+        self.assertEqual(self.store["param1"].value, 100)
+
+    def test_merge(self):
+        merged = self.store.merge([Attribute("param2", "ipsum")])
+        self.assertEqual(merged.as_dict(), {"param1": 30, "param2": "ipsum"})
+        self.assertEqual(self.store["param2"].value, "lorem")
+
+    @test_db()
+    def test_save(self):
+        req = Service_Request.create(service_type="test", status="unsubmitted")
+        Service_Parameter.bulk_create([a.as_model(req) for a in self.store])
+        loaded = Attribute_Store(Attribute.from_model(p) for p in req.parameters)
+        self.assertEqual(loaded.as_dict(), self.store.as_dict())
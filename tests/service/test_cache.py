@@ -0,0 +1,80 @@
+from solar.service.cache import Response_Cache
+from solar.service.utils import params_digest
+import unittest
+import tempfile
+import time
+import os
+
+
+class TestResponseCache(unittest.TestCase):
+
+    """Test case docstring."""
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_roundtrip(self):
+        cache = Response_Cache(self.dir.name)
+        params = {"event_type": ["cj"], "x1": -1200}
+        self.assertIsNone(cache.get(params))
+        cache.put(params, {"result": [1, 2, 3]})
+        self.assertEqual(cache.get({"x1": "-1200", "event_type": ["cj"]}), {"result": [1, 2, 3]})
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_ttl(self):
+        cache = Response_Cache(self.dir.name, ttl=0.05)
+        cache.put({"a": 1}, [1])
+        time.sleep(0.1)
+        self.assertIsNone(cache.get({"a": 1}))
+        self.assertEqual(cache.misses, 1)
+
+    def test_eviction(self):
+        cache = Response_Cache(self.dir.name, max_size=250)
+        for i in range(3):
+            cache.put({"a": i}, "x" * 40)
+        # Entry 1 is the least recently used one, entry 0 the most recent
+        now = time.time()
+        for i, offset in enumerate([3, -10, 0]):
+            os.utime(cache._entry_path({"a": i}), (now + offset, now + offset))
+        cache.put({"a": 3}, "x" * 40)
+        self.assertIsNone(cache.get({"a": 1}))
+        for i in [0, 2, 3]:
+            self.assertIsNotNone(cache.get({"a": i}))
+        self.assertLessEqual(cache._disk_size(), 250)
+
+    def test_size(self):
+        cache = Response_Cache(self.dir.name)
+        for i in range(3):
+            cache.put({"a": i}, "x" * 40)
+        # Overwriting an entry only counts the difference
+        for _ in range(3):
+            cache.put({"a": 0}, "x" * 80)
+        self.assertEqual(cache._size, cache._disk_size())
+
+
+class TestDigest(unittest.TestCase):
+
+    """Test case docstring."""
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    def test_stable(self):
+        self.assertEqual(
+            params_digest({"waves": 304, "fovx": 120.0}),
+            params_digest({"fovx": "120", "waves": "304"}),
+        )
+        self.assertNotEqual(
+            params_digest({"waves": 304}), params_digest({"waves": 171})
+        )
+
+    def test_exclude(self):
+        self.assertEqual(
+            params_digest({"a": 1, "t": 2}, exclude=["t"]), params_digest({"a": 1})
+        )
@@ -0,0 +1,188 @@
+from solar.service.client import (
+    Concurrency_Limiter,
+    Http_Client,
+    Retry_Policy,
+    Circuit_Breaker,
+    Circuit_Open,
+)
+from solar.common.config import Config
+from requests.exceptions import ConnectionError, HTTPError
+import unittest
+from unittest import mock
+
+
+class TestLimiter(unittest.TestCase):
+
+    """Test case docstring."""
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    def test_backoff(self):
+        lim = Concurrency_Limiter(8, min_limit=2, latency_factor=2.0)
+        lim.acquire()
+        lim.release(1.0)
+        self.assertEqual(lim.limit, 8)
+
+        lim.acquire()
+        lim.release(5.0)
+        self.assertEqual(lim.limit, 4)
+
+        for _ in range(3):
+            lim.acquire()
+            lim.release(10.0)
+        self.assertEqual(lim.limit, 2)
+
+    def test_recover(self):
+        lim = Concurrency_Limiter(4, latency_factor=2.0)
+        lim.acquire()
+        lim.release(1.0)
+        lim.acquire()
+        lim.release(3.0)
+        self.assertEqual(lim.limit, 2)
+        for _ in range(5):
+            lim.acquire()
+            lim.release(1.0)
+        self.assertEqual(lim.limit, 4)
+        self.assertEqual(lim.in_flight, 0)
+
+
+class TestClient(unittest.TestCase):
+
+    """Test case docstring."""
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    def test_timings(self):
+        session = mock.Mock()
+        session.get.return_value = mock.Mock(status_code=200)
+        client = Http_Client(session=session, timeout=5, use_breaker=False)
+        client.get("http://localhost", params={"a": 1})
+        client.get("http://localhost", params={"a": 2})
+
+        self.assertEqual(len(client.timings), 2)
+        self.assertEqual(client.timings[1].params, {"a": 2})
+        self.assertEqual(client.timings[0].status_code, 200)
+        session.get.assert_called_with(
+            "http://localhost", params={"a": 2}, timeout=5
+        )
+
+    def test_timings_bounded(self):
+        session = mock.Mock()
+        session.get.return_value = mock.Mock(status_code=200)
+        max_timings = Config.http.max_timings
+        Config.http.max_timings = 3
+        try:
+            client = Http_Client(session=session, use_breaker=False)
+        finally:
+            Config.http.max_timings = max_timings
+        for i in range(5):
+            client.get("http://localhost", params={"a": i})
+        self.assertEqual([t.params["a"] for t in client.timings], [2, 3, 4])
+
+    def test_retry(self):
+        session = mock.Mock()
+        session.get.side_effect = [
+            ConnectionError("down"),
+            mock.Mock(status_code=503),
+            mock.Mock(status_code=200),
+        ]
+        client = Http_Client(
+            session=session, retry=Retry_Policy(attempts=3, backoff=0), use_breaker=False
+        )
+        self.assertEqual(client.get("http://localhost").status_code, 200)
+        self.assertEqual(session.get.call_count, 3)
+        self.assertEqual(len(client.timings), 3)
+
+    def test_no_retry(self):
+        session = mock.Mock()
+        session.get.return_value = mock.Mock(status_code=404)
+        client = Http_Client(
+            session=session, retry=Retry_Policy(attempts=3, backoff=0), use_breaker=False
+        )
+        with self.assertRaises(HTTPError):
+            client.get("http://localhost")
+        self.assertEqual(session.get.call_count, 1)
+
+    def test_give_up(self):
+        session = mock.Mock()
+        session.get.side_effect = ConnectionError("down")
+        client = Http_Client(
+            session=session, retry=Retry_Policy(attempts=2, backoff=0), use_breaker=False
+        )
+        with self.assertRaises(ConnectionError):
+            client.get("http://localhost")
+        self.assertEqual(session.get.call_count, 2)
+
+
+class TestBreaker(unittest.TestCase):
+
+    """Test case docstring."""
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    def test_open(self):
+        breaker = Circuit_Breaker(threshold=2, reset_time=60)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+
+    def test_trial(self):
+        breaker = Circuit_Breaker(threshold=1, reset_time=0)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_success()
+        self.assertTrue(breaker.allow())
+        self.assertTrue(breaker.allow())
+
+    def test_client(self):
+        session = mock.Mock()
+        session.get.side_effect = ConnectionError("down")
+        client = Http_Client(session=session, retry=Retry_Policy(attempts=1))
+        url = "http://breaker.test"
+        breaker = Circuit_Breaker.for_host(url)
+        for _ in range(breaker.threshold):
+            with self.assertRaises(ConnectionError):
+                client.get(url)
+        with self.assertRaises(Circuit_Open) as raised:
+            client.get(url)
+        self.assertEqual(session.get.call_count, breaker.threshold)
+        self.assertGreater(raised.exception.retry_after, 0)
+
+    def test_once_per_request(self):
+        session = mock.Mock()
+        session.get.side_effect = ConnectionError("down")
+        client = Http_Client(session=session, retry=Retry_Policy(attempts=4, backoff=0))
+        url = "http://retried.test"
+        breaker = Circuit_Breaker.for_host(url)
+        with self.assertRaises(ConnectionError):
+            client.get(url)
+        self.assertEqual(session.get.call_count, 4)
+        self.assertEqual(breaker.failures, 1)
+        self.assertFalse(breaker.is_open)
+
+    def test_wait_open(self):
+        session = mock.Mock()
+        session.get.return_value = mock.Mock(status_code=200)
+        url = "http://waiting.test"
+        breaker = Circuit_Breaker.for_host(url)
+        breaker.reset_time = 0.05
+        for _ in range(breaker.threshold):
+            breaker.record_failure()
+        client = Http_Client(session=session, wait_open=True)
+        client.get(url)
+        self.assertEqual(session.get.call_count, 1)
+        self.assertFalse(breaker.is_open)
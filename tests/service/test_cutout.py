@@ -0,0 +1,392 @@
+from solar.service.cutout import (
+    Cutout_Service,
+    resume_cutouts,
+    group_events,
+    coalesce_cutouts,
+    Cutout_Size,
+)
+from solar.database.tables.service_request import Service_Request
+from solar.database.tables.fits_file import Fits_File
+from solar.database.tables.hek_event import Hek_Event
+from solar.database.tables.join_event_fit import Join_Event_Fits
+from solar.service.attribute import Attribute as Att
+from solar.common.config import Config
+from datetime import datetime, timedelta
+import unittest
+from unittest import mock
+from tests.utils import test_db
+
+
+class MockPage:
+    def __init__(self, text, status_code=200):
+        self.text = text
+        self.status_code = status_code
+
+
+def mock_ssw(ready_jobs):
+    def mocked_get(url, **kwargs):
+        if url.endswith("list.txt"):
+            return MockPage("http://x/a/aia_304_1.fits\nhttp://x/a/aia_304_2.fits\n")
+        if any(job in url for job in ready_jobs):
+            return MockPage('Per-Wave file lists <p><a href="list.txt">304</a>')
+        return MockPage("Still processing")
+
+    return mocked_get
+
+
+class TestResume(unittest.TestCase):
+
+    """Test case docstring."""
+
+    def setUp(self):
+        self.deadline = Config.cutout.deadline
+        Config.cutout.deadline = 0.2
+
+    def tearDown(self):
+        Config.cutout.deadline = self.deadline
+
+    @test_db()
+    @mock.patch("requests.Session.get", side_effect=mock_ssw(["ssw_ready"]))
+    @mock.patch.object(Cutout_Service, "submit_request")
+    def test_resume(self, submit, get):
+        for ycen, job_id in enumerate(["ssw_ready", "ssw_late"]):
+            c = Cutout_Service(fovx=200, ycen=ycen)
+            c.job_id = job_id
+            c.status = "submitted"
+            c.save_request()
+        Service_Request.create(service_type="cutout", status="completed", job_id="old")
+
+        done = resume_cutouts()
+
+        submit.assert_not_called()
+        self.assertEqual(len(done), 2)
+        status = {r.job_id: r.status for r in Service_Request.select()}
+        self.assertEqual(
+            status, {"ssw_ready": "completed", "ssw_late": "submitted", "old": "completed"}
+        )
+        self.assertEqual(Fits_File.select().count(), 2)
+        late = [c for c in done if c.job_id == "ssw_late"][0]
+        self.assertEqual(late.failures[0].stage, "deadline")
+        self.assertEqual(late.params["fovx"].value, 200)
+
+
+def make_event(i, x, y, start, minutes=30, size=60):
+    return Hek_Event.create(
+        event_id=f"event_{i}",
+        sol_standard=f"SOL_{i}",
+        start_time=start,
+        end_time=start + timedelta(minutes=minutes),
+        hpc_x=x,
+        hpc_y=y,
+        x_min=x - size / 2,
+        x_max=x + size / 2,
+        y_min=y - size / 2,
+        y_max=y + size / 2,
+    )
+
+
+class TestCoalesce(unittest.TestCase):
+
+    """Test case docstring."""
+
+    def setUp(self):
+        self.start = datetime(2012, 1, 1)
+
+    def tearDown(self):
+        pass
+
+    @test_db()
+    def test_groups(self):
+        t = self.start
+        events = [
+            make_event(0, 0, 0, t),
+            # Overlaps event 0 in time and space
+            make_event(1, 50, 50, t + timedelta(minutes=20)),
+            # Same place, but after the group has ended
+            make_event(2, 0, 0, t + timedelta(hours=2)),
+            # Same time, other side of the disk
+            make_event(3, 800, -400, t),
+            # Overlaps event 0, but the covering box would be too large
+            make_event(4, 100, 0, t, size=700),
+        ]
+        groups = group_events(events, max_fov=600)
+        self.assertEqual(
+            sorted([e.event_id for e in g] for g in groups),
+            [["event_0", "event_1"], ["event_2"], ["event_3"], ["event_4"]],
+        )
+
+        reqs = coalesce_cutouts(events, max_fov=600)
+        self.assertEqual(len(reqs), 4)
+        joint = [c for c in reqs if len(c.events) == 2][0]
+        self.assertEqual(joint.event.event_id, "event_0")
+        self.assertEqual(joint.params["xcen"].value, 25)
+        self.assertEqual(joint.params["fovx"].value, 170)
+        self.assertEqual(joint.params["starttime"].value, t)
+        self.assertEqual(joint.params["endtime"].value, t + timedelta(minutes=50))
+
+    @test_db()
+    def test_fan_out(self):
+        events = [make_event(0, 0, 0, self.start), make_event(1, 10, 10, self.start)]
+        c, = coalesce_cutouts(events)
+        c.job_id = "ssw_joint"
+        c.data = [c._as_fits(f"aia_{i}.fits") for i in range(3)]
+        c.save_data()
+        c.save_data()
+
+        self.assertEqual(Join_Event_Fits.select().count(), 6)
+        for e in events:
+            self.assertEqual(e.fits_join.count(), 3)
+        self.assertEqual(
+            {f.event.event_id for f in Fits_File.select()}, {"event_0"}
+        )
+
+    @test_db()
+    def test_strict_group(self):
+        events = [make_event(0, 0, 0, self.start), make_event(1, 10, 10, self.start)]
+        c, = coalesce_cutouts(events)
+        c.job_id = "ssw_joint"
+        c.status = "submitted"
+        c.save_request()
+
+        again, = coalesce_cutouts(events)
+        self.assertEqual(again.service_request_id, c.service_request_id)
+        self.assertEqual(again.job_id, "ssw_joint")
+        self.assertEqual([e.event_id for e in again.events], ["event_0", "event_1"])
+
+        loaded = Cutout_Service._from_model(Service_Request.get())
+        self.assertEqual([e.event_id for e in loaded.events], ["event_0", "event_1"])
+        self.assertIsNone(coalesce_cutouts(events, strict=False)[0].service_request_id)
+
+
+class TestSaveData(unittest.TestCase):
+
+    """Test case docstring."""
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    @test_db()
+    def test_bulk(self):
+        c = Cutout_Service()
+        c.job_id = "ssw_bulk"
+        c.data = [c._as_fits(f"aia_{i}.fits") for i in range(300)]
+        existing = c._as_fits("aia_7.fits")
+        existing.save()
+
+        c.save_data()
+
+        self.assertEqual(Fits_File.select().count(), 300)
+        self.assertTrue(all(f.id is not None for f in c.data))
+        self.assertEqual(c.data[7].id, existing.id)
+        self.assertEqual(
+            [f.server_file_name for f in c.data], [f"aia_{i}.fits" for i in range(300)]
+        )
+
+
+class TestFromEvents(unittest.TestCase):
+
+    """Test case docstring."""
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    @test_db()
+    def test_prefetch(self):
+        start = datetime(2012, 1, 1)
+        events = [make_event(i, 100 * i, 0, start) for i in range(4)]
+        for e in events[:2]:
+            c = Cutout_Service._from_event(e, strict=False)
+            c.params.append(Att("waves", [171, 193]))
+            c.job_id = f"ssw_{e.event_id}"
+            c.status = "submitted"
+            c.save_request()
+
+        db = Service_Request._meta.database
+        with mock.patch.object(db, "execute_sql", wraps=db.execute_sql) as sql:
+            reqs = Cutout_Service._from_events(Hek_Event.select().order_by(Hek_Event.id))
+            for c in reqs:
+                c.params.as_dict()
+                c.event.event_id
+        # The events, the requests, their parameters, the list values and the events they cover
+        self.assertEqual(sql.call_count, 5)
+
+        self.assertEqual([c.event.event_id for c in reqs], [e.event_id for e in events])
+        self.assertEqual([c.job_id for c in reqs], ["ssw_event_0", "ssw_event_1", None, None])
+        self.assertEqual(reqs[1].params["waves"].value, [171, 193])
+        self.assertEqual(reqs[2].params["xcen"].value, 200)
+
+
+class TestWaves(unittest.TestCase):
+
+    """Test case docstring."""
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    @mock.patch(
+        "requests.Session.get",
+        return_value=MockPage('<param name="JobID">ssw_waves</param>'),
+    )
+    def test_params(self, get):
+        c = Cutout_Service(waves=[171, 193, 211])
+        self.assertEqual(c.waves, [171, 193, 211])
+        c.submit_request(auto_save=False)
+        self.assertEqual(get.call_args[1]["params"]["waves"], "171,193,211")
+        self.assertEqual(c.job_id, "ssw_waves")
+
+    def test_channel(self):
+        c = Cutout_Service(waves=[171, 193])
+        c.job_id = "ssw_waves"
+        f = c._as_fits("ssw_cutout_20140607_215306_AIA_193_.fts")
+        self.assertEqual(f.channel, 193)
+        self.assertIsNone(c._as_fits("unknown.fts").channel)
+
+        single = Cutout_Service()
+        self.assertEqual(single._as_fits("unknown.fts").channel, 304)
+
+
+class TestSize(unittest.TestCase):
+
+    """Test case docstring."""
+
+    def setUp(self):
+        self.start = datetime(2012, 1, 1)
+
+    def tearDown(self):
+        pass
+
+    def test_frames(self):
+        size = Cutout_Size(cadence=12, frame_budget=100)
+        self.assertEqual(size.frames(self.start, self.start + timedelta(minutes=10)), 50)
+        self.assertEqual(size.frames(self.start, self.start + timedelta(hours=2)), 100)
+        self.assertEqual(size.frames(self.start, self.start), 1)
+
+    def test_fov(self):
+        size = Cutout_Size(max_fov_pix=500, padding=0.5)
+        self.assertEqual(size.fov(10), Config.cutout.min_fov)
+        self.assertEqual(size.fov(200), 300)
+        self.assertEqual(size.fov(2000), 500 * Config.cutout.plate_scale)
+
+    @test_db()
+    def test_from_event(self):
+        event = make_event(0, 100, 200, self.start, minutes=60, size=400)
+        size = Cutout_Size(cadence=60, frame_budget=50, max_fov_pix=1000, padding=0.25)
+        c = Cutout_Service._from_event(event, strict=False, size=size)
+        self.assertEqual(c.params["fovx"].value, 500)
+        self.assertEqual(c.params["xcen"].value, 100)
+        self.assertEqual(c.params["max_frames"].value, 50)
+
+        # Without an explicit size the frames follow the configured cadence
+        c = Cutout_Service(
+            starttime=self.start, endtime=self.start + timedelta(minutes=2)
+        )
+        self.assertEqual(c.params["max_frames"].value, 120 // Config.cutout.cadence)
+        c = Cutout_Service(max_frames=7)
+        self.assertEqual(c.params["max_frames"].value, 7)
+
+    @test_db()
+    def test_default_box(self):
+        # Without a size the box is the bounding box of the event, as for the requests made before sizes existed
+        event = make_event(0, 100, 200, self.start, size=2000)
+        c = Cutout_Service._from_event(event, strict=False)
+        self.assertEqual(c.params["fovx"].value, 2000)
+        small = make_event(1, 100, 200, self.start, size=10)
+        c = Cutout_Service._from_event(small, strict=False)
+        self.assertEqual(c.params["fovx"].value, Config.cutout.min_fov)
+
+
+class TestFingerprint(unittest.TestCase):
+
+    """Test case docstring."""
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    @test_db()
+    @mock.patch(
+        "requests.Session.get",
+        side_effect=[
+            MockPage('<param name="JobID">ssw_first</param>'),
+            MockPage('<param name="JobID">ssw_other</param>'),
+        ],
+    )
+    def test_reuse(self, get):
+        first = Cutout_Service(xcen=100, fovx=200)
+        first.submit_request()
+        self.assertEqual(get.call_count, 1)
+
+        # A submitted job is reused
+        second = Cutout_Service(fovx=200, xcen=100)
+        self.assertTrue(second.submit_request())
+        self.assertEqual(get.call_count, 1)
+        self.assertEqual(second.job_id, "ssw_first")
+        second.save_request()
+        self.assertEqual(second.service_request_id, first.service_request_id)
+
+        # And so are the files of a completed job
+        first.data = [first._as_fits(f"aia_{i}.fits") for i in range(2)]
+        first.status = "completed"
+        first.save_request()
+        first.save_data()
+        third = Cutout_Service(fovx=200, xcen=100)
+        self.assertTrue(third.fetch_data())
+        self.assertEqual(get.call_count, 1)
+        self.assertEqual([f.id for f in third.data], [f.id for f in first.data])
+
+        other = Cutout_Service(fovx=300, xcen=100)
+        other.submit_request()
+        self.assertEqual(get.call_count, 2)
+        self.assertEqual(Service_Request.select().count(), 2)
+
+    @test_db()
+    def test_save_waves(self):
+        c = Cutout_Service(channel=[171, 193])
+        c.status = "submitted"
+        for _ in range(3):
+            c.save_request()
+        req = Service_Request.get_by_id(c.service_request_id)
+        loaded = Cutout_Service._from_model(req)
+        self.assertEqual(loaded.waves, [171, 193])
+        self.assertEqual(loaded.fingerprint, c.fingerprint)
+
+    @test_db()
+    @mock.patch(
+        "requests.Session.get",
+        side_effect=[MockPage('<param name="JobID">ssw_shared</param>')],
+    )
+    def test_reuse_other_event(self, get):
+        start = datetime(2012, 1, 1)
+        events = [make_event(i, 0, 0, start) for i in range(2)]
+        for e in events:
+            e.save()
+        first = Cutout_Service(xcen=100, fovx=200)
+        first.event = events[0]
+        first.submit_request()
+
+        # The same job is used for the second event, but its request is not taken over
+        second = Cutout_Service(xcen=100, fovx=200)
+        second.event = events[1]
+        second.submit_request()
+        self.assertEqual(get.call_count, 1)
+        self.assertEqual(second.job_id, "ssw_shared")
+        self.assertNotEqual(second.service_request_id, first.service_request_id)
+        rows = {r.id: r.event_id for r in Service_Request.select()}
+        self.assertEqual(
+            rows,
+            {
+                first.service_request_id: events[0].id,
+                second.service_request_id: events[1].id,
+            },
+        )
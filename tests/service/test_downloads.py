@@ -0,0 +1,283 @@
+from solar.service.downloads import (
+    download_single_file,
+    multi_downloader,
+    Download_Engine,
+    Download_Error,
+    Token_Bucket,
+    part_suffix,
+)
+from solar.service.client import Circuit_Breaker
+from solar.common.config import Config
+from solar.common.utils import checksum
+from requests.exceptions import ConnectionError, ChunkedEncodingError, HTTPError
+from pathlib import Path
+from aiohttp import web
+import asyncio
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+files = {"http://x/a.fits": b"a" * 100000, "http://x/b.fits": b"SIMPLE" * 5000}
+
+
+class MockStream:
+    def __init__(self, content, headers, status_code=200, break_after=None):
+        self.content = content
+        self.headers = headers
+        self.status_code = status_code
+        self.break_after = break_after
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def iter_content(self, chunk_size=1):
+        for i in range(0, len(self.content), chunk_size):
+            if self.break_after is not None and i >= self.break_after:
+                raise ChunkedEncodingError("Connection broken")
+            yield self.content[i : i + chunk_size]
+
+
+class MockServer:
+    def __init__(self, break_after=None, ranges=True):
+        self.break_after = break_after
+        self.ranges = ranges
+        self.calls = []
+
+    def get(self, url, headers=None, **kwargs):
+        headers = headers or {}
+        self.calls.append(headers.get("Range"))
+        if url not in files:
+            raise ConnectionError("down")
+        content = files[url]
+        break_after, self.break_after = self.break_after, None
+        if "Range" in headers and self.ranges:
+            start = int(headers["Range"][6:-1])
+            return MockStream(
+                content[start:],
+                {"Content-Range": f"bytes {start}-{len(content) - 1}/{len(content)}"},
+                206,
+                break_after,
+            )
+        return MockStream(
+            content, {"Content-Length": str(len(content))}, 200, break_after
+        )
+
+
+class TestDownloads(unittest.TestCase):
+
+    """Test case docstring."""
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.dir.name)
+        self.backoff = Config.http.backoff
+        Config.http.backoff = 0
+        Circuit_Breaker._breakers.clear()
+
+    def tearDown(self):
+        Config.http.backoff = self.backoff
+        self.dir.cleanup()
+
+    def test_single(self):
+        server = MockServer()
+        path = self.root / "sub" / "a.fits"
+        with mock.patch("requests.Session.get", side_effect=server.get):
+            digest = download_single_file("http://x/a.fits", path)
+        self.assertEqual(path.read_bytes(), files["http://x/a.fits"])
+        self.assertEqual(digest, checksum(path))
+        self.assertFalse(path.with_name(path.name + part_suffix).exists())
+
+    def test_resume(self):
+        server = MockServer(break_after=8192 * 5)
+        path = self.root / "a.fits"
+        with mock.patch("requests.Session.get", side_effect=server.get):
+            digest = download_single_file("http://x/a.fits", path)
+        self.assertEqual(server.calls, [None, "bytes=40960-"])
+        self.assertEqual(path.read_bytes(), files["http://x/a.fits"])
+        self.assertEqual(digest, checksum(path))
+
+    def test_resume_later(self):
+        path = self.root / "a.fits"
+        part = path.with_name(path.name + part_suffix)
+        part.write_bytes(files["http://x/a.fits"][:1000])
+        server = MockServer()
+        with mock.patch("requests.Session.get", side_effect=server.get):
+            download_single_file("http://x/a.fits", path)
+        self.assertEqual(server.calls, ["bytes=1000-"])
+        self.assertEqual(path.read_bytes(), files["http://x/a.fits"])
+
+    def test_range_ignored(self):
+        path = self.root / "b.fits"
+        part = path.with_name(path.name + part_suffix)
+        part.write_bytes(b"garbage")
+        server = MockServer(ranges=False)
+        with mock.patch("requests.Session.get", side_effect=server.get):
+            download_single_file("http://x/b.fits", path)
+        self.assertEqual(path.read_bytes(), files["http://x/b.fits"])
+
+    def test_retried_once(self):
+        server = MockServer()
+        path = self.root / "missing.fits"
+        with mock.patch("requests.Session.get", side_effect=server.get):
+            with self.assertRaises(ConnectionError):
+                download_single_file("http://x/missing.fits", path)
+        # Only the client retries a failed request
+        self.assertEqual(len(server.calls), Config.http.retries + 1)
+
+    def test_server_error_closed(self):
+        responses = [MockStream(b"", {}, 503), MockStream(b"", {}, 404)]
+        with mock.patch("requests.Session.get", side_effect=responses):
+            with self.assertRaises(HTTPError):
+                download_single_file("http://x/a.fits", self.root / "a.fits")
+        self.assertTrue(all(r.closed for r in responses))
+
+    def test_bad_checksum(self):
+        path = self.root / "a.fits"
+        with mock.patch("requests.Session.get", side_effect=MockServer().get):
+            with self.assertRaises(Download_Error):
+                download_single_file("http://x/a.fits", path, expected_hash="0")
+        self.assertFalse(path.exists())
+        self.assertFalse(path.with_name(path.name + part_suffix).exists())
+
+    def test_multi(self):
+        struct = {url: self.root / Path(url).name for url in files}
+        struct["http://x/missing.fits"] = self.root / "missing.fits"
+        engine = Download_Engine(backend="threads", per_host=1)
+        with mock.patch("requests.Session.get", side_effect=MockServer().get):
+            digests = multi_downloader(struct, engine=engine)
+        self.assertEqual(set(digests), set(files))
+        self.assertEqual(list(engine.errors), ["http://x/missing.fits"])
+        self.assertEqual(engine.bytes_received, sum(len(x) for x in files.values()))
+        for url, digest in digests.items():
+            self.assertEqual(digest, checksum(struct[url]))
+
+    def test_priority(self):
+        started = []
+        server = MockServer()
+
+        def get(url, **kwargs):
+            started.append(url)
+            return server.get(url, **kwargs)
+
+        engine = Download_Engine(backend="threads", max_concurrency=1)
+        engine.add("http://x/a.fits", self.root / "a.fits", priority=2)
+        engine.add("http://x/b.fits", self.root / "b.fits", priority=1)
+        with mock.patch("requests.Session.get", side_effect=get):
+            engine.run()
+        self.assertEqual(started, ["http://x/b.fits", "http://x/a.fits"])
+
+    def test_busy_host(self):
+        started = []
+        server = MockServer()
+
+        def get(url, **kwargs):
+            started.append(url)
+            if "slow" in url:
+                time.sleep(0.1)
+            return server.get(url.replace("slow", "x"), **kwargs)
+
+        engine = Download_Engine(backend="threads", max_concurrency=2, per_host=1)
+        for i in range(3):
+            engine.add("http://slow/a.fits", self.root / f"{i}.fits", priority=i)
+        engine.add("http://x/b.fits", self.root / "b.fits", priority=3)
+        with mock.patch("requests.Session.get", side_effect=get):
+            engine.run()
+        # The file of the other host does not wait behind the busy one
+        self.assertEqual(started[:2], ["http://slow/a.fits", "http://x/b.fits"])
+        self.assertEqual(len(started), 4)
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    """Test case docstring."""
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    def test_rate(self):
+        bucket = Token_Bucket(rate=100000, burst=10000)
+        start = time.monotonic()
+        for _ in range(5):
+            bucket.take(10000)
+        # The first take is covered by the burst, the others wait 0.1s each
+        self.assertGreater(time.monotonic() - start, 0.35)
+
+    def test_unlimited(self):
+        bucket = Token_Bucket()
+        start = time.monotonic()
+        bucket.take(10 ** 9)
+        self.assertLess(time.monotonic() - start, 0.1)
+
+
+class TestAsyncEngine(unittest.TestCase):
+
+    """Test case docstring."""
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.dir.name)
+        self.requests = []
+        ready = threading.Event()
+
+        async def handler(request):
+            name = request.match_info["name"]
+            self.requests.append(request.headers.get("Range"))
+            if name not in self.files:
+                raise web.HTTPNotFound()
+            return web.Response(body=self.files[name])
+
+        self.files = {f"{i}.fits": bytes([i]) * (1000 + i) for i in range(50)}
+
+        async def serve():
+            app = web.Application()
+            app.router.add_get("/{name}", handler)
+            self.runner = web.AppRunner(app)
+            await self.runner.setup()
+            site = web.TCPSite(self.runner, "127.0.0.1", 0)
+            await site.start()
+            self.port = self.runner.addresses[0][1]
+            ready.set()
+
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(serve(), self.loop)
+        ready.wait(5)
+
+    def tearDown(self):
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result(5)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(5)
+        self.dir.cleanup()
+
+    def test_many_files(self):
+        base = f"http://127.0.0.1:{self.port}"
+        struct = {f"{base}/{name}": self.root / name for name in self.files}
+        struct[f"{base}/missing.fits"] = self.root / "missing.fits"
+        engine = Download_Engine(backend="async", max_concurrency=8, per_host=4)
+
+        digests = multi_downloader(struct, engine=engine)
+
+        self.assertEqual(len(digests), 50)
+        self.assertEqual(list(engine.errors), [f"{base}/missing.fits"])
+        for name, content in self.files.items():
+            self.assertEqual((self.root / name).read_bytes(), content)
+            self.assertEqual(digests[f"{base}/{name}"], checksum(self.root / name))
+        self.assertEqual(engine.bytes_received, sum(map(len, self.files.values())))
+        self.assertGreater(engine.throughput, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -6,9 +6,12 @@ from unittest import mock
 from tests.utils import test_db, mock_get_json
 from pathlib import Path
 import json
+import time
 from datetime import datetime, timedelta
 from solar.common.config import Config
 from .utils import load_responses
+from solar.service.cache import Response_Cache
+import tempfile
 
 
 class TestHek(unittest.TestCase):
@@ -29,15 +32,221 @@ class TestHek(unittest.TestCase):
             self.assertEqual(hek[x], param_dict[x])
 
     @test_db()
-    @mock.patch("requests.get", side_effect=mock_get_json(load_responses()))
+    @mock.patch("requests.Session.get", side_effect=mock_get_json(load_responses()))
     def test_request(self, mock_get):
         x, y = ("2010-06-01T00:00:00", "2010-07-01T00:00:00")
         hek = Hek_Service(event_starttime=x, event_endtime=y)
         hek.submit_request()
         self.assertEqual(len(hek.data), 8)
+        self.assertEqual(hek.windows_issued, 1)
         event1 = hek.data[0]
         self.assertEqual(event1.sol_standard, "SOL2010-06-04T09:21:47L246C049")
 
+    def test_merge_duplicates(self):
+        h = Hek_Service()
+        events = [
+            Hek_Event(event_id="1", description="first"),
+            Hek_Event(event_id="2"),
+            Hek_Event(event_id="1", description="second"),
+            Hek_Event(event_id="3"),
+        ]
+        h.data = events
+        self.assertEqual([e.event_id for e in h.data], ["1", "2", "3"])
+        self.assertEqual(h.data[0].description, "first")
+
+    @test_db()
+    @mock.patch("requests.Session.get", side_effect=mock_get_json(load_responses()))
+    def test_cached_request(self, mock_get):
+        x, y = ("2010-06-01T00:00:00", "2010-07-01T00:00:00")
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = Response_Cache(cache_dir)
+            for _ in range(2):
+                hek = Hek_Service(event_starttime=x, event_endtime=y)
+                hek.cache = cache
+                hek.submit_request()
+                self.assertEqual(len(hek.data), 8)
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    @test_db()
+    @mock.patch("requests.Session.get", side_effect=mock_get_json(load_responses()))
+    def test_incremental(self, mock_get):
+        x, y, z = ("2010-06-01T00:00:00", "2010-07-01T00:00:00", "2010-07-15T00:00:00")
+        hek = Hek_Service(event_starttime=x, event_endtime=y)
+        hek.submit_request(incremental=True)
+        # Saving the request alone does not mark the range as covered, its events are not in the database
+        hek.save_request()
+        self.assertEqual(len(hek.find_gaps()), 1)
+        hek.save_data()
+        self.assertEqual(len(hek.find_gaps()), 0)
+        self.assertEqual(mock_get.call_count, 1)
+
+        hek = Hek_Service(event_starttime=x, event_endtime=y)
+        hek.submit_request(incremental=True)
+        self.assertEqual(hek.windows_issued, 0)
+        self.assertEqual(mock_get.call_count, 1)
+
+        hek = Hek_Service(event_starttime=x, event_endtime=z, event_type=["fl"])
+        self.assertEqual(len(hek.find_gaps()), 1)
+
+        hek = Hek_Service(event_starttime=x, event_endtime=z)
+        hek.submit_request(incremental=True)
+        self.assertEqual(hek.windows_issued, 1)
+        params = mock_get.call_args[1]["params"]
+        self.assertEqual((params["event_starttime"], params["event_endtime"]), (y, z))
+        # The recorded responses do not include this interval, so it fails and stays uncovered
+        self.assertEqual(hek.failures[0].key, (y, z))
+        self.assertEqual(hek.covered, [])
+
+    @test_db()
+    @mock.patch("requests.Session.get", side_effect=mock_get_json(load_responses()))
+    def test_reload_covered(self, mock_get):
+        x, y = ("2010-06-01T00:00:00", "2010-07-01T00:00:00")
+        hek = Hek_Service(event_starttime=x, event_endtime=y)
+        hek.submit_request()
+        hek.save_data()
+        # Saved again, as the cli does
+        hek.save_request()
+        loaded = Hek_Service._from_model(
+            Service_Request.get_by_id(hek.service_request_id)
+        )
+        self.assertEqual(loaded.coverage_hash, hek.coverage_hash)
+        self.assertEqual(loaded.find_gaps(), [])
+
+    @test_db()
+    @mock.patch("requests.Session.get", side_effect=mock_get_json(load_responses()))
+    def test_fingerprint(self, mock_get):
+        x, y = ("2010-06-01T00:00:00", "2010-07-01T00:00:00")
+        hek = Hek_Service(event_starttime=x, event_endtime=y)
+        hek.submit_request()
+        hek.save_data()
+        self.assertEqual(
+            Service_Request.get_by_id(hek.service_request_id).fingerprint,
+            hek.fingerprint,
+        )
+
+        # The same search is not sent again, its events are loaded, and it is saved to the same request
+        same = Hek_Service(event_endtime=y, event_starttime=x)
+        self.assertEqual(same.fingerprint, hek.fingerprint)
+        same.submit_request()
+        self.assertEqual(same.windows_issued, 0)
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertEqual(
+            sorted(e.event_id for e in same.data), sorted(e.event_id for e in hek.data)
+        )
+        same.save_request()
+        self.assertEqual(same.service_request_id, hek.service_request_id)
+        self.assertEqual(Service_Request.select().count(), 1)
+
+        other = Hek_Service(event_starttime=x, event_endtime=y, event_type=["fl"])
+        self.assertNotEqual(other.fingerprint, hek.fingerprint)
+
+    @test_db()
+    @mock.patch("requests.Session.get", side_effect=mock_get_json(load_responses()))
+    def test_duplicate_not_saved(self, mock_get):
+        x, y = ("2010-06-01T00:00:00", "2010-07-01T00:00:00")
+        hek = Hek_Service(event_starttime=x, event_endtime=y)
+        hek.submit_request()
+        hek.save_request()
+
+        # The first search did not save its events, so the second one searches again
+        same = Hek_Service(event_starttime=x, event_endtime=y)
+        same.submit_request()
+        self.assertEqual(mock_get.call_count, 2)
+        self.assertEqual(len(same.data), 8)
+
+    @test_db()
+    @mock.patch("requests.Session.get", side_effect=mock_get_json(load_responses()))
+    def test_stream(self, mock_get):
+        x, y = ("2010-06-01T00:00:00", "2010-07-01T00:00:00")
+        hek = Hek_Service(event_starttime=x, event_endtime=y)
+        events = list(hek.iter_events())
+        self.assertEqual(len(events), 8)
+        self.assertEqual(events[0].sol_standard, "SOL2010-06-04T09:21:47L246C049")
+        self.assertEqual(hek.data, [])
+        self.assertEqual(hek.for_testing_data["result"], [])
+        self.assertTrue(mock_get.call_args[1]["stream"])
+
+        hek = Hek_Service(event_starttime=x, event_endtime=y)
+        self.assertEqual(hek.save_stream(chunk_size=3), 8)
+        self.assertEqual(Hek_Event.select().count(), 8)
+
+    @test_db()
+    def test_limit_reached(self):
+        params, page = load_responses()[0]
+        x, y = ("2010-06-01T00:00:00", "2010-06-01T01:00:00")
+        result = [
+            dict(raw, SOL_standard=f"SOL{i}") for i, raw in enumerate(page["result"][:3])
+        ]
+        responses = [
+            (
+                dict(params, event_starttime=x, event_endtime=y),
+                dict(page, result=result),
+            )
+        ]
+        limit = Config.hek.result_limit
+        Config.hek.result_limit = 3
+        try:
+            with mock.patch(
+                "requests.Session.get", side_effect=mock_get_json(responses)
+            ):
+                hek = Hek_Service(event_starttime=x, event_endtime=y)
+                hek.submit_request()
+        finally:
+            Config.hek.result_limit = limit
+        # The events are kept, but the window is not covered
+        self.assertEqual(len(hek.data), 3)
+        self.assertEqual(hek.failures[0].key, (x, y))
+        self.assertEqual(hek.failures[0].stage, "truncated")
+        hek.save_data()
+        self.assertEqual(len(hek.find_gaps()), 1)
+
+    @test_db()
+    def test_stream_closed(self):
+        params, page = load_responses()[0]
+        raw = page["result"][0]
+
+        def get(*args, **kwargs):
+            # One event in each window
+            start = kwargs["params"]["event_starttime"]
+            result = [dict(raw, SOL_standard=f"SOL{start}")]
+            return mock_get_json([(kwargs["params"], dict(page, result=result))])(
+                *args, **kwargs
+            )
+
+        days = (Config.hek.interval_days, Config.hek.max_interval_days)
+        Config.hek.interval_days, Config.hek.max_interval_days = 1, 1
+        try:
+            with mock.patch("requests.Session.get", side_effect=get) as mock_get:
+                hek = Hek_Service(
+                    event_starttime="2000-01-01T00:00:00",
+                    event_endtime="2010-01-01T00:00:00",
+                )
+                events = hek.iter_events(max_workers=1)
+                next(events)
+                events.close()
+                sent = mock_get.call_count
+                time.sleep(0.5)
+                self.assertEqual(mock_get.call_count, sent)
+        finally:
+            Config.hek.interval_days, Config.hek.max_interval_days = days
+        self.assertLess(sent, 10)
+        self.assertEqual(hek.covered, [])
+
+    @test_db()
+    @mock.patch("requests.Session.get", side_effect=mock_get_json(load_responses()))
+    def test_stream_seen(self, mock_get):
+        x, y = ("2010-06-01T00:00:00", "2010-07-01T00:00:00")
+        stream_seen = Config.hek.stream_seen
+        Config.hek.stream_seen = 3
+        try:
+            hek = Hek_Service(event_starttime=x, event_endtime=y)
+            events = [e.event_id for e in hek.iter_events()]
+        finally:
+            Config.hek.stream_seen = stream_seen
+        self.assertEqual(len(events), 8)
+        self.assertEqual(len(set(events)), 8)
+
     @test_db()
     def test_save_requests(self):
         h = Hek_Service()
@@ -48,8 +257,8 @@ class TestHek(unittest.TestCase):
             Hek_Event(event_id="asdfnadfsoos"),
         ]
 
-        h._data = events
-        self.assertEqual(len(h._data), 4)
+        h.data = events
+        self.assertEqual(len(h.data), 4)
 
         h.save_data()
         self.assertEqual(len(Hek_Event.select()), 4)
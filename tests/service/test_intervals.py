@@ -0,0 +1,69 @@
+from solar.service.intervals import Interval_Planner
+from datetime import datetime, timedelta
+import unittest
+
+
+class TestIntervalPlanner(unittest.TestCase):
+
+    """Test case docstring."""
+
+    def setUp(self):
+        self.start = datetime(2010, 1, 1)
+        self.end = datetime(2011, 1, 1)
+
+    def tearDown(self):
+        pass
+
+    def run_planner(self, planner, counter):
+        covered = []
+        while planner.has_next():
+            window = planner.next_window()
+            if planner.report(window, counter(*window)) == Interval_Planner.COMPLETE:
+                covered.append(window)
+        return sorted(covered)
+
+    def assertCovers(self, windows):
+        self.assertEqual(windows[0][0], self.start)
+        self.assertEqual(windows[-1][1], self.end)
+        for (_, end), (start, _) in zip(windows, windows[1:]):
+            self.assertEqual(end, start)
+
+    def test_split(self):
+        # 10 events a day, so a 60 day window returns more than the limit
+        def counter(start, end):
+            return min(100, int((end - start) / timedelta(days=1) * 10))
+
+        planner = Interval_Planner(self.start, self.end, days=60, limit=100)
+        windows = self.run_planner(planner, counter)
+        self.assertCovers(windows)
+        self.assertGreater(planner.splits, 0)
+        for start, end in windows:
+            self.assertLess(counter(start, end), 100)
+
+    def test_merge_sparse(self):
+        planner = Interval_Planner(self.start, self.end, days=30, limit=100)
+        windows = self.run_planner(planner, lambda start, end: 0)
+        self.assertCovers(windows)
+        self.assertEqual(planner.splits, 0)
+        self.assertEqual(planner.issued, 2)
+
+    def test_truncated(self):
+        planner = Interval_Planner(
+            self.start, self.start + timedelta(days=4), days=4, limit=None
+        )
+        window = planner.next_window()
+        self.assertEqual(
+            planner.report(window, 10, truncated=True), Interval_Planner.SPLIT
+        )
+        self.assertEqual(
+            planner.next_window(), (self.start, self.start + timedelta(days=2))
+        )
+
+    def test_too_short(self):
+        planner = Interval_Planner(
+            self.start, self.start + timedelta(hours=1), days=1, limit=100
+        )
+        window = planner.next_window()
+        self.assertEqual(planner.report(window, 100), Interval_Planner.TRUNCATED)
+        self.assertEqual(planner.truncations, 1)
+        self.assertFalse(planner.has_next())
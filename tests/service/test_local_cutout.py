@@ -0,0 +1,167 @@
+from solar.service.local_cutout import (
+    Local_Cutout_Service,
+    find_full_disk,
+    crop_fits,
+    local_cutouts,
+)
+from solar.service import local_cutout
+from solar.database.tables.service_request import Service_Request
+from solar.service.cutout import Cutout_Size
+from solar.service.attribute import Attribute as Att
+from solar.database.tables.fits_file import Fits_File
+from solar.database.tables.hek_event import Hek_Event
+from solar.common.config import Config
+from astropy.io import fits
+from datetime import datetime, timedelta
+from pathlib import Path
+import numpy as np
+import tempfile
+import unittest
+from unittest import mock
+from tests.utils import test_db
+
+
+def full_disk(path, time, wave, compressed=False):
+    """
+    A small fake full-disk image, 1 arcsec per pixel, with the sun center at pixel (50, 50).
+    The value of each pixel is 1000 * y + x
+    """
+    y, x = np.mgrid[0:100, 0:100]
+    data = (1000 * y + x).astype(np.int32)
+    header = fits.Header()
+    header["DATE-OBS"] = time.strftime(Config.time_format.fits)
+    header["WAVELNTH"] = wave
+    header["CTYPE1"], header["CTYPE2"] = "HPLN-TAN", "HPLT-TAN"
+    header["CUNIT1"], header["CUNIT2"] = "arcsec", "arcsec"
+    header["CRPIX1"], header["CRPIX2"] = 51.0, 51.0
+    header["CRVAL1"], header["CRVAL2"] = 0.0, 0.0
+    header["CDELT1"], header["CDELT2"] = 1.0, 1.0
+    if compressed:
+        hdul = fits.HDUList(
+            [fits.PrimaryHDU(), fits.CompImageHDU(data, header=header)]
+        )
+    else:
+        hdul = fits.HDUList([fits.PrimaryHDU(data, header=header)])
+    hdul.writeto(path)
+
+
+class TestLocalCutout(unittest.TestCase):
+
+    """Test case docstring."""
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.db_save = Config.db_save
+        Config.db_save = self.dir.name
+        root = Path(self.dir.name) / Config.local_cutout.path
+        root.mkdir()
+        self.start = datetime(2012, 1, 1)
+        for i in range(6):
+            t = self.start + timedelta(minutes=i)
+            full_disk(root / f"aia_304_{i}.fits", t, 304, compressed=i % 2 == 1)
+            full_disk(root / f"aia_171_{i}.fits", t, 171)
+
+    def tearDown(self):
+        Config.db_save = self.db_save
+        self.dir.cleanup()
+
+    def test_find(self):
+        end = self.start + timedelta(minutes=2)
+        found = find_full_disk(self.start, end, [304])
+        self.assertEqual(
+            [p.name for p, _, _ in found], [f"aia_304_{i}.fits" for i in range(3)]
+        )
+        self.assertEqual(len(find_full_disk(self.start, end)), 6)
+
+    def test_index(self):
+        end = self.start + timedelta(minutes=10)
+        self.assertEqual(len(find_full_disk(self.start, end)), 12)
+        with mock.patch.object(local_cutout.os, "walk") as walk:
+            self.assertEqual(len(find_full_disk(self.start, end, [171])), 6)
+        walk.assert_not_called()
+
+        root = Path(self.dir.name) / Config.local_cutout.path
+        (root / "new").mkdir()
+        full_disk(root / "new" / "aia_171_9.fits", self.start, 171)
+        with mock.patch.object(
+            local_cutout, "_read_info", wraps=local_cutout._read_info
+        ) as read:
+            self.assertEqual(len(find_full_disk(self.start, end, [171])), 7)
+            full_disk(root / "new" / "aia_171_10.fits", self.start, 171)
+            self.assertEqual(len(find_full_disk(self.start, end, [171])), 8)
+        # Only the new files are read
+        self.assertEqual(read.call_count, 2)
+
+    def test_crop(self):
+        root = Path(self.dir.name) / Config.local_cutout.path
+        for name in ["aia_304_0.fits", "aia_304_1.fits"]:
+            dest = Path(self.dir.name) / "out" / name
+            self.assertEqual(crop_fits(root / name, dest, -10, 10, 20, 30), (10, 20))
+            with fits.open(dest) as hdul:
+                data, header = hdul[0].data, hdul[0].header
+                self.assertEqual(data[0, 0], 1000 * 70 + 40)
+                self.assertEqual(header["CRPIX1"], 11)
+                self.assertEqual(header["CRPIX2"], -19)
+                self.assertEqual(header["WAVELNTH"], 304)
+        self.assertIsNone(crop_fits(root / name, dest, 500, 600, 500, 600))
+
+    @test_db()
+    def test_event(self):
+        event = Hek_Event.create(
+            event_id="local",
+            start_time=self.start,
+            end_time=self.start + timedelta(minutes=5),
+            hpc_x=0,
+            hpc_y=0,
+            x_min=-10,
+            x_max=10,
+            y_min=-10,
+            y_max=10,
+        )
+        size = Cutout_Size(cadence=60, frame_budget=3)
+        c = Local_Cutout_Service._from_event(event, size=size)
+        c.params.append(Att("waves", [304, 171]))
+        self.assertTrue(c.fetch_data())
+        c.save_data()
+
+        self.assertEqual(len(c.data), 6)
+        self.assertEqual(Fits_File.select().count(), 6)
+        self.assertEqual({f.channel for f in c.data}, {171, 304})
+        f = Fits_File.get(Fits_File.channel == 171)
+        self.assertTrue(f.check_integrity())
+        self.assertEqual(f["wavelnth"], 171)
+        self.assertEqual(f.request.service_type, "local_cutout")
+        with fits.open(f.file_path) as hdul:
+            self.assertEqual(hdul[0].data.shape, (100, 100))
+
+        # Making the same cutouts again reuses the rows
+        c.fetch_data()
+        c.save_data()
+        self.assertEqual(Fits_File.select().count(), 6)
+
+        loaded = Local_Cutout_Service._from_model(Service_Request.get())
+        self.assertIsInstance(loaded, Local_Cutout_Service)
+        self.assertEqual(loaded.job_id, c.job_id)
+        self.assertEqual([e.event_id for e in loaded.events], ["local"])
+
+    @test_db()
+    def test_many_events(self):
+        events = [
+            Hek_Event.create(
+                event_id=f"local_{i}",
+                start_time=self.start + timedelta(minutes=i),
+                end_time=self.start + timedelta(minutes=i + 2),
+                hpc_x=10 * i,
+                hpc_y=0,
+                x_min=10 * i - 5,
+                x_max=10 * i + 5,
+                y_min=-5,
+                y_max=5,
+            )
+            for i in range(3)
+        ]
+        reqs = local_cutouts(events, size=Cutout_Size(cadence=60, frame_budget=3))
+        self.assertEqual([c.event.event_id for c in reqs], [e.event_id for e in events])
+        self.assertTrue(all(c.status == "completed" and c.data for c in reqs))
+        self.assertEqual(Service_Request.select().count(), 3)
+        self.assertEqual(Fits_File.select().count(), sum(len(c.data) for c in reqs))
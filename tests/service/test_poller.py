@@ -0,0 +1,103 @@
+from solar.service.poller import Cutout_Poller
+from solar.service.request import Base_Service
+from solar.service.client import Circuit_Open
+from requests.exceptions import ConnectionError
+import unittest
+
+
+class Fake_Job(Base_Service):
+    def __init__(self, polls_needed, job_id=None, errors=()):
+        self.job_id = job_id
+        self.polls_needed = polls_needed
+        self.errors = list(errors)
+        self.polls = 0
+        self.status = "submitted" if job_id else "unsubmitted"
+        self.failures = []
+
+    def submit_request(self, auto_save=True):
+        self.job_id = "job"
+        self.status = "submitted"
+        return True
+
+    def check_status(self):
+        error = self.errors.pop(0) if self.errors else None
+        if isinstance(error, Exception):
+            raise error
+        if error:
+            raise ConnectionError("down")
+        self.polls += 1
+        return self.polls >= self.polls_needed
+
+    def fetch_file_list(self):
+        self.status = "completed"
+        return True
+
+
+class TestPoller(unittest.TestCase):
+
+    """Test case docstring."""
+
+    def setUp(self):
+        self.poller = Cutout_Poller(max_workers=4, min_delay=0, max_delay=0)
+
+    def tearDown(self):
+        pass
+
+    def test_many_jobs(self):
+        jobs = [Fake_Job(i % 3 + 1) for i in range(50)]
+        submitted = []
+        completed = []
+        self.poller.on_submit = submitted.append
+        self.poller.on_complete = completed.append
+        for j in jobs:
+            self.poller.add(j)
+        self.assertEqual(len(self.poller), 50)
+
+        finished = self.poller.run()
+
+        self.assertEqual(len(finished), 50)
+        self.assertEqual(len(submitted), 50)
+        self.assertEqual(len(completed), 50)
+        self.assertEqual(self.poller.completed.qsize(), 50)
+        self.assertEqual(len(self.poller), 0)
+        self.assertTrue(all(j.status == "completed" for j in jobs))
+
+    def test_errors(self):
+        flaky = Fake_Job(1, job_id="flaky", errors=[True, True, False])
+        broken = Fake_Job(1, job_id="broken", errors=[True] * 10)
+        self.poller.add(flaky)
+        self.poller.add(broken)
+        self.poller.run()
+
+        self.assertEqual(self.poller.finished, [flaky])
+        self.assertEqual(self.poller.failed, [broken])
+        self.assertEqual(broken.failures[0].stage, "poll")
+
+    def test_paused(self):
+        paused = [Circuit_Open("paused", retry_after=0.01)] * 10
+        job = Fake_Job(1, job_id="paused", errors=paused)
+        self.poller.add(job)
+        self.poller.run()
+
+        self.assertEqual(self.poller.finished, [job])
+        self.assertEqual(job.failures, [])
+
+        late = Fake_Job(1, job_id="late", errors=[Circuit_Open("paused", retry_after=60)])
+        self.poller.add(late, deadline=1)
+        self.poller.run()
+        self.assertEqual(self.poller.failed, [late])
+
+    def test_deadline(self):
+        never = Fake_Job(10 ** 9, job_id="never")
+        self.poller.add(never, deadline=0.05)
+        self.poller.run()
+
+        self.assertEqual(self.poller.failed, [never])
+        self.assertEqual(never.failures[0].stage, "deadline")
+        self.assertEqual(never.status, "submitted")
+
+    def test_delay(self):
+        poller = Cutout_Poller(min_delay=10, max_delay=300, backoff=0.1)
+        self.assertEqual(poller.delay(0), 10)
+        self.assertEqual(poller.delay(1000), 100)
+        self.assertEqual(poller.delay(10 ** 6), 300)
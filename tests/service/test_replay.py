@@ -0,0 +1,59 @@
+from solar.service.hek import Hek_Service
+from solar.database.tables.hek_event import Hek_Event
+from solar.common.config import Config
+from tests.utils import test_db
+from .replay import Hek_Replay_Server
+from datetime import datetime
+import unittest
+
+
+class TestHekReplay(unittest.TestCase):
+
+    """Run Hek_Service against the local replay server."""
+
+    def setUp(self):
+        self.old_backoff = Config.http.backoff
+        self.old_limit = Config.hek.result_limit
+        Config.http.backoff = 0
+
+    def tearDown(self):
+        Config.http.backoff = self.old_backoff
+        Config.hek.result_limit = self.old_limit
+
+    def search(self, server, x, y, **kwargs):
+        hek = Hek_Service(event_starttime=x, event_endtime=y)
+        hek.base_url = server.url
+        hek.submit_request(**kwargs)
+        return hek
+
+    @test_db()
+    def test_recorded(self):
+        with Hek_Replay_Server() as server:
+            hek = self.search(server, "2010-06-01T00:00:00", "2010-07-01T00:00:00")
+        self.assertEqual(len(hek.data), 8)
+
+    @test_db()
+    def test_limit(self):
+        Config.hek.result_limit = 50
+        x, y = "2012-01-01T00:00:00", "2012-04-01T00:00:00"
+        with Hek_Replay_Server(rate=5, limit=50) as server:
+            hek = self.search(server, x, y)
+            expected = server.expected_events(
+                datetime(2012, 1, 1), datetime(2012, 4, 1)
+            )
+        self.assertEqual(len(hek.data), expected)
+        self.assertGreater(hek.windows_issued, 1)
+        hek.save_data()
+        self.assertEqual(Hek_Event.select().count(), expected)
+
+    @test_db()
+    def test_errors(self):
+        x, y = "2012-01-01T00:00:00", "2013-01-01T00:00:00"
+        with Hek_Replay_Server(rate=1, error_rate=0.3, seed=3) as server:
+            hek = self.search(server, x, y, max_workers=3)
+            expected = server.expected_events(
+                datetime(2012, 1, 1), datetime(2013, 1, 1)
+            )
+            self.assertGreater(server.errors, 0)
+        self.assertEqual(hek.failures, [])
+        self.assertEqual(len(hek.data), expected)
@@ -0,0 +1,47 @@
+from solar.service.stream import Json_Array_Reader
+import unittest
+import json
+
+
+def chunked(text, size):
+    data = text.encode("utf-8")
+    return [data[i : i + size] for i in range(0, len(data), size)]
+
+
+class TestJsonArrayReader(unittest.TestCase):
+
+    """Test case docstring."""
+
+    def setUp(self):
+        self.doc = {
+            "overmax": True,
+            "result": [{"a": 1, "b": "é[]"}, 12345, [1, 2], {"c": {"d": None}}],
+            "extra": "x",
+        }
+
+    def tearDown(self):
+        pass
+
+    def test_chunks(self):
+        text = json.dumps(self.doc)
+        for size in [1, 2, 7, 1000]:
+            reader = Json_Array_Reader(chunked(text, size))
+            self.assertEqual(list(reader), self.doc["result"])
+            self.assertEqual(reader.count, 4)
+            self.assertTrue(reader.flag("overmax"))
+            self.assertFalse(reader.flag("missing"))
+
+    def test_flag_after(self):
+        text = json.dumps({"result": [], "overmax": False})
+        reader = Json_Array_Reader(chunked(text, 3))
+        self.assertEqual(list(reader), [])
+        self.assertFalse(reader.flag("overmax"))
+
+    def test_missing(self):
+        reader = Json_Array_Reader(chunked(json.dumps({"other": [1]}), 4))
+        self.assertEqual(list(reader), [])
+
+    def test_truncated(self):
+        text = json.dumps(self.doc)[:40]
+        with self.assertRaises(ValueError):
+            list(Json_Array_Reader(chunked(text, 5)))
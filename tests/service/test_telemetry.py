@@ -0,0 +1,150 @@
+from solar.service.cutout import Cutout_Service
+from solar.service.telemetry import latency_report, percentile
+from solar.database.tables.service_request import Service_Request
+from solar.database.tables.service_stage import Service_Stage
+from solar.database.tables.fits_file import Fits_File
+from solar.common.utils import checksum
+from pathlib import Path
+import tempfile
+from datetime import datetime, timedelta
+from tests.service.test_cutout import mock_ssw
+import unittest
+from unittest import mock
+from tests.utils import test_db
+
+
+class TestTelemetry(unittest.TestCase):
+
+    """Test case docstring."""
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([3], 90), 3)
+        self.assertEqual(percentile([1, 2, 3, 4, 5], 50), 3)
+        self.assertEqual(percentile([1, 2, 3, 4, 5], 90), 5)
+        self.assertEqual(percentile([1, 2, 3], 0), 1)
+        self.assertEqual(percentile([1, 2, 3], 34), 2)
+        self.assertIsNone(percentile([], 50))
+
+    @test_db()
+    @mock.patch("requests.Session.get", side_effect=mock_ssw(["ssw_ready"]))
+    def test_stages_saved(self, get):
+        c = Cutout_Service(fovx=200)
+        c.job_id = "ssw_ready"
+        c._mark_stage("submitted")
+        c.status = "submitted"
+        c.save_request()
+        self.assertTrue(c.check_status())
+        self.assertTrue(c.fetch_file_list())
+        c.save_request()
+
+        stages = {
+            s.stage: s.time
+            for s in Service_Stage.select().where(
+                Service_Stage.service_request == c.service_request_id
+            )
+        }
+        self.assertEqual(
+            set(stages), {"created", "submitted", "first_poll", "ready", "listed"}
+        )
+        self.assertLessEqual(stages["submitted"], stages["ready"])
+
+        # A stage keeps the time it was first reached
+        first = stages["created"]
+        c.stage_times["created"] = first + timedelta(days=1)
+        c.save_request()
+        self.assertEqual(
+            Service_Stage.get(
+                Service_Stage.service_request == c.service_request_id,
+                Service_Stage.stage == "created",
+            ).time,
+            first,
+        )
+
+    @test_db()
+    def test_report(self):
+        start = datetime(2020, 1, 1)
+        for i in range(10):
+            req = Service_Request.create(
+                service_type="cutout", status="completed", job_id=str(i)
+            )
+            Service_Stage.record(
+                [
+                    (req.id, "created", start),
+                    (req.id, "submitted", start),
+                    (req.id, "ready", start + timedelta(seconds=10 * (i + 1))),
+                    (req.id, "listed", start + timedelta(days=i % 2, seconds=200)),
+                ]
+            )
+        hek = Service_Request.create(service_type="hek", status="completed")
+        Service_Stage.record(
+            [
+                (hek.id, "submitted", start),
+                (hek.id, "completed", start + timedelta(seconds=5)),
+            ]
+        )
+
+        report = latency_report()
+        cutout = report["cutout"]
+        self.assertEqual(cutout["requests"], 10)
+        self.assertEqual(cutout["spans"]["queue"]["count"], 10)
+        self.assertEqual(cutout["spans"]["queue"]["p50"], 50)
+        self.assertEqual(cutout["spans"]["queue"]["p99"], 100)
+        self.assertEqual(
+            cutout["per_day"], {start.date(): 5, (start + timedelta(days=1)).date(): 5}
+        )
+        self.assertEqual(report["hek"]["spans"]["search"]["p90"], 5)
+
+        self.assertEqual(list(latency_report("hek")), ["hek"])
+        self.assertEqual(latency_report(since=datetime(2021, 1, 1)), {})
+        late = Service_Request.create(service_type="hek", status="completed")
+        Service_Stage.record([(late.id, "submitted", datetime(2021, 6, 1))])
+        self.assertEqual(latency_report(since=datetime(2021, 1, 1))["hek"]["requests"], 1)
+
+    @test_db()
+    def test_downloaded_all(self):
+        req = Service_Request.create(service_type="cutout", status="completed")
+        with tempfile.TemporaryDirectory() as root:
+            for i in range(2):
+                Fits_File.create(
+                    request=req,
+                    server_full_path=f"http://x/{i}.fits",
+                    file_path=str(Path(root) / f"{i}.fits"),
+                )
+
+            def download(reachable):
+                def downloader(urls):
+                    ret = {}
+                    for url, path in urls.items():
+                        if url in reachable:
+                            Path(path).write_bytes(b"data")
+                            ret[url] = checksum(path)
+                    return ret
+
+                return downloader
+
+            with mock.patch(
+                "solar.database.tables.fits_file.multi_downloader",
+                side_effect=download(["http://x/0.fits"]),
+            ):
+                Fits_File.update_table(update_headers=False)
+            self.assertEqual([s.stage for s in req.stages], [])
+
+            with mock.patch(
+                "solar.database.tables.fits_file.multi_downloader",
+                side_effect=download(["http://x/0.fits", "http://x/1.fits"]),
+            ) as downloader:
+                Fits_File.update_table(update_headers=False)
+            self.assertEqual(list(downloader.call_args[0][0]), ["http://x/1.fits"])
+            self.assertEqual([s.stage for s in req.stages], ["downloaded"])
+
+if __name__ == "__main__":
+    unittest.main()
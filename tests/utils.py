@@ -2,6 +2,7 @@ from functools import wraps
 from peewee import SqliteDatabase
 from solar.database.tables import tables
 import requests
+import json
 
 table_tuple = tuple(tables)
 
@@ -34,6 +35,11 @@ def mock_get_json(param_resp_tuples):
             def json(self):
                 return self.json_data
 
+            def iter_content(self, chunk_size=1, decode_unicode=False):
+                text = json.dumps(self.json_data).encode("utf-8")
+                for i in range(0, len(text), chunk_size):
+                    yield text[i : i + chunk_size]
+
         found = [x for x in param_resp_tuples if x[0] == kwargs["params"]]
         if found:
             return MockResponse(found[0][1], 200)